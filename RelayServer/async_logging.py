@@ -0,0 +1,180 @@
+# Non-blocking logging of the relay server. All log records go through a bounded queue to a background writer thread,
+# which formats them and writes them to the rotating log file and the console, so a slow disk or terminal never delays
+# an answer: logging a record is a put into the queue, and records are dropped (and counted) if the writer cannot keep
+# up. Records are only formatted on the writer thread, except for tracebacks, which refer to the frames of the caller.
+# RequestLog writes one structured json line per request to a separate file: the trace of every request, and for a
+# sampled share of the requests also the payload, retrieved context, prompt and answers. These are only referenced on
+# the request path; truncation of long fields, redaction and serialization happen on the writer thread.
+
+import atexit
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import numpy as np
+
+QUEUE_SIZE = 10000
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+MAX_LOG_BYTES = 10*1024*1024
+LOG_BACKUP_COUNT = 5
+REQUEST_LOGGER_NAME = "relay.requests"
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the logging thread, records that do not fit into the queue are dropped
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        if record.exc_info:
+            return super().prepare(record)  # renders the traceback now, it is gone once the caller returns
+        return record
+
+
+class RequestRecordFilter(logging.Filter):
+    # passes only the records of RequestLog (or only the other records, with requests=False)
+    def __init__(self, requests=True):
+        super().__init__()
+        self.requests = requests
+
+    def filter(self, record):
+        return hasattr(record, "request_record") == self.requests
+
+
+def json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def truncate(value, max_chars):
+    # strings longer than max_chars (also inside lists and dicts) are cut, with the number of removed characters
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return value[:max_chars] + f"...[{len(value) - max_chars} more characters]"
+        return value
+    if isinstance(value, dict):
+        return {k: truncate(v, max_chars) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(v, max_chars) for v in value]
+    return value
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats the records of RequestLog as json lines. Runs on the writer thread.
+
+    Parameters:
+    - max_field_chars: Strings in the record are truncated to this length.
+    - redact_fields: Names of fields (e.g. "message" for the free text of the pilots) that are replaced by their length.
+    """
+    def __init__(self, max_field_chars=4000, redact_fields=()):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+        self.redact_fields = set(redact_fields)
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            return {k: f"<redacted, {len(str(v))} characters>" if k in self.redact_fields else self.redact(v)
+                    for k, v in value.items()}
+        return value
+
+    def format(self, record):
+        fields = dict(record.request_record)
+        trace = fields.pop("trace", None)
+        entry = {"time": self.formatTime(record)} | (trace.to_dict() if trace is not None else {})
+        entry |= truncate(self.redact(fields), self.max_field_chars)
+        return json.dumps(entry, default=json_default)
+
+
+class LogPipeline():
+    """
+    Queue-based logging: the root logger (and RequestLog) only put records into the queue, a QueueListener writes them.
+
+    Parameters:
+    - log_file: Rotating text log with all records from file_level on.
+    - request_log_file: Rotating json lines file of RequestLog, None to not write it.
+    - console_level: Records from this level on are also written to stderr.
+    - max_field_chars, redact_fields: See JsonLinesFormatter.
+    - queue_size: Number of records that can wait for the writer before new ones are dropped.
+    """
+    def __init__(self, log_file, request_log_file=None, file_level=logging.DEBUG, console_level=logging.INFO,
+                 max_field_chars=4000, redact_fields=(), queue_size=QUEUE_SIZE):
+        formatter = logging.Formatter(LOG_FORMAT)
+        self.file_handler = RotatingFileHandler(log_file, maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUP_COUNT)
+        self.file_handler.setLevel(file_level)
+        self.console_handler = logging.StreamHandler()
+        self.console_handler.setLevel(console_level)
+        handlers = [self.file_handler, self.console_handler]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            handler.addFilter(RequestRecordFilter(requests=False))
+        self.request_handler = None
+        if request_log_file is not None:
+            self.request_handler = RotatingFileHandler(request_log_file, maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUP_COUNT)
+            self.request_handler.setFormatter(JsonLinesFormatter(max_field_chars, redact_fields))
+            self.request_handler.addFilter(RequestRecordFilter(requests=True))
+            handlers.append(self.request_handler)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.running = False
+
+    @property
+    def dropped(self):
+        return self.queue_handler.dropped
+
+    def start(self):
+        root = logging.getLogger()
+        root.setLevel(logging.DEBUG)
+        root.addHandler(self.queue_handler)
+        request_logger = logging.getLogger(REQUEST_LOGGER_NAME)
+        request_logger.propagate = False    # json records only go to their own file
+        request_logger.addHandler(self.queue_handler)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)  # writes the records that are still in the queue
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+
+class RequestLog():
+    """
+    Structured per-request log, written by the JsonLinesFormatter of a LogPipeline.
+
+    Parameters:
+    - sample_rate: Share of the requests whose payload, context, prompt and answers are logged, the trace is logged
+      for every request.
+    """
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger(REQUEST_LOGGER_NAME)
+
+    def sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def log(self, trace, **fields):
+        """
+        Parameters:
+        - trace: Finished trace of the request.
+        - fields: Large fields of the request, e.g. payload, context, prompt, answer. Only logged if the request is
+          sampled, they must not be modified afterwards since they are serialized later on the writer thread.
+        """
+        record = {"trace": trace} | (fields if self.sampled() else {})
+        self.logger.info("request", extra={"request_record": record})
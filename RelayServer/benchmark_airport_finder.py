@@ -0,0 +1,91 @@
+# Micro-benchmark of AirportFinder.get_closest_airports against the previous implementation (deepcopy of the filtered
+# DataFrame, haversine against every airport and a full sort). Runs on the default filtered airport set and on the full
+# ./data/all_apts.csv table, and checks that both implementations return the same airports. It also compares the batch
+# query for whole trajectories against calling get_closest_airports for every point.
+# Usage: python3 benchmark_airport_finder.py [--queries 2000]
+
+import argparse
+import time
+from copy import deepcopy
+import numpy as np
+from find_airport import AirportFinder
+
+
+def legacy_get_closest_airports(af, lat1, lon1, altitude=None):
+    filtered_df = deepcopy(af.df_filtered)
+    lat_lons = af.lat_lon
+    lat1_rad, lon1_rad = np.radians(lat1), np.radians(lon1)
+    lat2_rad = np.radians(lat_lons[:, 0])
+    lon2_rad = np.radians(lat_lons[:, 1])
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+    a = np.sin(dlat / 2.0)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2.0)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    filtered_df["Distance"] = 6371.0 * c
+    filtered_df = filtered_df.sort_values(by='Distance')
+    filtered_df["In_Glidepath"] = False
+    if altitude is not None:
+        max_range = altitude * af.glide_ratio
+        filtered_df.loc[filtered_df["Distance"]<=max_range, "In_Glidepath"] = True
+        if filtered_df[filtered_df["Distance"]<=max_range].shape[0] >= af.N:
+            return filtered_df[filtered_df["Distance"]<=max_range].to_dict(orient='records')
+    return filtered_df.head(af.N).to_dict(orient='records')
+
+
+def time_per_call(fn, queries):
+    t_start = time.perf_counter()
+    results = [fn(*q) for q in queries]
+    return (time.perf_counter() - t_start) / len(queries), results
+
+
+def run(name, af, n_queries, rng):
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, n_queries)))    # uniform on the sphere
+    lons = rng.uniform(-180, 180, n_queries)
+    altitudes = rng.uniform(0, 12, n_queries)   # in km
+    for label, queries in [("without altitude", [(lat, lon) for lat, lon in zip(lats, lons)]),
+                           ("with altitude", list(zip(lats, lons, altitudes)))]:
+        t_legacy, legacy = time_per_call(lambda *q: legacy_get_closest_airports(af, *q), queries)
+        t_new, new = time_per_call(af.get_closest_airports, queries)
+        mismatches = sum(1 for l, n in zip(legacy, new)
+                         if [a["ICAO"] for a in l] != [a["ICAO"] for a in n]
+                         or not np.allclose([a["Distance"] for a in l], [a["Distance"] for a in n], atol=1e-6))
+        print(f"{name:<24} {label:<18} airports: {len(af.records):>6}  legacy: {t_legacy*1e6:>9.1f} us/call  "
+              f"index: {t_new*1e6:>8.1f} us/call  speedup: {t_legacy/t_new:>6.1f}x  mismatches: {mismatches}")
+
+
+def run_batch(name, af, n_points, rng):
+    # random walk as a stand-in for a recorded flight with one sample per second
+    lats = np.clip(40 + np.cumsum(rng.normal(0, 0.01, n_points)), -89, 89)
+    lons = -100 + np.cumsum(rng.normal(0, 0.01, n_points))
+    altitudes = np.abs(10 + np.cumsum(rng.normal(0, 0.05, n_points)))
+    t_start = time.perf_counter()
+    scalar = [af.get_closest_airports(lat, lon, alt)[:af.N] for lat, lon, alt in zip(lats, lons, altitudes)]
+    t_scalar = time.perf_counter() - t_start
+    t_start = time.perf_counter()
+    indices, distances, in_glidepath = af.get_closest_airports_batch(lats, lons, altitudes)
+    t_batch = time.perf_counter() - t_start
+    mismatches = sum(1 for i, s in enumerate(scalar)
+                     if [a["ICAO"] for a in s] != [af.records[j]["ICAO"] for j in indices[i]]
+                     or [a["Distance"] for a in s] != list(distances[i])
+                     or [a["In_Glidepath"] for a in s] != list(in_glidepath[i]))
+    print(f"{name:<24} batch of {n_points} points  scalar: {t_scalar:.3f} s  batch: {t_batch:.3f} s  "
+          f"speedup: {t_scalar/t_batch:.1f}x  mismatches: {mismatches}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the nearest airport search")
+    parser.add_argument("--queries", type=int, default=2000, help="number of random query positions")
+    parser.add_argument("--trajectory", type=int, default=3600, help="number of points of the simulated trajectory")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    filtered = AirportFinder("./data/all_apts.csv", "./data/metars.csv")
+    full = AirportFinder("./data/all_apts.csv", "./data/metars.csv", min_runway_length_ft=0, apt_types=("C", "P", "M", "J"))
+    run("filtered (default)", filtered, args.queries, rng)
+    run("full all_apts.csv", full, args.queries, rng)
+    run_batch("filtered (default)", filtered, args.trajectory, rng)
+    run_batch("full all_apts.csv", full, args.trajectory, rng)
+
+
+if __name__ == "__main__":
+    main()
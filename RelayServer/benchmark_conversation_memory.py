@@ -0,0 +1,80 @@
+# Size of the conversation history that is sent with the text entry follow-ups, without and with the conversation
+# memory. The history starts with the flight-data prompt of the alert in mock_xp_plugin.py, followed by synthetic
+# follow-up questions and answers. The summaries are made by a stub with a fixed latency instead of the LLM, so this runs
+# offline. Reports the tokens of the history per turn and the share of it that is the same prefix as in the previous
+# turn, which a provider with prompt caching can reuse.
+# Usage: python3 benchmark_conversation_memory.py [--turns 40] [--budget 6000] [--summary-latency 0.5]
+
+import argparse
+import random
+import time
+import main
+from conversation_memory import ConversationMemory, message_tokens
+from mock_xp_plugin import DATA
+
+WORDS = ["engine", "fire", "thrust", "idle", "agent", "discharge", "land", "runway", "diversion", "fuel", "weather",
+         "approach", "gear", "flaps", "speed", "altitude", "checklist", "ECAM", "QRH", "crosswind", "METAR", "KMIA"]
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def prefix_tokens(previous, history):
+    # tokens of the messages at the start of history that were sent the same way in the previous turn
+    tokens = 0
+    for old, new in zip(previous, history):
+        if old != new:
+            break
+        tokens += message_tokens(new)
+    return tokens
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="History size of the text entry follow-ups")
+    parser.add_argument("--turns", type=int, default=40, help="number of follow-up questions")
+    parser.add_argument("--budget", type=int, default=main.HISTORY_TOKEN_BUDGET, help="token budget of the memory")
+    parser.add_argument("--summary-latency", type=float, default=0.5, help="latency of the stub summarizer in s")
+    parser.add_argument("--turn-interval", type=float, default=0.1, help="time between two follow-ups in s")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    prompt = main.format_prompt(DATA)
+    answer = text(rng, 120)
+
+    summary_rng = random.Random(1)
+
+    def summarize(messages):
+        time.sleep(args.summary_latency)
+        return text(summary_rng, 80)
+
+    unbounded = [{"role": "user", "content": prompt}, {"role": "assistant", "content": answer}]
+    memory = ConversationMemory(args.budget)
+    memory.reset(prompt, answer)
+    previous = {"unbounded": [], "memory": []}
+    totals = {"unbounded": [0, 0], "memory": [0, 0]}    # tokens sent, tokens of a reused prefix
+    print(f"{'turn':>4} | {'unbounded':>9} | {'memory':>6} | {'memory prefix':>13}")
+    for turn in range(1, args.turns + 1):
+        for name, history in [("unbounded", list(unbounded)), ("memory", memory.messages())]:
+            tokens = sum(message_tokens(m) for m in history)
+            reused = prefix_tokens(previous[name], history)
+            totals[name][0] += tokens
+            totals[name][1] += reused
+            previous[name] = history
+            if name == "unbounded":
+                row = f"{turn:>4} | {tokens:>9} | "
+            else:
+                row += f"{tokens:>6} | {reused / tokens:>12.0%}"
+        if turn % 5 == 0 or turn == 1:
+            print(row)
+        question, answer = text(rng, 15), text(rng, rng.randint(60, 200))
+        unbounded += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        memory.add_turn(question, answer, summarize=summarize)
+        time.sleep(args.turn_interval)
+    for name, (tokens, reused) in totals.items():
+        print(f"{name}: {tokens} history tokens sent in {args.turns} turns, {reused / tokens:.0%} of them in a reused prefix")
+    print(f"{memory.summaries} summaries")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,120 @@
+# Time that logging adds to a request on the thread that answers it, with the previous synchronous logging (payload,
+# context, prompt and answers printed, trace written by a file handler) and with the queue-based logging of
+# async_logging.py. The "disk" is a stream that sleeps on every write, to show what happens when it is slow. The
+# request contents are the flight data of mock_xp_plugin.py and synthetic context and answers.
+# Usage: python3 benchmark_logging.py [--requests 200] [--write-latency 0.002]
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+from async_logging import LogPipeline, RequestLog, LOG_FORMAT
+from mock_xp_plugin import DATA
+from tracing import Trace
+
+CONTEXT = "ENG 1(2) FIRE\n- THR LEVER (AFFECTED ENG)....IDLE\n- ENG MASTER (AFFECTED)....OFF\n" * 100
+PROMPT = "Given the following flight data and ECAM messages for an A320, what are the immediate next steps? " * 40
+RESPONSE = "Land at the nearest suitable airport. " * 60
+ANSWER = "LAND ASAP. Discharge agent 2 if fire persists after 30 s. " * 5
+
+
+class SlowStream():
+    # a file whose writes take write_latency seconds
+    def __init__(self, write_latency):
+        self.write_latency = write_latency
+        self.bytes = 0
+
+    def write(self, text):
+        time.sleep(self.write_latency)
+        self.bytes += len(text)
+
+    def flush(self):
+        pass
+
+    def seek(self, offset, whence=0):
+        return self.bytes   # RotatingFileHandler checks the file size before every record
+
+    def tell(self):
+        return self.bytes
+
+
+def make_trace():
+    trace = Trace("0" * 32, time.perf_counter())
+    trace.trigger_source = "alert"
+    for name in ["decode", "queue", "retrieval_vector", "retrieval_bm25", "prompt", "generation", "send"]:
+        trace.add(name, time.perf_counter())
+    trace.total_s = time.perf_counter() - trace.t_received
+    trace.first_token_s = trace.total_s
+    return trace
+
+
+def synchronous_request(logger, stream, trace):
+    # what the relay did before: prints on the request path and the trace through a synchronous handler
+    print("----------------------MESSAGE RECEIVED----------------------", file=stream)
+    print(DATA, file=stream)
+    print("\nContext used:", file=stream)
+    print(CONTEXT, file=stream)
+    print(f"\nQuestion: {PROMPT}", file=stream)
+    print(f"\nLong Answer: {RESPONSE}", file=stream)
+    print(f"\nShort Answer: {ANSWER}", file=stream)
+    logger.info(f"Request {trace.request_id}: time to last token {trace.total_s:.3f} s")
+    logger.debug(f"Trace: {trace.to_json()}")
+
+
+def queued_request(logger, request_log, trace):
+    logger.info(f"Request {trace.request_id}: time to last token {trace.total_s:.3f} s")
+    request_log.log(trace, payload=DATA, context=CONTEXT, prompt=PROMPT, response=RESPONSE, answer=ANSWER)
+
+
+def measure(log_request, requests):
+    durations = []
+    for _ in range(requests):
+        trace = make_trace()
+        t_start = time.perf_counter()
+        log_request(trace)
+        durations.append(time.perf_counter() - t_start)
+        time.sleep(0.001)   # requests do not arrive back to back
+    return np.array(durations)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Latency that logging adds to a request")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--write-latency", type=float, default=0.002, help="duration of every write to the disk in s")
+    parser.add_argument("--sample-rate", type=float, default=1.0, help="share of the requests with their large fields")
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    stream = SlowStream(args.write_latency)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+    synchronous = measure(lambda trace: synchronous_request(root, stream, trace), args.requests)
+    root.removeHandler(handler)
+
+    with tempfile.TemporaryDirectory() as log_directory:
+        pipeline = LogPipeline(os.path.join(log_directory, "relay.log"), os.path.join(log_directory, "requests.jsonl"))
+        queued_stream = SlowStream(args.write_latency)
+        for pipeline_handler in [pipeline.file_handler, pipeline.console_handler, pipeline.request_handler]:
+            pipeline_handler.setStream(queued_stream)
+        pipeline.start()
+        request_log = RequestLog(args.sample_rate)
+        queued = measure(lambda trace: queued_request(root, request_log, trace), args.requests)
+        t_stop = time.perf_counter()
+        pipeline.stop()
+        drain_s = time.perf_counter() - t_stop
+        root.removeHandler(pipeline.queue_handler)
+
+    print(f"{args.requests} requests, {args.write_latency * 1000:.1f} ms per write")
+    print(f"{'logging':<12} | {'p50':>9} | {'p99':>9} | {'max':>9} | {'written':>9}")
+    for name, durations, written in [("synchronous", synchronous, stream.bytes), ("queued", queued, queued_stream.bytes)]:
+        print(f"{name:<12} | {np.percentile(durations, 50) * 1000:>6.3f} ms | {np.percentile(durations, 99) * 1000:>6.3f} ms | "
+              f"{durations.max() * 1000:>6.3f} ms | {written / 1024:>6.0f} kB")
+    print(f"The writer needed {drain_s:.2f} s after the last request to empty the queue, {pipeline.dropped} records dropped")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,131 @@
+# End-to-end benchmark of the relay server with a deterministic LLM. Starts mock_llm_server.py with a fixed latency
+# model and the relay server (main.main) in this process, replays the recorded scenarios in ./data/recorded_payloads.json
+# over zmq like the X-Plane plugin does and breaks the time of every request down per pipeline stage. Everything except
+# generation and shortening is overhead of the relay itself.
+# Usage: python3 benchmark_pipeline.py [--repeats 5] [--ttft 0.5] [--tokens-per-s 50] [--stream] [--embedding-provider local]
+
+import argparse
+import json
+import logging
+import threading
+import time
+import numpy as np
+import zmq
+import main
+import mock_llm_server
+from mock_xp_plugin import connect, send_request, stream_request
+
+RECORDED_PAYLOADS_PATH = "./data/recorded_payloads.json"
+STAGES = ["decode", "queue", "session_lock", "response_cache", "speculation", "retrieval_prompt", "retrieval_lookup", "retrieval_vector",
+          "retrieval_bm25", "retrieval_fusion", "retrieval_rerank", "airport_lookup", "prompt", "generation", "shortening", "send"]
+LLM_STAGES = ["generation", "shortening"]
+STAGE_LABELS = {"session_lock": "lock", "response_cache": "cache", "speculation": "spec", "retrieval_prompt": "ret_prmpt", "retrieval_lookup": "lookup",
+                "retrieval_vector": "vector", "retrieval_bm25": "bm25", "retrieval_fusion": "fusion", "retrieval_rerank": "rerank",
+                "airport_lookup": "airports",
+                "generation": "generate", "shortening": "shorten"}
+
+
+def wait_for_relay(context, server_uri, relay_thread, timeout_s=600):
+    # the relay builds its index before it serves, the arm request is answered as soon as it is listening. main.main
+    # returns right away if there are no documents to index, then the benchmark fails instead of waiting for the timeout
+    socket = connect(context, server_uri, zmq.DEALER)
+    socket.send_multipart([b"", json.dumps({"trigger_source": "arm"}).encode('utf-8')])
+    deadline = time.monotonic() + timeout_s
+    while not socket.poll(500):
+        if not relay_thread.is_alive():
+            raise RuntimeError(f"Relay server stopped before it was listening, are there Markdown documents in '{main.MD_RAG_FILE_PATH}'?")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Relay server did not answer within {timeout_s} s")
+    socket.recv_multipart()
+    socket.close()
+
+
+def run_scenarios(context, server_uri, scenarios, repeats, stream, observed):
+    results = {}    # (scenario, step, trigger source) -> list of (client latency, stage timings)
+    for _ in range(repeats):
+        for scenario in scenarios:
+            # a new socket is a new session, so every replay starts with an empty chat history
+            socket = connect(context, server_uri, zmq.DEALER if stream else zmq.REQ)
+            for step, payload in enumerate(scenario["payloads"]):
+                payload = payload | {"stream": stream}
+                n_observed = len(observed)
+                t_start = time.perf_counter()
+                if stream:
+                    for _ in stream_request(socket, payload):
+                        pass
+                else:
+                    send_request(socket, payload)
+                latency = time.perf_counter() - t_start
+                if payload["trigger_source"] in ("arm", "state_change"):
+                    continue    # answered right away by the socket thread, there are no stage timings
+                while len(observed) == n_observed:     # the observer runs right after the reply was handed over
+                    time.sleep(0.001)
+                results.setdefault((scenario["name"], step, payload["trigger_source"]), []).append((latency, observed[-1]))
+            socket.close()
+    return results
+
+
+def print_report(results):
+    stages = [s for s in STAGES if any(s in t for runs in results.values() for _, t in runs)]
+    header = f"{'request':<32}|{'client':>9} |{'relay':>9} |{'overhead':>9} |" + "".join(f"{STAGE_LABELS.get(s, s):>10} |" for s in stages)
+    print(header)
+    print("-" * len(header))
+    for key, runs in results.items():
+        latency = np.median([r[0] for r in runs]) * 1000
+        total = np.median([r[1]["total"] for r in runs]) * 1000
+        overhead = np.median([r[1]["total"] - sum(r[1].get(s, 0.0) for s in LLM_STAGES) for r in runs]) * 1000
+        row = f"{key[0] + ' #' + str(key[1]) + ' ' + key[2]:<32}|{latency:>9.1f} |{total:>9.1f} |{overhead:>9.1f} |"
+        row += "".join(f"{np.median([r[1].get(s, 0.0) for r in runs]) * 1000:>10.1f} |" for s in stages)
+        print(row)
+    print("-" * len(header))
+    print("Median times in ms. client: round trip seen by the plugin, relay: from receiving the request to sending the "
+          "last reply, overhead: relay time without the LLM calls.")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the relay server with a mock LLM")
+    parser.add_argument("--repeats", type=int, default=5, help="how often every scenario is replayed")
+    parser.add_argument("--payloads", default=RECORDED_PAYLOADS_PATH, help="json file with the recorded scenarios")
+    parser.add_argument("--ttft", type=float, default=0.5, help="time to first token of the mock LLM in seconds")
+    parser.add_argument("--tokens-per-s", type=float, default=50.0, help="generation speed of the mock LLM")
+    parser.add_argument("--llm-port", type=int, default=8002, help="port of the mock LLM server")
+    parser.add_argument("--server", default="127.0.0.1:5599", help="address the relay server is started on")
+    parser.add_argument("--stream", action="store_true", help="request streamed answers like the X-Plane plugin")
+    parser.add_argument("--response-cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--embedding-provider", default=main.EMBEDDING_PROVIDER, help="embedding provider of the relay")
+    args = parser.parse_args()
+
+    with open(args.payloads, 'r') as f:
+        scenarios = json.load(f)
+
+    llm_server = mock_llm_server.serve(args.llm_port, time_to_first_token_s=args.ttft, tokens_per_s=args.tokens_per_s)
+    threading.Thread(target=llm_server.serve_forever, daemon=True).start()
+
+    main.LLM_BACKEND = "openai"
+    main.LLM_BASE_URL = f"http://127.0.0.1:{args.llm_port}/v1"
+    main.EMBEDDING_PROVIDER = args.embedding_provider
+    main.SERVER_BIND_URI = f"tcp://{args.server}"
+    main.METAR_REFRESH_INTERVAL_S = 0    # no background downloads during the measurement
+    main.METRICS_PORT = 0
+    main.METRICS_LOG_INTERVAL_S = 0
+    main.MONITOR_ENABLED = False
+    main.RECORDING_ENABLED = False
+    if not args.response_cache:
+        main.RESPONSE_CACHE.max_entries = 0
+    observed = []
+    main.REQUEST_OBSERVERS.append(lambda payload, trace: observed.append(trace.durations() | {"total": trace.total_s}))
+    main.LOG_PIPELINE.console_handler.setLevel(logging.WARNING)    # the log of every request would bury the report
+
+    context = zmq.Context()
+    relay_thread = threading.Thread(target=main.main, daemon=True)
+    relay_thread.start()
+    wait_for_relay(context, args.server, relay_thread)
+    results = run_scenarios(context, args.server, scenarios, args.repeats, args.stream, observed)
+
+    print(f"Mock LLM: time to first token {args.ttft:.2f} s, {args.tokens_per_s:.0f} tokens/s, "
+          f"{'streamed' if args.stream else 'not streamed'}, {args.repeats} repeats")
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,164 @@
+# Cost per call of the prompt formatting of the relay server: the compiled flight data and ECAM formatters
+# (prompt_schema.py) against the previous f-string formatting, which is kept here as the reference. Both are run on
+# the flight data of mock_xp_plugin.py and on randomized variations of it (ECAM texts of any length and case, gear
+# positions outside the known values, numpy scalars), and the outputs are checked to be identical.
+# Usage: python3 benchmark_prompt_formatting.py [--calls 20000] [--variations 2000]
+
+import argparse
+import random
+import time
+import numpy as np
+import main
+from mock_xp_plugin import DATA
+
+ECAM_WORDS = ["ENG", "2", "FIRE", "LAND ASAP", "-THR LEVER", "IDLE", "HYD G RSVR LO LVL", "agent 1", "DISCH", "......", " "]
+
+
+def legacy_format_ecam_message(ecam_data):
+    left_ecam_msgs = []
+    right_ecam_msgs = []
+    
+    for l in main.ECAM_LINES:
+        left_msg = None
+        right_msg = None
+        padded_colored_messages = []
+        for c in main.ECAM_COLORS:
+            padded_colored_messages.append(ecam_data[f"AirbusFBW/EWD{l}{c}Text"].ljust(48))
+        
+        #split in left and right
+        left_padded_colored_messages = [pcm[:24] for pcm in padded_colored_messages]
+        right_padded_colored_messages = [pcm[24:] for pcm in padded_colored_messages]
+        
+        for i,c in enumerate(main.ECAM_FULL_COLORS):   #invert the priority
+            if sum(1 for char in left_padded_colored_messages[i] if char != ' ') > 0:
+                left_msg = left_padded_colored_messages[i].rstrip().upper() + f" ({c})"
+            if sum(1 for char in right_padded_colored_messages[i] if char != ' ') > 0:    
+                right_msg = right_padded_colored_messages[i].rstrip().upper() + f" ({c})"
+        
+        if left_msg is not None:
+            left_ecam_msgs.append(left_msg)
+        if right_msg is not None:
+            right_ecam_msgs.append(right_msg)
+    
+    # build final ECAM messges
+    final_ecam_msg = '\n'.join(left_ecam_msgs+right_ecam_msgs)
+    
+    return final_ecam_msg
+
+
+def legacy_format_flight_data(flight_data):
+    fligh_data_msgs = []
+    
+    def ldg_pos_str(ldg_ind):
+        if ldg_ind == 0:
+            pos = "Up"
+        elif ldg_ind == 1:
+            pos = "Changing"
+        elif ldg_ind == 2:
+            pos = "Down"
+        elif ldg_ind == 3:
+            pos = "Changing"
+        else:
+            pos = "Unknown"
+            
+        return pos
+        
+    fligh_data_msgs.append(f"Latitude: {flight_data['sim/flightmodel/position/latitude']:.6f} deg")
+    fligh_data_msgs.append(f"Longitude: {flight_data['sim/flightmodel/position/longitude']:.6f} deg")
+    fligh_data_msgs.append(f"Altitde MSL: {int(flight_data['sim/flightmodel/position/elevation'] * 3.28084)} ft")
+    fligh_data_msgs.append(f"Altitde AGL: {int(flight_data['sim/flightmodel/position/y_agl'] * 3.28084)} ft")
+    fligh_data_msgs.append(f"Magnetic Heading: {flight_data['sim/flightmodel/position/mag_psi']:.1f} deg")
+    fligh_data_msgs.append(f"Pitch Angle: {flight_data['toliss_airbus/pfdoutputs/captain/pitch_angle']:.1f} deg")
+    fligh_data_msgs.append(f"Roll Angle: {flight_data['toliss_airbus/pfdoutputs/captain/roll_angle']:.1f} deg")
+    fligh_data_msgs.append(f"Angle of Attack: {flight_data['sim/flightmodel/position/alpha']:.1f} deg")
+    fligh_data_msgs.append(f"Sideslip Angle: {flight_data['sim/flightmodel/position/beta']:.1f} deg")
+    fligh_data_msgs.append(f"Inidcated Airspeed: {flight_data['sim/flightmodel/position/indicated_airspeed']:.1f} kt")
+    fligh_data_msgs.append(f"Groundspeed: {flight_data['sim/flightmodel/position/groundspeed'] * 1.94384:.1f} kt")
+    fligh_data_msgs.append(f"Vertical Speed: {int(flight_data['sim/flightmodel/position/vh_ind_fpm'])} ft/min")
+    fligh_data_msgs.append(f"Left N1: {flight_data['AirbusFBW/fmod/eng/N1Array'][0]:.1f}%")
+    fligh_data_msgs.append(f"Right N1: {flight_data['AirbusFBW/fmod/eng/N1Array'][1]:.1f}%")
+    fligh_data_msgs.append(f"Left Flaps Deployment: {flight_data['sim/flightmodel2/controls/flap1_deploy_ratio']*100:.1f}%")
+    fligh_data_msgs.append(f"Right Flaps Deployment: {flight_data['sim/flightmodel2/controls/flap2_deploy_ratio']*100:.1f}%")
+    fligh_data_msgs.append(f"Left Slats Deployment: {flight_data['AirbusFBW/SlatPositionLWing']*100/27:.1f}%")  # originally in deg
+    fligh_data_msgs.append(f"Right Slats Deployment: {flight_data['AirbusFBW/SlatPositionRWing']*100/27:.1f}%") 
+    fligh_data_msgs.append(f"Left Landing Gear Position: {ldg_pos_str(flight_data['AirbusFBW/LeftGearInd'])}")
+    fligh_data_msgs.append(f"Right Landing Gear Position: {ldg_pos_str(flight_data['AirbusFBW/RightGearInd'])}")
+    fligh_data_msgs.append(f"Nose Landing Gear Position: {ldg_pos_str(flight_data['AirbusFBW/NoseGearInd'])}")
+    fligh_data_msgs.append(f"Wheels Ground Contact: {bool(np.any(flight_data['sim/flightmodel2/gear/on_ground']))}")
+    fligh_data_msgs.append(f"Estimated Fuel on Board: {int(flight_data['sim/flightmodel/weight/m_fuel_total'])} kg")
+    fligh_data_msgs.append(f"Fuel Mass Center Tank: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][0])} kg (max capcity: 6500kg)")
+    fligh_data_msgs.append(f"Fuel Mass Main Wing Tanks: Left: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][1])} kg, Right: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][2])} kg (max capacity per side: 5400 kg)")
+    fligh_data_msgs.append(f"Fuel Mass Tip Tank: Left: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][3])} kg,  Right: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][4])} kg (max capacity per side: 680 kg)")
+    fligh_data_msgs.append(f"Auto Pilot 1 Active: {bool(flight_data['AirbusFBW/AP1Engage'])}")
+    fligh_data_msgs.append(f"Auto Pilot 2 Active: {bool(flight_data['AirbusFBW/AP2Engage'])}")
+    fligh_data_msgs.append(f"Auto Throttle Active: {flight_data['AirbusFBW/ATHRmode'] > 0}") 
+    fligh_data_msgs.append(f"Outside Air Temperature: {int(flight_data['sim/cockpit2/temperature/outside_air_temp_deg'])} C")
+    fligh_data_msgs.append(f"Wind Direction and Speed: {int(flight_data['sim/cockpit2/gauges/indicators/wind_heading_deg_mag'])}/{int(flight_data['sim/cockpit2/gauges/indicators/wind_speed_kts'])} ")
+    
+    final_flight_data_msg = '\n'.join(fligh_data_msgs)
+    
+    return final_flight_data_msg
+
+
+def legacy_format_prompt_parts(data):
+    # the dict comprehensions and formatting of the previous format_prompt
+    ecam_data = {dr:data[dr] for dr in main.ECAM_DREFS}
+    flight_data = {dr:data[dr] for dr in main.FLIGHT_DREFS}
+    return legacy_format_ecam_message(ecam_data), legacy_format_flight_data(flight_data)
+
+
+def format_prompt_parts(data):
+    return main.format_ecam_message(data), main.format_flight_data(data)
+
+
+def variation(rng):
+    data = dict(DATA)
+    for dr in main.ECAM_DREFS:
+        data[dr] = "" if rng.random() < 0.7 else " ".join(rng.choice(ECAM_WORDS) for _ in range(rng.randint(1, 12)))
+        if rng.random() < 0.3:
+            data[dr] = data[dr].lower()
+    for dr in main.FLIGHT_DREFS:
+        value = data[dr]
+        if isinstance(value, list):
+            data[dr] = [v + rng.uniform(-1000, 1000) for v in value] if rng.random() < 0.5 else np.array(value, dtype=np.float32)
+        elif isinstance(value, float):
+            data[dr] = value * rng.uniform(-2, 2) if rng.random() < 0.5 else np.float32(value * rng.uniform(-2, 2))
+    for dr in ["AirbusFBW/LeftGearInd", "AirbusFBW/RightGearInd", "AirbusFBW/NoseGearInd", "AirbusFBW/ATHRmode"]:
+        data[dr] = rng.choice([0, 1, 2, 3, 4, 2.0, -1])
+    return data
+
+
+def time_per_call(function, data, calls):
+    t_start = time.perf_counter()
+    for _ in range(calls):
+        function(data)
+    return (time.perf_counter() - t_start) / calls
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Cost of the prompt formatting")
+    parser.add_argument("--calls", type=int, default=20000, help="calls per formatter for the timing")
+    parser.add_argument("--variations", type=int, default=2000, help="randomized payloads checked for identical output")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    payloads = [dict(DATA)] + [variation(rng) for _ in range(args.variations)]
+    for data in payloads:
+        if legacy_format_prompt_parts(data) != format_prompt_parts(data):
+            raise AssertionError(f"Different output for {data}")
+    print(f"Identical output for {len(payloads)} payloads")
+
+    cases = [("ECAM messages", lambda data: legacy_format_ecam_message({dr:data[dr] for dr in main.ECAM_DREFS}),
+              main.format_ecam_message),
+             ("flight data", lambda data: legacy_format_flight_data({dr:data[dr] for dr in main.FLIGHT_DREFS}),
+              main.format_flight_data),
+             ("both", legacy_format_prompt_parts, format_prompt_parts)]
+    print(f"{'formatter':<14} | {'f-strings':>10} | {'compiled':>10} | speedup")
+    for name, legacy, compiled in cases:
+        t_legacy = time_per_call(legacy, DATA, args.calls)
+        t_compiled = time_per_call(compiled, DATA, args.calls)
+        print(f"{name:<14} | {t_legacy * 1e6:>7.1f} us | {t_compiled * 1e6:>7.1f} us | {t_legacy / t_compiled:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,67 @@
+# Compares the "two_stage" and "concise" response modes of the relay server. Every recorded scenario in
+# ./data/recorded_payloads.json is replayed in a fresh session for each mode, and the wall-clock latency and token counts
+# of every request are reported side by side. Needs the same setup as main.py (markdown files, OpenAI API key).
+# Usage: python3 benchmark_response_modes.py [--repeats 3]
+
+import argparse
+import json
+import time
+import numpy as np
+import main
+from sessions import Session
+
+RECORDED_PAYLOADS_PATH = "./data/recorded_payloads.json"
+
+
+def run_mode(mode, scenarios, retriever, client, repeats):
+    results = {}    # (scenario, step) -> list of (latency, usage)
+    for _ in range(repeats):
+        for scenario in scenarios:
+            session = Session(scenario["name"].encode())
+            for step, payload in enumerate(scenario["payloads"]):
+                usage = {}
+                t_start = time.perf_counter()
+                main.handle_request(payload | {"response_mode": mode}, session, retriever, client, usage=usage)
+                latency = time.perf_counter() - t_start
+                results.setdefault((scenario["name"], step, payload["trigger_source"]), []).append((latency, usage))
+    return results
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark of the relay server response modes")
+    parser.add_argument("--repeats", type=int, default=3, help="how often every scenario is replayed per mode")
+    parser.add_argument("--payloads", default=RECORDED_PAYLOADS_PATH, help="json file with the recorded scenarios")
+    args = parser.parse_args()
+
+    with open(args.payloads, 'r') as f:
+        scenarios = json.load(f)
+
+    embeddings = main.setup_embedding_model()
+    chunks, vectors = main.build_index(main.MD_RAG_FILE_PATH, embeddings)
+    retriever = main.create_hybrid_retriever(chunks, vectors, embeddings)
+    client = main.setup_gpt_client()
+    main.RESPONSE_CACHE.max_entries = 0     # every repeat has to reach the LLM, otherwise the cache is measured
+
+    results = {mode: run_mode(mode, scenarios, retriever, client, args.repeats) for mode in main.RESPONSE_MODES}
+
+    header = f"{'request':<36}" + "".join(f"| {mode + ' latency':>20} | {'tokens in/out':>15} " for mode in main.RESPONSE_MODES)
+    print(header)
+    print("-" * len(header))
+    totals = {mode: [0.0, 0, 0] for mode in main.RESPONSE_MODES}
+    for key in results[main.RESPONSE_MODES[0]]:
+        row = f"{key[0] + ' #' + str(key[1]) + ' ' + key[2]:<36}"
+        for mode in main.RESPONSE_MODES:
+            latencies = [r[0] for r in results[mode][key]]
+            prompt_tokens = np.mean([r[1].get("prompt_tokens", 0) for r in results[mode][key]])
+            completion_tokens = np.mean([r[1].get("completion_tokens", 0) for r in results[mode][key]])
+            row += f"| {np.median(latencies):>18.2f} s | {prompt_tokens:>7.0f}/{completion_tokens:<7.0f} "
+            totals[mode][0] += np.median(latencies)
+            totals[mode][1] += prompt_tokens
+            totals[mode][2] += completion_tokens
+        print(row)
+    print("-" * len(header))
+    print(f"{'total':<36}" + "".join(f"| {totals[mode][0]:>18.2f} s | {totals[mode][1]:>7.0f}/{totals[mode][2]:<7.0f} " for mode in main.RESPONSE_MODES))
+
+
+if __name__ == "__main__":
+    main_benchmark()
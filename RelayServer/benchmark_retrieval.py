@@ -0,0 +1,95 @@
+# Retrieval quality and latency of the relay server. Every labeled ECAM message in ./data/retrieval_benchmark.json is
+# turned into the retrieval prompt the relay would use, and the chunks returned by the vector search, the BM25 search,
+# their fusion and (with --rerank-model) the cross-encoder reranking are checked for the expected procedure: a chunk
+# counts as a hit if it belongs to the procedure of the label (see qrh_chunker.py) or contains one of its "match" strings.
+# The lookup of the procedures by ECAM title is reported on its own and as "relay", the lookup merged with the search
+# when a title is unknown, like the relay uses it. Reports recall@k, the mean reciprocal rank and the latency of every stage. Needs the
+# same setup as main.py (markdown files in MD_RAG_FILE_PATH, embedding provider).
+# Usage: python3 benchmark_retrieval.py [--k 1 3 5] [--vector-weight 0.5] [--rrf-c 60] [--rerank-model <model>]
+
+import argparse
+import json
+import re
+import time
+import numpy as np
+import main
+from hybrid_retriever import reciprocal_rank_fusion, merge_documents
+from qrh_chunker import normalize_title
+from tracing import Trace
+
+BENCHMARK_PATH = "./data/retrieval_benchmark.json"
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text).upper()
+
+
+def first_hit(docs, label):
+    # rank (1-based) of the first chunk of the expected procedure, None if it was not retrieved
+    matches = [normalize(m) for m in label["match"]]
+    procedure = normalize_title(label["procedure"])
+    for rank, doc in enumerate(docs, start=1):
+        if doc.metadata.get("procedure") == procedure or any(m in normalize(doc.page_content) for m in matches):
+            return rank
+    return None
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Retrieval quality and latency benchmark")
+    parser.add_argument("--labels", default=BENCHMARK_PATH, help="json file with the labeled ECAM messages")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="cut-offs of the recall")
+    parser.add_argument("--vector-weight", type=float, default=main.RETRIEVAL_WEIGHTS["vector"],
+                        help="weight of the vector search in the fusion, BM25 gets the rest")
+    parser.add_argument("--rrf-c", type=float, default=main.RETRIEVAL_RRF_C, help="rank constant of the fusion")
+    parser.add_argument("--rerank-model", default=main.RERANK_MODEL, help="cross-encoder for the reranking stage")
+    parser.add_argument("--repeats", type=int, default=3, help="how often every query is run for the latencies")
+    args = parser.parse_args()
+
+    with open(args.labels, 'r') as f:
+        labels = json.load(f)
+
+    main.RETRIEVAL_WEIGHTS = {"vector": args.vector_weight, "bm25": 1.0 - args.vector_weight}
+    main.RETRIEVAL_RRF_C = args.rrf_c
+    embeddings = main.setup_embedding_model()
+    chunks, vectors = main.build_index(main.MD_RAG_FILE_PATH, embeddings)
+    retriever = main.create_hybrid_retriever(chunks, vectors, embeddings, args.rerank_model)
+    weights = [retriever.weights[name] for name in retriever.retrievers]
+
+    ranks = {}  # stage -> list of ranks of the first hit
+    durations = {}  # span name -> list of durations
+    for label in labels:
+        query = main.format_ecam_retrieval_prompt(label["ecam"])
+        for repeat in range(args.repeats):
+            trace = Trace("benchmark", time.perf_counter())
+            docs = retriever.retrieve(query, trace)
+            trace.total_s = time.perf_counter() - trace.t_received
+            for name, duration in trace.durations().items():
+                durations.setdefault(name, []).append(duration)
+            durations.setdefault("total", []).append(trace.total_s)
+        lists = {name: retriever.search(name, query)[0] for name in retriever.retrievers}
+        results = dict(lists)
+        results["fusion"] = reciprocal_rank_fusion(list(lists.values()), weights, retriever.rrf_c)
+        if retriever.reranker is not None:
+            results["rerank"] = docs
+        t_start = time.perf_counter()
+        results["lookup"], complete = retriever.lookup(label["ecam"])
+        durations.setdefault("retrieval_lookup", []).append(time.perf_counter() - t_start)
+        results["relay"] = results["lookup"] if results["lookup"] and complete else merge_documents(results["lookup"], docs)
+        for stage, stage_docs in results.items():
+            ranks.setdefault(stage, []).append(first_hit(stage_docs, label))
+        if first_hit(results["relay"], label) is None:
+            print(f"Missed {label['procedure']}")
+
+    print(f"{len(labels)} labeled ECAM messages, {len(chunks)} chunks, weights {retriever.weights}, rrf_c {retriever.rrf_c}")
+    print(f"{'stage':<8} | " + " | ".join(f"recall@{k:<2}" for k in args.k) + " |   MRR")
+    for stage, stage_ranks in ranks.items():
+        recalls = [np.mean([r is not None and r <= k for r in stage_ranks]) for k in args.k]
+        mrr = np.mean([1.0 / r if r is not None else 0.0 for r in stage_ranks])
+        print(f"{stage:<8} | " + " | ".join(f"{recall:>9.0%}" for recall in recalls) + f" | {mrr:.3f}")
+    print(f"\n{'span':<18} | {'mean':>9} | {'p95':>9}")
+    for name, values in durations.items():
+        print(f"{name:<18} | {np.mean(values) * 1000:>6.2f} ms | {np.percentile(values, 95) * 1000:>6.2f} ms")
+
+
+if __name__ == "__main__":
+    main_benchmark()
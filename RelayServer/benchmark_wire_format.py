@@ -0,0 +1,65 @@
+# Compares the json messages of the X-Plane plugin with the binary wire format (wire_format.py). A simulated telemetry
+# stream based on the flight data of mock_xp_plugin.py (attitude, speeds and fuel change every sample, ECAM messages
+# rarely) is encoded and decoded in each format, and the cost per frame and the bytes per frame are reported.
+# Usage: python3 benchmark_wire_format.py [--frames 2000]
+
+import argparse
+import json
+import time
+import numpy as np
+from mock_xp_plugin import DATA
+from wire_format import WireEncoder, WireDecoder
+
+VARYING_DREFS = ["toliss_airbus/pfdoutputs/captain/pitch_angle", "toliss_airbus/pfdoutputs/captain/roll_angle",
+                 "sim/flightmodel/position/alpha", "sim/flightmodel/position/indicated_airspeed",
+                 "sim/flightmodel/position/groundspeed", "sim/flightmodel/position/vh_ind_fpm",
+                 "sim/flightmodel/position/elevation", "sim/flightmodel/position/y_agl",
+                 "sim/flightmodel/position/latitude", "sim/flightmodel/position/longitude",
+                 "sim/flightmodel/weight/m_fuel_total"]
+
+
+def telemetry_stream(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    base = {k: v for k, v in DATA.items() if k != "trigger_source"}
+    messages = []
+    for i in range(frames):
+        message = dict(base) | {"plugin_id": "0" * 32, "time": i * 0.5}
+        for dr in VARYING_DREFS:
+            message[dr] = float(np.float32(base[dr] + rng.normal()))
+        if i % 200 == 100:
+            message["AirbusFBW/EWD1aText"] = "HYD G RSVR LO LVL"
+        messages.append(message)
+    return messages
+
+
+def measure(encode, decode, messages):
+    t_start = time.perf_counter()
+    frames = [encode(m) for m in messages]
+    t_encoded = time.perf_counter()
+    decoded = [decode(f) for f in frames]
+    t_decoded = time.perf_counter()
+    return frames, decoded, (t_encoded - t_start) / len(messages), (t_decoded - t_encoded) / len(messages)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark of the json and binary wire formats")
+    parser.add_argument("--frames", type=int, default=2000, help="number of telemetry frames")
+    args = parser.parse_args()
+
+    messages = telemetry_stream(args.frames)
+    variants = [("json", lambda: (lambda m: json.dumps(m).encode('utf-8'), lambda f: json.loads(f.decode()))),
+                ("binary, key frames only", lambda: (WireEncoder(key_frame_interval=1).encode, WireDecoder().decode)),
+                ("binary, delta frames", lambda: (WireEncoder().encode, WireDecoder().decode))]
+
+    print(f"{'format':<26}|{'encode us':>10} |{'decode us':>10} |{'bytes/frame':>12} |{'max bytes':>10} |")
+    print("-" * 75)
+    for name, make in variants:
+        encode, decode = make()
+        frames, decoded, t_encode, t_decode = measure(encode, decode, messages)
+        assert all(d == m for d, m in zip(decoded, messages)), f"{name}: decoded messages differ"
+        sizes = [len(f) for f in frames]
+        print(f"{name:<26}|{t_encode * 1e6:>10.1f} |{t_decode * 1e6:>10.1f} |{np.mean(sizes):>12.1f} |{max(sizes):>10} |")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,149 @@
+# Conversation memory of the text entry follow-ups. The history that is sent with every follow-up starts with the
+# flight-data prompt of the alert or query and its answer, which stay pinned. The follow-up turns after it are counted in
+# tokens; once they fill a share of the budget, the older turns are summarized by the LLM on a background thread and
+# replaced by the summary, so the prompt stays under the budget without the pilots waiting for the summary. Until the
+# summary is done, the oldest turns are left out of the prompt if it would exceed the budget (several at once, so the
+# prompt does not change at its start with every turn).
+# Between two summaries, new turns are only appended, so the messages up to the last turn are the same for consecutive
+# follow-ups and providers with prompt caching (like OpenAI for prompts from 1024 tokens) can reuse that prefix.
+
+import logging
+import threading
+
+HISTORY_TOKEN_BUDGET = 6000
+SUMMARIZE_AT = 0.75     # share of the budget at which the older turns are summarized
+KEEP_TURNS = 2  # most recent turns that are never summarized
+TOKENIZER_MODEL = "gpt-4o"
+SUMMARY_PREFIX = "Summary of the earlier follow-up questions and answers: "
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def load_tokenizer():
+    """
+    Load the tokenizer of TOKENIZER_MODEL. tiktoken downloads the encoding on first use, so the relay calls this at
+    startup instead of on the request path. If tiktoken is not installed or cannot load the encoding, the tokens are
+    estimated with 4 characters per token.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+        except Exception as e:
+            logger.warning(f"Could not load the tokenizer, estimating tokens from the text length: {str(e)}")
+            _encoding = False
+
+
+def count_tokens(text):
+    # loads the tokenizer if load_tokenizer was not called yet (e.g. in the benchmarks)
+    if _encoding is None:
+        load_tokenizer()
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    return count_tokens(message["content"]) + 4     # role and separators
+
+
+class ConversationMemory():
+    """
+    Parameters:
+    - token_budget: Maximum number of tokens of the history that is sent with a follow-up. The pinned situation is
+      always sent, even if it exceeds the budget on its own.
+    - summarize_at: Share of the budget at which the older turns are summarized.
+    - keep_turns: Number of most recent turns that are never summarized.
+    """
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, summarize_at=SUMMARIZE_AT, keep_turns=KEEP_TURNS):
+        self.token_budget = token_budget
+        self.summarize_at = summarize_at
+        self.keep_turns = keep_turns
+        self.situation = []     # list of (message, tokens): the prompt of the alert or query and its answer
+        self.summary = None     # (message, tokens) of the summarized turns
+        self.turns = []     # list of ([question, answer], tokens)
+        self.skipped = 0    # oldest turns that are left out of the prompt until the summary is done
+        self.conversation = 0   # incremented by reset, summaries of an earlier conversation are discarded
+        self.summarizing = False
+        self.summaries = 0
+        self.lock = threading.Lock()
+
+    def reset(self, prompt=None, answer=None):
+        """
+        Start a new conversation, pinning the prompt of an alert or query and its answer. Without a prompt (e.g. on
+        arm), the memory is emptied.
+        """
+        with self.lock:
+            self.conversation += 1
+            self.situation = []
+            if prompt is not None:
+                for message in [{"role": "user", "content": prompt}, {"role": "assistant", "content": answer}]:
+                    self.situation.append((message, message_tokens(message)))
+            self.summary = None
+            self.turns = []
+            self.skipped = 0
+
+    def add_turn(self, question, answer, summarize=None):
+        """
+        Parameters:
+        - summarize: Function that summarizes a list of messages into a text. If given and the turns fill
+          summarize_at of the budget, the older turns are summarized with it on a background thread.
+        """
+        messages = [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        with self.lock:
+            self.turns.append((messages, sum(message_tokens(m) for m in messages)))
+            count = len(self.turns) - self.keep_turns
+            # a summary is only made if it frees a good part of the budget, every summary changes the prompt prefix
+            if summarize is not None and not self.summarizing and count > 0 \
+                    and self.tokens() >= self.summarize_at * self.token_budget \
+                    and sum(t for _, t in self.turns[:count]) >= (1 - self.summarize_at) * self.token_budget:
+                to_summarize = ([self.summary[0]] if self.summary is not None else []) + \
+                    [m for turn, _ in self.turns[:count] for m in turn]
+                self.summarizing = True
+                threading.Thread(target=self.run_summary, args=(summarize, to_summarize, count, self.conversation),
+                                 daemon=True).start()
+
+    def run_summary(self, summarize, messages, count, conversation):
+        try:
+            text = summarize(messages)
+        except Exception as e:
+            logger.error(f"Could not summarize the conversation: {str(e)}")
+            text = None
+        with self.lock:
+            self.summarizing = False
+            if text is None or conversation != self.conversation:
+                return
+            message = {"role": "user", "content": SUMMARY_PREFIX + text}
+            before = self.tokens()
+            self.summary = (message, message_tokens(message))
+            self.turns = self.turns[count:]
+            self.skipped = max(0, self.skipped - count)
+            self.summaries += 1
+            logger.info(f"Summarized {count} turns of the conversation, {before} -> {self.tokens()} tokens")
+
+    def tokens(self):
+        return sum(t for _, t in self.situation) + (self.summary[1] if self.summary is not None else 0) + \
+            sum(t for _, t in self.turns)
+
+    def messages(self):
+        """
+        Returns:
+        - history: The messages to send before the next question: the pinned situation, the summary and as many of
+          the most recent turns as fit into the budget.
+        """
+        with self.lock:
+            history = [m for m, _ in self.situation]
+            if self.summary is not None:
+                history.append(self.summary[0])
+            available = self.token_budget - self.tokens() + sum(t for _, t in self.turns)
+            if sum(t for _, t in self.turns[self.skipped:]) > available:
+                # the summary is still running, leave out the oldest turns down to the share at which it was started
+                while self.skipped < len(self.turns) and \
+                        sum(t for _, t in self.turns[self.skipped:]) > available - (1 - self.summarize_at) * self.token_budget:
+                    self.skipped += 1
+            for turn, _ in self.turns[self.skipped:]:
+                history.extend(turn)
+            return history
@@ -1,22 +1,11 @@
 # This helper scripts downloads all current real-world METARs for commericial airports with at least one runway with a length >=8000ft.
 # The resulting file is saved in ./metars.csv. Airports that do not have a METAR available will have an empty entry in the ./metars.csv
+# The running relay server refreshes the METARs on its own (see METAR_REFRESH_INTERVAL_S in main.py), this script is only needed to update the file it starts with.
 
+import os
+import time
 import pandas as pd
-import requests
-from tqdm import tqdm
-
-def download_metar(ICAO):
-    base_url = 'https://tgftp.nws.noaa.gov/data/observations/metar/stations/'
-    url = base_url + ICAO + '.TXT'
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error for bad status codes
-        return response.text.split('\n')[1]
-    except requests.RequestException as e:
-        # raise ValueError
-        print(f"Error fetching the file: {e}")
-        
-        return ""   # just return an empty string if no METAR could be found
+from metar import METAR_BASE_URL, MetarFetcher
 
 database_path = './data/all_apts.csv'
 min_runway_length_ft = 8000
@@ -29,10 +18,10 @@ df_filtered = df_filtered[df_filtered["AptType"]=="C"]
 
 # list of all global (approx. 2000) airports that are candidates due to to airport type and min max runway length
 icao_list = df_filtered["ICAO"].to_list()
-metars = []
-for icao in tqdm(icao_list):
-    metars.append(download_metar(icao))
+fetcher = MetarFetcher(os.getenv("METAR_BASE_URL", METAR_BASE_URL))
+t_start = time.perf_counter()
+metars, stats = fetcher.fetch_all(icao_list)
 
-df = pd.DataFrame({"ICAO":icao_list, "METAR":metars}).to_csv('./data/metars.csv',index=False)
+df = pd.DataFrame({"ICAO":icao_list, "METAR":[metars[icao] for icao in icao_list]}).to_csv('./data/metars.csv',index=False)
 
-print("Completed.")
\ No newline at end of file
+print(f"Completed in {time.perf_counter() - t_start:.1f} s ({stats['updated']} downloaded, {stats['failed']} without METAR).")
@@ -0,0 +1,88 @@
+# Embedding providers for the RAG index of the relay server.
+# "openai" uses the OpenAI embedding API, "local" runs a sentence-transformers model on the CPU, so the relay also works
+# on hosts without internet access and retrieval does not wait for a network round trip.
+# CachedEmbeddings wraps either provider: the retrieval prompts are derived from the ECAM messages and repeat a lot, so
+# query embeddings are kept in an LRU cache, and documents are embedded in batches.
+
+import logging
+import threading
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_PROVIDERS = ["openai", "local"]
+
+logger = logging.getLogger(__name__)
+
+
+def create_embeddings(provider, model, batch_size=64):
+    """
+    Create the embedding model of a provider.
+
+    Parameters:
+    - provider: One of EMBEDDING_PROVIDERS.
+    - model: Model name, e.g. "text-embedding-ada-002" for "openai" or "sentence-transformers/all-MiniLM-L6-v2" for "local".
+    - batch_size: Number of documents that are embedded per call.
+
+    Returns:
+    - embeddings: A langchain Embeddings object.
+    """
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model, chunk_size=batch_size)
+
+    if provider == "local":
+        # needs the sentence-transformers package, the model is downloaded once and then loaded from the local cache
+        try:
+            from langchain_huggingface import HuggingFaceEmbeddings
+        except ImportError:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model, model_kwargs={"device": "cpu"},
+                                     encode_kwargs={"batch_size": batch_size, "normalize_embeddings": True})
+
+    raise ValueError(f"Unknown embedding provider '{provider}', expected one of {EMBEDDING_PROVIDERS}")
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, provider, model, batch_size=64, query_cache_size=1024):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        self.batch_size = batch_size
+        self.query_cache_size = query_cache_size
+        self.query_cache = OrderedDict()    # query text -> embedding, in order of last use
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def provider_id(self):
+        # recorded in the index cache, vectors of different providers or models must never be mixed
+        return f"{self.provider}:{self.model}"
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text):
+        with self.lock:
+            vector = self.query_cache.get(text)
+            if vector is not None:
+                self.query_cache.move_to_end(text)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = self.embeddings.embed_query(text)
+        with self.lock:
+            self.query_cache[text] = vector
+            while len(self.query_cache) > self.query_cache_size:
+                self.query_cache.popitem(last=False)
+        return vector
+
+
+def setup_embeddings(provider, model, batch_size=64, query_cache_size=1024):
+    embeddings = create_embeddings(provider, model, batch_size)
+    logger.info(f"Using embedding provider {provider} with model {model}")
+    return CachedEmbeddings(embeddings, provider, model, batch_size, query_cache_size)
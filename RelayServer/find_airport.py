@@ -1,10 +1,28 @@
 import numpy as np
 import pandas as pd
-from copy import deepcopy
+
+EARTH_RADIUS_KM = 6371.0     # Radius of Earth in kilometers (use 3958.8 for miles)
+
+
+def to_unit_xyz(lat, lon):
+    """
+    Convert latitude/longitude (in degrees) to points on the unit sphere.
+
+    Returns:
+    - xyz: Array of shape (..., 3).
+    """
+    lat_rad, lon_rad = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat_rad)
+    return np.stack([cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)], axis=-1)
+
+
+def chord_to_km(chord):
+    # great-circle distance for the straight-line distance between two points on the unit sphere, equivalent to haversine
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0))
 
 
 class AirportFinder():
-    def __init__(self,database_path,metas_path,min_runway_length_ft=8000,N=5):
+    def __init__(self,database_path,metas_path,min_runway_length_ft=8000,N=5,apt_types=("C",)):
         self.database_path = database_path
         self.metars_path = metas_path
         self.min_runway_length_ft = min_runway_length_ft
@@ -16,61 +34,175 @@ class AirportFinder():
         # filter airports by minimum runway length
         self.df_filtered = self.df[self.df["MaxRunwayLength"]>=self.min_runway_length_ft]
         # filter airports by airport types (C=commercial, P=private, M=military)
-        self.df_filtered = self.df_filtered[self.df_filtered["AptType"]=="C"]
-        
+        self.df_filtered = self.df_filtered[self.df_filtered["AptType"].isin(apt_types)]
+        self.df_filtered = self.df_filtered.dropna(subset=["Latitude", "Longitude"])
+
         self.lat_lon = self.df_filtered[["Latitude", "Longitude"]].to_numpy()
         self.glide_ratio = 17   # A320 has a glide ratio of approx. 17:1 in clean config
-    
+
+        # spatial index: airports as points on the unit sphere, the straight-line (chord) distance between two points
+        # is monotonic in their great-circle distance, so nearest neighbours can be found with a single dot product
+        self.xyz = to_unit_xyz(self.lat_lon[:, 0], self.lat_lon[:, 1])
+        # lightweight per-airport records, built once instead of converting the DataFrame on every call
+        self.records = self.df_filtered.to_dict(orient='records')
+
+    def _chord_km(self, indices, query_xyz):
+        # element-wise instead of BLAS, so results do not depend on how many query points are processed at once
+        diff = self.xyz[indices] - query_xyz
+        return chord_to_km(np.sqrt(diff[..., 0]**2 + diff[..., 1]**2 + diff[..., 2]**2))
+
+    def _neg_dots(self, query_xyz, subset=None):
+        # negative dot products between query points (m, 3) and all airports (or the airports in subset), smaller is closer
+        xyz = self.xyz if subset is None else self.xyz[subset]
+        return -(query_xyz[:, 0:1] * xyz[:, 0] + query_xyz[:, 1:2] * xyz[:, 1] + query_xyz[:, 2:3] * xyz[:, 2])
+
+    def _k_nearest(self, query_xyz, k, subset=None):
+        """
+        Find the k nearest airports for every query point.
+
+        Parameters:
+        - query_xyz: Array of shape (m, 3) with query points on the unit sphere.
+        - k: Number of airports per query point.
+        - subset: Optional sorted array of airport indices the search is restricted to.
+
+        Returns:
+        - indices: Array of shape (m, k) with airport indices, sorted by distance (ties by index).
+        - distances: Array of shape (m, k) with great-circle distances (in kilometers).
+        """
+        n = len(self.xyz) if subset is None else len(subset)
+        k = min(k, n)
+        neg_dots = self._neg_dots(query_xyz, subset)
+        if k < n:
+            candidates = np.argpartition(neg_dots, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(n), neg_dots.shape)
+        candidates = np.sort(candidates, axis=1)
+        order = np.argsort(np.take_along_axis(neg_dots, candidates, axis=1), axis=1, kind='stable')
+        indices = np.take_along_axis(candidates, order, axis=1)
+        if subset is not None:
+            indices = subset[indices]
+        return indices, self._chord_km(indices, query_xyz[:, None, :])
+
+    def nearest(self, lat, lon, k=None):
+        """
+        Find the k nearest airports to (lat, lon) (in degrees), k defaults to N.
+
+        Returns:
+        - indices: Indices into records, sorted by distance.
+        - distances: Great-circle distances (in kilometers).
+        """
+        indices, distances = self._k_nearest(to_unit_xyz(lat, lon)[None, :], self.N if k is None else k)
+        return indices[0], distances[0]
+
+    def within_radius(self, lat, lon, radius_km):
+        """
+        Find all airports within radius_km of (lat, lon) (in degrees).
+
+        Returns:
+        - indices: Indices into records, sorted by distance.
+        - distances: Great-circle distances (in kilometers).
+        """
+        query_xyz = to_unit_xyz(lat, lon)
+        neg_dots = self._neg_dots(query_xyz[None, :])[0]
+        if radius_km >= np.pi * EARTH_RADIUS_KM:
+            indices = np.arange(len(self.xyz))
+        else:
+            max_chord = 2 * np.sin(radius_km / (2 * EARTH_RADIUS_KM))
+            # |p - q|^2 = 2 - 2 p.q for unit vectors, pad the threshold a little and filter exactly below
+            indices = np.flatnonzero(neg_dots <= max_chord**2 / 2 - 1 + 1e-12)
+        distances = self._chord_km(indices, query_xyz)
+        inside = distances <= radius_km
+        indices, distances = indices[inside], distances[inside]
+        order = np.argsort(neg_dots[indices], kind='stable')    # same order as nearest()
+        return indices[order], distances[order]
+
+    def make_records(self, indices, distances, in_glidepath):
+        records = self.records
+        return [dict(records[i], Distance=float(d), In_Glidepath=bool(g)) for i, d, g in zip(indices, distances, in_glidepath)]
+
+    def get_metars(self):
+        return {r["ICAO"]: r["METAR"] for r in self.records if isinstance(r["METAR"], str)}
+
+    def set_metars(self, metars):
+        """
+        Hot-swap the METARs (ICAO -> METAR, empty if none is available), e.g. after a refresh. The records are rebuilt
+        and replaced in one step, so concurrent queries see either the old or the new METARs. Airports that are not in
+        metars keep their current METAR.
+        """
+        self.records = [dict(r, METAR=(metars[r["ICAO"]] or None)) if r["ICAO"] in metars else r for r in self.records]
+
     def get_closest_airports(self,lat1, lon1, altitude=None):
         """
-        Calculate the great-circle distances between a single (lat1, lon1) pair and 
-        an array of latitude/longitude pairs using the haversine formula.
-        
+        Find the closest airports to a single (lat1, lon1) pair.
+
         Parameters:
         - lat1, lon1: Latitude and longitude of the reference point (in degrees).
-        - range: Range of the aircraft (in kilometers)
-        
+        - altitude: Altitude of the aircraft (in kilometers). If given, all airports in gliding range are returned
+          (at least N).
+
         Returns:
-        - distances: Array of distances (in kilometers) from the reference point.
+        - airports: List of airport records with their distance (in kilometers) from the reference point and whether
+          they are in gliding range, sorted by distance.
         """
-        filtered_df = deepcopy(self.df_filtered)
-        
-        lat_lons = self.lat_lon
-        
-        # Convert degrees to radians
-        lat1_rad, lon1_rad = np.radians(lat1), np.radians(lon1)
-        lat2_rad = np.radians(lat_lons[:, 0])
-        lon2_rad = np.radians(lat_lons[:, 1])
-        
-        # Haversine formula
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-        a = np.sin(dlat / 2.0)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2.0)**2
-        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
-        
-        # Radius of Earth in kilometers (use 3958.8 for miles)
-        R = 6371.0
-        distances = R * c
-        
-        filtered_df["Distance"] = distances
-        filtered_df = filtered_df.sort_values(by='Distance')
-        filtered_df["In_Glidepath"] = False
         if altitude is not None:
             max_range = altitude * self.glide_ratio
-            filtered_df.loc[filtered_df["Distance"]<=max_range, "In_Glidepath"] = True
-            
-            if filtered_df[filtered_df["Distance"]<=max_range].shape[0] >= self.N:
-                return filtered_df[filtered_df["Distance"]<=max_range].to_dict(orient='records')
-            else: 
-                return filtered_df.head(self.N).to_dict(orient='records')
+            indices, distances = self.within_radius(lat1, lon1, max_range)
+            if len(indices) >= self.N:
+                return self.make_records(indices, distances, np.ones(len(indices), dtype=bool))
+
+        indices, distances = self.nearest(lat1, lon1)
+        in_glidepath = distances <= max_range if altitude is not None else np.zeros(len(indices), dtype=bool)
+        return self.make_records(indices, distances, in_glidepath)
+
+    def get_closest_airports_batch(self, lats, lons, altitudes=None, N=None, chunk_size=256, max_matrix_elements=2**21):
+        """
+        Vectorized version of get_closest_airports for many positions, e.g. every sample of a recorded flight.
+        The points are processed in chunks of consecutive samples, and the point x airport distance matrix of a chunk
+        has at most max_matrix_elements entries to bound memory. For every point the result equals the first N airports
+        returned by get_closest_airports.
+
+        Parameters:
+        - lats, lons: Arrays of latitudes and longitudes (in degrees).
+        - altitudes: Optional array of altitudes (in kilometers) for the In_Glidepath flag.
+        - N: Number of airports per point, defaults to self.N.
+
+        Returns:
+        - indices: Array of shape (m, N) with indices into records, sorted by distance.
+        - distances: Array of shape (m, N) with great-circle distances (in kilometers).
+        - in_glidepath: Boolean array of shape (m, N).
+        """
+        N = self.N if N is None else N
+        query_xyz = to_unit_xyz(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)).reshape(-1, 3)
+        n_points = len(query_xyz)
+        k = min(N, len(self.xyz))
+        indices = np.empty((n_points, k), dtype=np.intp)
+        distances = np.empty((n_points, k))
+
+        chunk_size = max(1, min(chunk_size, max_matrix_elements // max(1, len(self.xyz))))
+        for start in range(0, n_points, chunk_size):
+            stop = min(start + chunk_size, n_points)
+            chunk = query_xyz[start:stop]
+            # only airports that can be among the k nearest of any point in the chunk: with the chunk center c and
+            # radius r, the k-th nearest airport of every point is at most d_k(c) + r away from it, so at most
+            # d_k(c) + 2r from c (triangle inequality in 3D)
+            center = chunk.mean(axis=0)
+            radius = np.sqrt(((chunk - center)**2).sum(axis=1)).max()
+            center_dist = np.sqrt(((self.xyz - center)**2).sum(axis=1))
+            kth_dist = np.partition(center_dist, k - 1)[k - 1]
+            subset = np.flatnonzero(center_dist <= kth_dist + 2 * radius + 1e-9)
+            indices[start:stop], distances[start:stop] = self._k_nearest(chunk, k, subset)
+
+        if altitudes is None:
+            in_glidepath = np.zeros(distances.shape, dtype=bool)
         else:
-            return filtered_df.head(self.N).to_dict(orient='records')
+            max_range = np.asarray(altitudes, dtype=float).reshape(-1, 1) * self.glide_ratio
+            in_glidepath = distances <= max_range
+        return indices, distances, in_glidepath
 
-        
 
 if __name__ == "__main__":
     af = AirportFinder('./all_apts.csv', 'metars.csv')
     pos = np.array([47.229714, -122.172793])
     closest_apts = af.get_closest_airports(*pos)
     print("stp[]")
-    
\ No newline at end of file
+
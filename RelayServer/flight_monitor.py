@@ -0,0 +1,188 @@
+# Continuous flight health monitoring. The X-Plane plugin publishes the flight data a few times per second, and cheap
+# numeric detectors (envelope limits, rates of change, engine N1 asymmetry, fuel imbalance) run on every sample. A detector
+# only trips if its condition holds for its persistence time, which filters out single noisy samples. Only when a detector
+# trips, the relay asks the LLM for a health assessment, and the number of those calls is limited by an LLMBudget.
+
+import threading
+import time
+
+MAX_BANK_DEG = 45
+MAX_PITCH_UP_DEG = 25
+MAX_PITCH_DOWN_DEG = -15
+MAX_ALPHA_DEG = 12
+VMO_KT = 350
+MIN_CLEAN_SPEED_KT = 180    # with flaps and slats retracted
+MAX_VERTICAL_SPEED_FPM = 6000
+MAX_PITCH_RATE_DEG_S = 5
+MAX_ROLL_RATE_DEG_S = 15
+MAX_SPEED_DECAY_KT_S = 4
+MIN_RUNNING_N1 = 15     # below this, an engine is considered shut down
+MAX_N1_ASYMMETRY = 10
+MAX_INNER_TANK_IMBALANCE_KG = 1500
+MAX_FUEL_FLOW_KG_MIN = 120      # far above the normal burn of an A320, sustained higher flows indicate a leak
+
+
+def airborne(sample):
+    return not any(sample["sim/flightmodel2/gear/on_ground"])
+
+
+def check_bank_angle(sample, previous, dt):
+    roll = sample["toliss_airbus/pfdoutputs/captain/roll_angle"]
+    if abs(roll) > MAX_BANK_DEG:
+        return f"Bank angle {roll:.0f} deg exceeds {MAX_BANK_DEG} deg"
+
+
+def check_pitch_attitude(sample, previous, dt):
+    pitch = sample["toliss_airbus/pfdoutputs/captain/pitch_angle"]
+    if pitch > MAX_PITCH_UP_DEG or pitch < MAX_PITCH_DOWN_DEG:
+        return f"Pitch attitude {pitch:.1f} deg outside of {MAX_PITCH_DOWN_DEG} to {MAX_PITCH_UP_DEG} deg"
+
+
+def check_angle_of_attack(sample, previous, dt):
+    alpha = sample["sim/flightmodel/position/alpha"]
+    if airborne(sample) and alpha > MAX_ALPHA_DEG:
+        return f"Angle of attack {alpha:.1f} deg exceeds {MAX_ALPHA_DEG} deg"
+
+
+def check_airspeed(sample, previous, dt):
+    ias = sample["sim/flightmodel/position/indicated_airspeed"]
+    if ias > VMO_KT:
+        return f"Indicated airspeed {ias:.0f} kt exceeds VMO of {VMO_KT} kt"
+    clean = sample["sim/flightmodel2/controls/flap1_deploy_ratio"] == 0 and sample["AirbusFBW/SlatPositionLWing"] == 0
+    if airborne(sample) and clean and sample["sim/flightmodel/position/y_agl"] * 3.28084 > 1000 and ias < MIN_CLEAN_SPEED_KT:
+        return f"Indicated airspeed {ias:.0f} kt below {MIN_CLEAN_SPEED_KT} kt in clean configuration"
+
+
+def check_vertical_speed(sample, previous, dt):
+    vs = sample["sim/flightmodel/position/vh_ind_fpm"]
+    if abs(vs) > MAX_VERTICAL_SPEED_FPM:
+        return f"Vertical speed {vs:.0f} ft/min exceeds {MAX_VERTICAL_SPEED_FPM} ft/min"
+
+
+def check_attitude_rates(sample, previous, dt):
+    if previous is None or dt <= 0:
+        return None
+    pitch_rate = (sample["toliss_airbus/pfdoutputs/captain/pitch_angle"] - previous["toliss_airbus/pfdoutputs/captain/pitch_angle"]) / dt
+    roll_rate = (sample["toliss_airbus/pfdoutputs/captain/roll_angle"] - previous["toliss_airbus/pfdoutputs/captain/roll_angle"]) / dt
+    if abs(pitch_rate) > MAX_PITCH_RATE_DEG_S:
+        return f"Pitch rate {pitch_rate:.1f} deg/s exceeds {MAX_PITCH_RATE_DEG_S} deg/s"
+    if abs(roll_rate) > MAX_ROLL_RATE_DEG_S:
+        return f"Roll rate {roll_rate:.1f} deg/s exceeds {MAX_ROLL_RATE_DEG_S} deg/s"
+
+
+def check_speed_decay(sample, previous, dt):
+    if previous is None or dt <= 0 or not airborne(sample):
+        return None
+    decay = (previous["sim/flightmodel/position/indicated_airspeed"] - sample["sim/flightmodel/position/indicated_airspeed"]) / dt
+    if decay > MAX_SPEED_DECAY_KT_S:
+        return f"Airspeed decreasing by {decay:.1f} kt/s"
+
+
+def check_n1_asymmetry(sample, previous, dt):
+    n1_left, n1_right = sample["AirbusFBW/fmod/eng/N1Array"][:2]
+    if max(n1_left, n1_right) < MIN_RUNNING_N1:
+        return None     # both engines shut down, e.g. on the ground
+    if min(n1_left, n1_right) < MIN_RUNNING_N1:
+        return f"Engine {1 if n1_left < n1_right else 2} not running (N1 {n1_left:.1f}% / {n1_right:.1f}%)"
+    if abs(n1_left - n1_right) > MAX_N1_ASYMMETRY:
+        return f"N1 asymmetry of {abs(n1_left - n1_right):.1f}% (N1 {n1_left:.1f}% / {n1_right:.1f}%)"
+
+
+def check_fuel_imbalance(sample, previous, dt):
+    tanks = sample["toliss_airbus/fuelTankContent_kgs"]
+    imbalance = tanks[1] - tanks[2]
+    if abs(imbalance) > MAX_INNER_TANK_IMBALANCE_KG:
+        return f"Fuel imbalance of {abs(imbalance):.0f} kg between the inner tanks ({'left' if imbalance > 0 else 'right'} heavy)"
+
+
+def check_fuel_flow(sample, previous, dt):
+    if previous is None or dt <= 0:
+        return None
+    flow = (previous["sim/flightmodel/weight/m_fuel_total"] - sample["sim/flightmodel/weight/m_fuel_total"]) / dt * 60
+    if flow > MAX_FUEL_FLOW_KG_MIN:
+        return f"Fuel on board decreasing by {flow:.0f} kg/min, possible fuel leak"
+
+
+# (name, check, persistence time in s)
+DETECTORS = [("bank_angle", check_bank_angle, 2.0),
+             ("pitch_attitude", check_pitch_attitude, 2.0),
+             ("angle_of_attack", check_angle_of_attack, 1.0),
+             ("airspeed", check_airspeed, 3.0),
+             ("vertical_speed", check_vertical_speed, 3.0),
+             ("attitude_rates", check_attitude_rates, 1.0),
+             ("speed_decay", check_speed_decay, 3.0),
+             ("n1_asymmetry", check_n1_asymmetry, 5.0),
+             ("fuel_imbalance", check_fuel_imbalance, 10.0),
+             ("fuel_flow", check_fuel_flow, 60.0),
+             ]
+
+
+class FlightMonitor():
+    """
+    Runs the detectors on the flight data samples of a single plugin and keeps track of which of them are tripped.
+    """
+    def __init__(self, detectors=DETECTORS):
+        self.detectors = detectors
+        self.previous = None
+        self.first_seen = {}    # detector name -> sample time its condition was first seen, until it clears
+        self.active = {}    # detector name -> message of the tripped detectors
+        self.last_escalation = None     # time of the last LLM assessment for this plugin
+
+    def update(self, sample):
+        """
+        Run all detectors on a new sample. Samples need a "time" entry in seconds.
+
+        Returns:
+        - tripped: Dict of detector name -> message for the detectors that tripped with this sample.
+        - cleared: List of detector names whose condition no longer holds.
+        """
+        dt = sample["time"] - self.previous["time"] if self.previous is not None else 0.0
+        tripped = {}
+        cleared = []
+        for name, check, persist_s in self.detectors:
+            try:
+                message = check(sample, self.previous, dt)
+            except (KeyError, IndexError, TypeError):
+                message = None  # incomplete sample
+            if message is None:
+                self.first_seen.pop(name, None)
+                if self.active.pop(name, None) is not None:
+                    cleared.append(name)
+                continue
+            first_seen = self.first_seen.setdefault(name, sample["time"])
+            if name in self.active:
+                self.active[name] = message
+            elif sample["time"] - first_seen >= persist_s:
+                self.active[name] = message
+                tripped[name] = message
+        self.previous = sample
+        return tripped, cleared
+
+
+class LLMBudget():
+    """
+    Token bucket that limits the LLM health assessments of all plugins together: up to burst calls at once, refilled
+    with calls_per_hour. In addition, every plugin gets at most one assessment per cooldown_s.
+    """
+    def __init__(self, calls_per_hour=6, burst=2, cooldown_s=300):
+        self.rate = calls_per_hour / 3600
+        self.burst = burst
+        self.cooldown_s = cooldown_s
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.granted = 0
+        self.denied = 0
+
+    def try_acquire(self, monitor):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1 or (monitor.last_escalation is not None and now - monitor.last_escalation < self.cooldown_s):
+                self.denied += 1
+                return False
+            self.tokens -= 1
+            monitor.last_escalation = now
+            self.granted += 1
+            return True
@@ -0,0 +1,308 @@
+# Flight data recorder of the relay server. Every payload the relay receives (requests and, optionally, the continuous
+# telemetry) is appended to a recording per session or plugin, so incidents can be reproduced with the full dataref
+# stream around an alert (see replay_recording.py).
+# A recording is a directory with one memory-mapped column file per dataref of the wire format schema, typed like the
+# dataref (float32, float64 for the position, int32, padded arrays with a length column, strings as indices into an append-only string table),
+# plus the receive time and kind of every row, the fields outside of the schema as json lines and a meta.json with the
+# number of valid rows. Column files grow in chunks of CHUNK_ROWS rows and are only ever appended to.
+# Request handling never waits for the disk: record() only puts the payload into a bounded queue, a background thread
+# writes the rows and drops payloads if it cannot keep up.
+
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from wire_format import SCHEMA, schema_hash
+
+RECORDING_VERSION = 1
+CHUNK_ROWS = 4096
+ARRAY_WIDTH = 16    # padded length of the array datarefs, longer arrays are truncated
+INT_MISSING = np.iinfo(np.int32).min
+ARRAY_MISSING = 255     # length of an array that was not in the payload
+KINDS = ["request", "telemetry"]
+QUEUE_SIZE = 10000
+FLUSH_INTERVAL_S = 1.0
+IDLE_CLOSE_S = 600  # recordings without new rows for this long are closed, a new row reopens them
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"f": np.float32, "d": np.float64, "i": np.int32, "s": np.int32, "vf": np.float32, "vi": np.int32}
+MISSING = {"f": np.nan, "d": np.nan, "i": INT_MISSING, "s": -1, "vf": np.nan, "vi": INT_MISSING}
+
+
+def column_file(index):
+    return f"c{index:03d}.bin"
+
+
+class Column():
+    """
+    Append-only memory-mapped column with rows of width values. The file is grown by chunk_rows rows at a time.
+    """
+    def __init__(self, path, dtype, width=1, rows=0, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.chunk_rows = chunk_rows
+        row_bytes = self.dtype.itemsize * width
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.capacity = max(size // row_bytes, rows, chunk_rows)
+        if size < self.capacity * row_bytes:
+            with open(path, 'ab') as f:
+                f.truncate(self.capacity * row_bytes)
+        self.map = np.memmap(path, dtype=self.dtype, mode='r+', shape=(self.capacity, width))
+
+    def write(self, start, values):
+        end = start + len(values)
+        if end > self.capacity:
+            self.map.flush()
+            del self.map
+            self.capacity = (end // self.chunk_rows + 1) * self.chunk_rows
+            with open(self.path, 'ab') as f:
+                f.truncate(self.capacity * self.dtype.itemsize * self.width)
+            self.map = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(self.capacity, self.width))
+        self.map[start:end] = values.reshape(len(values), self.width)
+
+    def flush(self):
+        self.map.flush()
+
+
+class RecordingWriter():
+    """
+    Writes the rows of a single recording. Only used by the thread of the FlightRecorder.
+    """
+    def __init__(self, path, schema=SCHEMA):
+        self.path = path
+        self.schema = schema
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta["schema_hash"] != schema_hash(schema):
+                raise ValueError(f"Recording {path} was made with a different wire format schema")
+            self.rows = meta["rows"]
+        else:
+            self.rows = 0
+        self.time = Column(os.path.join(path, "time.bin"), np.float64, rows=self.rows)
+        self.kind = Column(os.path.join(path, "kind.bin"), np.uint8, rows=self.rows)
+        self.columns = []   # (Column, length Column or None) per schema entry
+        for i, (name, value_kind) in enumerate(schema):
+            width = ARRAY_WIDTH if value_kind.startswith("v") else 1
+            column = Column(os.path.join(path, column_file(i)), DTYPES[value_kind], width, rows=self.rows)
+            length = Column(os.path.join(path, f"c{i:03d}_len.bin"), np.uint8, rows=self.rows) if width > 1 else None
+            self.columns.append((column, length))
+        self.strings = {}
+        strings_path = os.path.join(path, "strings.jsonl")
+        if os.path.exists(strings_path):
+            with open(strings_path, 'r') as f:
+                self.strings = {json.loads(line): i for i, line in enumerate(f)}
+        self.strings_file = open(strings_path, 'a')
+        self.extras_file = open(os.path.join(path, "extras.jsonl"), 'a')
+        self.last_write = time.monotonic()
+
+    def string_index(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+            self.strings_file.write(json.dumps(text) + "\n")
+        return index
+
+    def append(self, rows):
+        """
+        Parameters:
+        - rows: List of (receive time, kind, payload).
+        """
+        n = len(rows)
+        self.time.write(self.rows, np.array([r[0] for r in rows], dtype=np.float64))
+        self.kind.write(self.rows, np.array([KINDS.index(r[1]) for r in rows], dtype=np.uint8))
+        for (name, value_kind), (column, length) in zip(self.schema, self.columns):
+            values = np.full((n, column.width), MISSING[value_kind], dtype=column.dtype)
+            lengths = np.full(n, ARRAY_MISSING, dtype=np.uint8)
+            for j, (_, _, payload) in enumerate(rows):
+                value = payload.get(name)
+                if value is None:
+                    continue
+                if value_kind == "s":
+                    values[j, 0] = self.string_index(value)
+                elif length is not None:
+                    value = value[:ARRAY_WIDTH]
+                    values[j, :len(value)] = value
+                    lengths[j] = len(value)
+                else:
+                    values[j, 0] = value
+            column.write(self.rows, values)
+            if length is not None:
+                length.write(self.rows, lengths)
+        names = {name for name, _ in self.schema}
+        for _, _, payload in rows:
+            self.extras_file.write(json.dumps({k: v for k, v in payload.items() if k not in names}) + "\n")
+        self.rows += n
+        self.last_write = time.monotonic()
+
+    def flush(self):
+        for column in [self.time, self.kind] + [c for pair in self.columns for c in pair if c is not None]:
+            column.flush()
+        self.strings_file.flush()
+        self.extras_file.flush()
+        # the row count is written last, readers never see rows whose columns are not complete
+        meta = {"version": RECORDING_VERSION, "schema_hash": schema_hash(self.schema), "schema": self.schema,
+                "array_width": ARRAY_WIDTH, "rows": self.rows}
+        with open(os.path.join(self.path, "meta.json.tmp"), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.path, "meta.json.tmp"), os.path.join(self.path, "meta.json"))
+
+    def close(self):
+        self.flush()
+        self.strings_file.close()
+        self.extras_file.close()
+
+
+class FlightRecorder(threading.Thread):
+    """
+    Records payloads into one recording per key (session id or plugin id) below directory.
+    """
+    def __init__(self, directory, queue_size=QUEUE_SIZE, flush_interval_s=FLUSH_INTERVAL_S):
+        super().__init__(daemon=True, name="flight_recorder")
+        self.directory = directory
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.flush_interval_s = flush_interval_s
+        self.writers = {}   # key -> RecordingWriter
+        self.failed = set()     # keys whose recording could not be opened
+        self.recorded = 0
+        self.dropped = 0
+        self.stop_event = threading.Event()
+
+    def record(self, key, kind, payload, t_received=None):
+        # called on the socket thread, must never block
+        try:
+            self.queue.put_nowait((key, time.time() if t_received is None else t_received, kind, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def writer(self, key):
+        writer = self.writers.get(key)
+        if writer is None and key not in self.failed:
+            name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{re.sub(r'[^0-9A-Za-z_-]', '_', key)}"
+            try:
+                writer = self.writers[key] = RecordingWriter(os.path.join(self.directory, name))
+                logger.info(f"Recording {key} to {writer.path}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not open a recording for {key}: {str(e)}")
+                self.failed.add(key)
+        return writer
+
+    def run(self):
+        last_flush = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval_s)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.queue.maxsize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = {}
+            for key, t_received, kind, payload in batch:
+                rows.setdefault(key, []).append((t_received, kind, payload))
+            for key, key_rows in rows.items():
+                writer = self.writer(key)
+                if writer is None:
+                    continue
+                try:
+                    writer.append(key_rows)
+                    self.recorded += len(key_rows)
+                except (OSError, ValueError, TypeError) as e:
+                    logger.error(f"Could not record {len(key_rows)} payloads of {key}: {str(e)}")
+            if time.monotonic() - last_flush >= self.flush_interval_s:
+                self.flush()
+                last_flush = time.monotonic()
+        self.flush()
+
+    def flush(self):
+        now = time.monotonic()
+        for key, writer in list(self.writers.items()):
+            if now - writer.last_write > IDLE_CLOSE_S:
+                writer.close()
+                del self.writers[key]
+            else:
+                writer.flush()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+class Recording():
+    """
+    Read access to a recording. The columns are memory-mapped, so even long recordings open instantly.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        self.schema = [tuple(entry) for entry in meta["schema"]]
+        self.rows = meta["rows"]
+        self.times = self.map("time.bin", np.float64)[:, 0]
+        self.kinds = self.map("kind.bin", np.uint8)[:, 0]
+        self.columns = {}   # name -> (value kind, values, lengths or None)
+        for i, (name, value_kind) in enumerate(self.schema):
+            width = meta["array_width"] if value_kind.startswith("v") else 1
+            values = self.map(column_file(i), DTYPES[value_kind], width)
+            lengths = self.map(f"c{i:03d}_len.bin", np.uint8)[:, 0] if width > 1 else None
+            self.columns[name] = (value_kind, values, lengths)
+        with open(os.path.join(path, "strings.jsonl"), 'r') as f:
+            self.strings = [json.loads(line) for line in f]
+        with open(os.path.join(path, "extras.jsonl"), 'r') as f:
+            self.extras = [json.loads(line) for line, _ in zip(f, range(self.rows))]
+
+    def map(self, file_name, dtype, width=1):
+        if self.rows == 0:
+            return np.zeros((0, width), dtype=dtype)
+        return np.memmap(os.path.join(self.path, file_name), dtype=dtype, mode='r', shape=(self.rows, width))
+
+    def __len__(self):
+        return self.rows
+
+    def kind(self, row):
+        return KINDS[self.kinds[row]]
+
+    def column(self, name):
+        """
+        Returns:
+        - values: All recorded values of a dataref, shape (rows,) or (rows, ARRAY_WIDTH) for arrays. Missing values are
+          NaN, INT_MISSING or -1 for strings.
+        """
+        value_kind, values, _ = self.columns[name]
+        return values if value_kind.startswith("v") else values[:, 0]
+
+    def payload(self, row):
+        """
+        Returns:
+        - payload: The row as the dict the relay received, with the dataref paths as keys.
+        """
+        payload = dict(self.extras[row])
+        for name, (value_kind, values, lengths) in self.columns.items():
+            if lengths is not None:
+                if lengths[row] != ARRAY_MISSING:
+                    payload[name] = values[row, :lengths[row]].tolist()
+                continue
+            value = values[row, 0]
+            if value_kind == "f" or value_kind == "d":
+                if not np.isnan(value):
+                    payload[name] = float(value)
+            elif value_kind == "i":
+                if value != INT_MISSING:
+                    payload[name] = int(value)
+            elif value >= 0:
+                payload[name] = self.strings[value]
+        return payload
@@ -0,0 +1,139 @@
+# Retrieval engine of the relay server. The vector search (FAISS over the chunk embeddings) and the lexical search (BM25)
+# run in parallel, and their result lists are fused with weighted reciprocal rank fusion: a chunk gets
+# weight / (rank + rrf_c) from every list it appears in. With the default weights and rrf_c, the fused order is the same
+# as that of the previous langchain EnsembleRetriever. Optionally, the fused candidates are reranked by a local
+# cross-encoder that scores every (query, chunk) pair jointly, which is slower but better at telling the procedure of the
+# displayed ECAM message apart from procedures that share its vocabulary.
+# With a procedure index (see qrh_chunker.py), alerts whose ECAM titles are all known get their procedures by lookup
+# instead; if only some are known, the looked-up procedures are merged with the search results.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_community.vectorstores import FAISS
+from langchain_community.retrievers import BM25Retriever
+from tracing import add_span
+
+RRF_C = 60
+
+
+class CrossEncoderReranker():
+    """
+    Parameters:
+    - model: Name of a sentence-transformers cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2". Needs the
+      sentence-transformers package, the model is downloaded once and then loaded from the local cache.
+    - top_n: Number of chunks that are kept after reranking.
+    """
+    def __init__(self, model, top_n=5):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model, device="cpu")
+        self.top_n = top_n
+
+    def rerank(self, query, docs):
+        if not docs:
+            return docs
+        scores = self.model.predict([(query, doc.page_content) for doc in docs])
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order[:self.top_n]]
+
+
+def merge_documents(*doc_lists):
+    # concatenation of the lists without the documents that occur in an earlier list
+    seen = set()
+    docs = []
+    for doc_list in doc_lists:
+        for doc in doc_list:
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                docs.append(doc)
+    return docs
+
+
+def reciprocal_rank_fusion(doc_lists, weights, c=RRF_C):
+    """
+    Fuse ranked lists of documents. Documents with the same content are counted as one.
+
+    Returns:
+    - docs: All documents of the lists, sorted by their fused score.
+    """
+    scores = {}
+    docs = {}
+    for doc_list, weight in zip(doc_lists, weights):
+        for rank, doc in enumerate(doc_list, start=1):
+            scores[doc.page_content] = scores.get(doc.page_content, 0.0) + weight / (rank + c)
+            docs.setdefault(doc.page_content, doc)
+    return sorted(docs.values(), key=lambda doc: scores[doc.page_content], reverse=True)
+
+
+class HybridRetriever():
+    """
+    Parameters:
+    - chunks: List of chunk documents.
+    - vectors: List of embedding arrays, one per file, aligned with chunks.
+    - embeddings: Embedding model for the queries.
+    - k: Number of chunks each retriever returns.
+    - weights: Dict of retriever name -> weight in the fusion.
+    - rrf_c: Rank constant of the fusion, larger values flatten the difference between the ranks.
+    - reranker: If given, a CrossEncoderReranker for the fused chunks.
+    - procedure_index: If given, a ProcedureIndex for lookup().
+    - max_workers: Number of searches that can run next to the ones on the calling threads.
+    """
+    def __init__(self, chunks, vectors, embeddings, k=5, weights=None, rrf_c=RRF_C, reranker=None, procedure_index=None,
+                 max_workers=8):
+        text_embeddings = zip([c.page_content for c in chunks], (v for file_vectors in vectors for v in file_vectors))
+        vector_store = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=[c.metadata for c in chunks])
+        bm25_retriever = BM25Retriever.from_documents(chunks)
+        bm25_retriever.k = k
+        self.retrievers = {"vector": vector_store.as_retriever(search_kwargs={"k": k}), "bm25": bm25_retriever}
+        self.weights = weights if weights is not None else {name: 1.0 / len(self.retrievers) for name in self.retrievers}
+        self.rrf_c = rrf_c
+        self.reranker = reranker
+        self.procedure_index = procedure_index
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+
+    def search(self, name, query):
+        t_start = time.perf_counter()
+        docs = self.retrievers[name].invoke(query)
+        return docs, t_start, time.perf_counter()
+
+    def retrieve(self, query, trace=None):
+        """
+        Run all retrievers in parallel, fuse their results and rerank them if a reranker is set. If trace is given, a
+        span is added to it for every retriever and for the fusion and reranking.
+
+        Returns:
+        - docs: The relevant chunks, best first.
+        """
+        names = list(self.retrievers)
+        # the calling thread runs the last search itself instead of waiting idle
+        futures = [self.executor.submit(self.search, name, query) for name in names[:-1]]
+        last = self.search(names[-1], query)
+        results = [future.result() for future in futures] + [last]
+        if trace is not None:
+            for name, (docs, t_start, t_end) in zip(names, results):
+                trace.add(f"retrieval_{name}", t_start, t_end, documents=len(docs))
+
+        t_start = time.perf_counter()
+        docs = reciprocal_rank_fusion([docs for docs, _, _ in results], [self.weights[name] for name in names],
+                                      self.rrf_c)
+        t_start = add_span(trace, "retrieval_fusion", t_start, documents=len(docs))
+        if self.reranker is not None:
+            docs = self.reranker.rerank(query, docs)
+            add_span(trace, "retrieval_rerank", t_start, documents=len(docs))
+        return docs
+
+    def lookup(self, ecam_message, trace=None):
+        """
+        Returns:
+        - docs: The chunks of the procedures of the ECAM titles in ecam_message, empty if there is no procedure index or
+          none of the titles is known.
+        - complete: True if all red and amber titles were found, False if some (or all) need the search.
+        """
+        if self.procedure_index is None:
+            return [], False
+        t_start = time.perf_counter()
+        docs, complete = self.procedure_index.lookup(ecam_message)
+        add_span(trace, "retrieval_lookup", t_start, documents=len(docs), complete=complete)
+        return docs, complete
+
+    def invoke(self, query):
+        return self.retrieve(query)
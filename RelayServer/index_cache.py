@@ -0,0 +1,109 @@
+# Content-addressed on-disk store for the RAG index.
+# Every markdown file is split and embedded only once. The resulting chunks (which also form the BM25 corpus) and their
+# embedding vectors are saved under a key that is derived from the file content, the splitter settings (including the
+# chunker and its version) and the embedding provider, so changing any of those automatically invalidates the affected
+# entries: an entry built with other settings is never found under the key of the current ones. The settings are
+# stored with every entry for inspection.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from langchain_core.documents import Document
+from rag_manifest import file_sha256
+
+
+class IndexCache():
+    def __init__(self, cache_dir, chunk_size, chunk_overlap, embedding_provider, chunker="markdown"):
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.chunker = chunker  # e.g. "qrh-1-4000" for version 1 of the QRH chunker with 4000 characters per chunk
+        self.embedding_provider = embedding_provider    # e.g. "openai:text-embedding-ada-002"
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def settings(self):
+        return {"chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "chunker": self.chunker,
+                "embedding_provider": self.embedding_provider}
+
+    def file_key(self, file_path, content_sha256=None):
+        """
+        Compute the cache key of a markdown file.
+
+        Parameters:
+        - file_path: Path to the markdown file.
+        - content_sha256: Known sha256 of the file content (e.g. from the manifest), the file is hashed if omitted.
+
+        Returns:
+        - key: Hex digest over the file content and the index settings.
+        """
+        if content_sha256 is None:
+            content_sha256 = file_sha256(file_path)
+        sha = hashlib.sha256(json.dumps(self.settings(), sort_keys=True).encode())
+        sha.update(content_sha256.encode())
+        return sha.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Load the chunks and embedding vectors stored under key.
+
+        Returns:
+        - (chunks, vectors) where vectors is a read-only memory-mapped float32 array, or None if there is no entry.
+        """
+        entry_dir = self.entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return None
+
+        try:
+            with open(os.path.join(entry_dir, "chunks.json"), 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            vectors = np.load(os.path.join(entry_dir, "vectors.npy"), mmap_mode='r')
+        except (OSError, ValueError):
+            return None     # a broken entry is treated like a missing one and gets rebuilt
+
+        if len(records) != vectors.shape[0]:
+            return None
+
+        chunks = [Document(page_content=r["page_content"], metadata=r["metadata"]) for r in records]
+        return chunks, vectors
+
+    def save(self, key, chunks, vectors):
+        """
+        Store chunks and their embedding vectors under key. The entry is written to a temporary directory first and
+        then renamed, so a crash never leaves a half-written entry behind.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            with open(os.path.join(tmp_dir, "chunks.json"), 'w', encoding='utf-8') as f:
+                json.dump([{"page_content": c.page_content, "metadata": c.metadata} for c in chunks], f)
+            np.save(os.path.join(tmp_dir, "vectors.npy"), vectors)
+            with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump(self.settings() | {"num_chunks": len(chunks)}, f)
+
+            entry_dir = self.entry_dir(key)
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def prune(self, keep_keys):
+        """
+        Delete all entries that are not in keep_keys (e.g. files that were changed or removed).
+        """
+        keep_keys = set(keep_keys)
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name not in keep_keys:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+                removed += 1
+        return removed
@@ -0,0 +1,141 @@
+# LLM backends of the relay server. All generation in main.py goes through LLMBackend.complete, so the provider can be
+# swapped without touching the prompts:
+# - "openai": the OpenAI chat completion API, or any OpenAI-compatible server via base_url (e.g. mock_llm_server.py).
+# - "replay": answers in-process with recorded completions and a configurable latency model, without any network. Used
+#   to measure the overhead of the relay itself (retrieval, prompt formatting, zmq) separately from provider latency.
+
+import json
+import time
+from abc import ABC, abstractmethod
+from openai import OpenAI
+
+LLM_BACKENDS = ["openai", "replay"]
+RECORDED_COMPLETIONS_PATH = "./data/recorded_completions.json"
+
+
+def add_usage(usage, completion_usage):
+    if usage is None or completion_usage is None:
+        return
+    usage["calls"] = usage.get("calls", 0) + 1
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + completion_usage.prompt_tokens
+    usage["completion_tokens"] = usage.get("completion_tokens", 0) + completion_usage.completion_tokens
+    # prompt tokens of a prefix the provider had cached, e.g. the pinned situation of a conversation
+    details = getattr(completion_usage, "prompt_tokens_details", None)
+    if details is not None and getattr(details, "cached_tokens", None):
+        usage["cached_tokens"] = usage.get("cached_tokens", 0) + details.cached_tokens
+
+
+class LLMBackend(ABC):
+    def __init__(self, model):
+        self.model = model
+
+    @abstractmethod
+    def complete(self, messages, on_chunk=None, usage=None):
+        """
+        Run a chat completion. If on_chunk is given, the completion is streamed and on_chunk is called with every text
+        delta as soon as it arrives. If usage is given, the token counts of the call are added to it.
+
+        Returns:
+        - response: The complete response text.
+        """
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, model, api_key=None, base_url=None):
+        super().__init__(model)
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    def complete(self, messages, on_chunk=None, usage=None):
+        if on_chunk is None:
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages
+            )
+            add_usage(usage, completion.usage)
+            return completion.choices[0].message.content
+
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        response = []
+        for chunk in stream:
+            add_usage(usage, chunk.usage)   # only set on the last chunk
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                response.append(delta)
+                on_chunk(delta)
+        return "".join(response)
+
+
+class TokenUsage():
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class ReplayBackend(LLMBackend):
+    def __init__(self, model, recordings_path=RECORDED_COMPLETIONS_PATH, time_to_first_token_s=0.5, tokens_per_s=50.0,
+                 words_per_chunk=1):
+        """
+        Parameters:
+        - recordings_path: Json file with a list of {"match": ..., "content": ...}. The first recording whose match
+          string occurs in the system or last user message is replayed, the last recording is the fallback.
+        - time_to_first_token_s: Delay before the first chunk (or the whole answer, if not streamed).
+        - tokens_per_s: Generation speed after the first token. Words are counted as tokens.
+        - words_per_chunk: Number of words that are sent per streamed chunk.
+        """
+        super().__init__(model)
+        with open(recordings_path, 'r') as f:
+            self.recordings = json.load(f)
+        self.time_to_first_token_s = time_to_first_token_s
+        self.tokens_per_s = tokens_per_s
+        self.words_per_chunk = words_per_chunk
+
+    def find_recording(self, messages):
+        text = messages[0]["content"] + "\n" + messages[-1]["content"]
+        for recording in self.recordings:
+            if recording["match"] in text:
+                return recording["content"]
+        return self.recordings[-1]["content"]
+
+    def chunks(self, content):
+        words = content.split(' ')
+        for start in range(0, len(words), self.words_per_chunk):
+            chunk = ' '.join(words[start:start + self.words_per_chunk])
+            yield chunk + ' ' if start + self.words_per_chunk < len(words) else chunk
+
+    def complete(self, messages, on_chunk=None, usage=None):
+        content = self.find_recording(messages)
+        n_tokens = len(content.split())
+        time.sleep(self.time_to_first_token_s)
+        if on_chunk is None:
+            time.sleep(n_tokens / self.tokens_per_s)
+        else:
+            for i, chunk in enumerate(self.chunks(content)):
+                if i > 0:
+                    time.sleep(self.words_per_chunk / self.tokens_per_s)
+                on_chunk(chunk)
+        add_usage(usage, TokenUsage(sum(len(m["content"].split()) for m in messages), n_tokens))
+        return content
+
+
+def create_backend(backend, model, base_url=None, **kwargs):
+    """
+    Create the LLM backend of the relay server.
+
+    Parameters:
+    - backend: One of LLM_BACKENDS.
+    - model: Model name that is passed to the provider.
+    - base_url: URL of an OpenAI-compatible server for the "openai" backend, None for the OpenAI API.
+    - kwargs: Additional parameters of the backend class (e.g. the latency model of ReplayBackend).
+    """
+    if backend == "openai":
+        return OpenAIBackend(model, base_url=base_url, **kwargs)
+    if backend == "replay":
+        return ReplayBackend(model, **kwargs)
+    raise ValueError(f"Unknown LLM backend '{backend}', expected one of {LLM_BACKENDS}")
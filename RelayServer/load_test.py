@@ -0,0 +1,80 @@
+# Load test for the relay server. Simulates several cockpits (each with its own REQ or DEALER socket)
+# that send the mock_xp_plugin.py payload to a running relay server and reports latency percentiles and throughput.
+# Usage: python3 load_test.py --clients 4 --requests 5 [--stream]
+
+import argparse
+import json
+import threading
+import time
+import numpy as np
+import zmq
+from mock_xp_plugin import DATA, SERVER_URI, connect, send_request, stream_request
+
+TEXT_ENTRY_DATA = {'trigger_source': 'text_entry', 'message': 'What should I do if there does not seem to be an engine fire?'}
+ARM_DATA = {'trigger_source': 'arm'}
+
+
+def run_cockpit(context, server_uri, n_requests, follow_up, stream, latencies, first_token_latencies, errors):
+    socket = connect(context, server_uri, zmq.DEALER if stream else zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, 120 * 1000)     # don't hang forever if the relay dies
+    socket.setsockopt(zmq.LINGER, 0)
+    try:
+        if stream:
+            socket.send_multipart([b"", json.dumps(ARM_DATA).encode('utf-8')])
+            socket.recv_multipart()
+        else:
+            send_request(socket, ARM_DATA)
+        for _ in range(n_requests):
+            data = TEXT_ENTRY_DATA if (follow_up and latencies) else DATA
+            t_start = time.perf_counter()
+            if stream:
+                for _ in stream_request(socket, data):
+                    if len(first_token_latencies) == len(latencies):
+                        first_token_latencies.append(time.perf_counter() - t_start)
+            else:
+                send_request(socket, data)
+            latencies.append(time.perf_counter() - t_start)
+    except zmq.ZMQError as e:
+        errors.append(str(e))
+    finally:
+        socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the relay server")
+    parser.add_argument("--clients", type=int, default=4, help="number of simulated cockpits")
+    parser.add_argument("--requests", type=int, default=5, help="number of requests per cockpit")
+    parser.add_argument("--server", default=SERVER_URI, help="address of the relay server")
+    parser.add_argument("--follow-up", action="store_true", help="send text entry follow ups after the first alert")
+    parser.add_argument("--stream", action="store_true", help="request streamed answers and also report the time to first token")
+    args = parser.parse_args()
+
+    context = zmq.Context()
+    latencies = [[] for _ in range(args.clients)]
+    first_token_latencies = [[] for _ in range(args.clients)]
+    errors = []
+    threads = [threading.Thread(target=run_cockpit, args=(context, args.server, args.requests, args.follow_up, args.stream,
+                                                          latencies[i], first_token_latencies[i], errors))
+               for i in range(args.clients)]
+
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall_time = time.perf_counter() - t_start
+
+    all_latencies = np.array([l for cockpit in latencies for l in cockpit])
+    print(f"Cockpits: {args.clients}, requests per cockpit: {args.requests}, completed: {len(all_latencies)}, errors: {len(errors)}")
+    if len(all_latencies):
+        print(f"Latency p50: {np.percentile(all_latencies, 50):.3f} s, p99: {np.percentile(all_latencies, 99):.3f} s, max: {all_latencies.max():.3f} s")
+        all_first_token = np.array([l for cockpit in first_token_latencies for l in cockpit])
+        if len(all_first_token):
+            print(f"Time to first token p50: {np.percentile(all_first_token, 50):.3f} s, p99: {np.percentile(all_first_token, 99):.3f} s")
+        print(f"Throughput: {len(all_latencies) / wall_time:.2f} requests/s over {wall_time:.1f} s")
+    for e in errors:
+        print(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
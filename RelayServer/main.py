@@ -1,150 +1,227 @@
 from find_airport import AirportFinder
+from index_cache import IndexCache
+from rag_manifest import load_manifest_hashes
+from sessions import SessionStore, RequestCancelled
+from embeddings import setup_embeddings
+from conversation_memory import load_tokenizer
+from llm_backend import create_backend
+from tracing import Trace, add_span
+from flight_monitor import FlightMonitor, LLMBudget
+from flight_recorder import FlightRecorder
+from wire_format import WireDecoder, is_binary, schema_hash, WIRE_VERSION
+from metrics import RelayMetrics, MetricsLogger, start_metrics_server
+from response_cache import ResponseCache, normalize_ecam_text, flight_state_buckets
+from metar import METAR_BASE_URL, MetarFetcher, MetarRefresher
+from prompt_schema import CompiledSchema, EcamFormatter, FLIGHT_DATA_SCHEMA
+from async_logging import LogPipeline, RequestLog
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+from collections import OrderedDict
 from datetime import datetime
 from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import MarkdownTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
+from hybrid_retriever import HybridRetriever, CrossEncoderReranker, merge_documents
+from qrh_chunker import split_procedures, ProcedureIndex, QRH_CHUNKER_VERSION
 # from langchain.schema import Document
 from dotenv import load_dotenv
-from openai import OpenAI
 # from builtins import open
 import zmq
 import json
-# import time
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 MODEL_NAME = "gpt-4o"   # for model strings see: https://platform.openai.com/docs/models
+RESPONSE_MODES = ["two_stage", "concise"]
+RESPONSE_MODE = "two_stage"     # "two_stage" generates a verbose answer and shortens it in a second LLM call, "concise" produces the short answer in a single call. Can be overridden per request with "response_mode"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")    # Your OpenAI API key needs to be saved as a system variable
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")    # one of LLM_BACKENDS in llm_backend.py, "replay" answers with recorded completions without any network
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")    # OpenAI-compatible server for the "openai" backend, e.g. http://127.0.0.1:8002/v1 for mock_llm_server.py
 
 MD_RAG_FILE_PATH = "./data/md_rag_files/"   # when adding new pdf files, make sure to run pdf2md.py file to generate markdown files. Does not work for scanned pdf without OCR. In this case, we recommend tools like Nougat, although the success might be limited
+RAG_CACHE_PATH = "./data/rag_cache/"    # chunks and embeddings of the markdown files are cached here, delete the directory to force a full rebuild
+CHUNKER = "qrh"     # "qrh" keeps every section (procedure) of the markdown files in one chunk, see qrh_chunker.py, "markdown" splits them every CHUNK_SIZE characters
+MAX_PROCEDURE_CHARS = 4000  # longer sections are split between checklist items
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+EMBEDDING_PROVIDER = "openai"   # one of EMBEDDING_PROVIDERS, "local" runs a sentence-transformers model on the CPU and works offline
+EMBEDDING_MODEL = "text-embedding-ada-002"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"    # used for EMBEDDING_PROVIDER = "local"
+EMBEDDING_BATCH_SIZE = 64
+QUERY_EMBEDDING_CACHE_SIZE = 1024   # embeddings of recent retrieval prompts are kept, they repeat for the same ECAM state
 
 APT_FINDER = AirportFinder("./data/all_apts.csv", "./data/metars.csv")
 NO_METAR_MSG = "No METAR available"
+METAR_REFRESH_INTERVAL_S = 1800     # the METARs of all candidate airports are refreshed in the background, set to 0 to only use ./data/metars.csv
+METAR_MAX_AGE_S = 2 * 3600     # METARs observed longer ago (also those of ./data/metars.csv) are shown as not available, most stations report every hour
 
 ECAM_COLORS = ["w", "g", "b", "a", "r"]
 ECAM_FULL_COLORS = ["white", "green", "blue", "amber", "red"]
 ECAM_LINES = [1, 2, 3, 4, 5, 6, 7]
-ECAM_DREFS = [f"AirbusFBW/EWD{l}{c}Text" for l in ECAM_LINES for c in ECAM_COLORS]
-
-FLIGHT_DREFS = ["sim/flightmodel/position/latitude",
-                "sim/flightmodel/position/longitude",
-                "sim/flightmodel/position/elevation",
-                "sim/flightmodel/position/y_agl",
-                "sim/flightmodel/position/mag_psi",
-                "toliss_airbus/pfdoutputs/captain/pitch_angle",
-                "toliss_airbus/pfdoutputs/captain/roll_angle",
-                "sim/flightmodel/position/alpha",
-                "sim/flightmodel/position/beta",
-                "sim/flightmodel/position/indicated_airspeed",
-                "sim/flightmodel/position/groundspeed",
-                "sim/flightmodel/position/vh_ind_fpm",
-                "AirbusFBW/fmod/eng/N1Array",
-                "sim/flightmodel2/controls/flap1_deploy_ratio",
-                "sim/flightmodel2/controls/flap2_deploy_ratio",
-                "AirbusFBW/SlatPositionLWing", 
-                "AirbusFBW/SlatPositionRWing",
-                "AirbusFBW/RightGearInd",
-                "AirbusFBW/LeftGearInd",
-                "AirbusFBW/NoseGearInd",
-                "sim/flightmodel2/gear/on_ground",  # array where [0] is nose gear, [1] is left gear, [2] is right gear
-                "sim/flightmodel/weight/m_fuel_total", 
-                "toliss_airbus/fuelTankContent_kgs", # array where [0] is center tank, [1] is left inner tank, [2] right inner tank, [3] is left tip tank, [4] is right tip tank
-                "AirbusFBW/AP1Engage",
-                "AirbusFBW/AP2Engage",
-                "AirbusFBW/ATHRmode",   # >0 indicates that athr is activated    
-                "sim/cockpit2/temperature/outside_air_temp_deg",
-                "sim/cockpit2/gauges/indicators/wind_heading_deg_mag",
-                "sim/cockpit2/gauges/indicators/wind_speed_kts",
-                ]
-
-CHAT_HISTORY = []
+ECAM_FORMATTER = EcamFormatter(ECAM_LINES, ECAM_COLORS, ECAM_FULL_COLORS)
+FLIGHT_DATA_FORMATTER = CompiledSchema(FLIGHT_DATA_SCHEMA)   # the flight data lines of the alert and health prompts
+ECAM_DREFS = ECAM_FORMATTER.datarefs
+FLIGHT_DREFS = FLIGHT_DATA_FORMATTER.datarefs
+PROMPT_SINK = None  # called with the title and text of every formatted alert and health prompt, e.g. print_prompt to echo them to the console
+
+ERROR_RESPONSE = "I apologize, but I encountered an error while generating the response. Please try asking a simpler question or rephrasing your query."
+
+RESPONSE_CACHE_SIZE = 256     # number of answers to alerts and queries that are kept, set to 0 to disable the cache
+RESPONSE_CACHE_TTL_S = 3600
+RESPONSE_CACHE_SIMILARITY = 0.97    # minimum cosine similarity of the ECAM messages for a near match
+
+SERVER_BIND_URI = "tcp://*:5555"
+REPLY_URI = "inproc://replies"  # workers hand their replies back to the socket thread through this
+NUM_WORKERS = 8     # number of requests that are answered concurrently
+TELEMETRY_BIND_URI = "tcp://*:5556"     # the plugins publish their flight data here for the flight health monitor
+ADVISORY_BIND_URI = "tcp://*:5557"  # advisories of the flight health monitor are published here, the topic is the plugin id
+ADVISORY_URI = "inproc://advisories"    # workers hand the LLM health assessments back to the socket thread through this
+MONITOR_ENABLED = True
+MONITOR_LLM_CALLS_PER_HOUR = 6  # budget of LLM health assessments of all plugins together
+MONITOR_LLM_BURST = 2
+MONITOR_COOLDOWN_S = 300    # minimum time between two LLM health assessments of the same plugin
+MAX_MONITORS = 256  # flight health monitors kept, the one of the plugin that sent telemetry least recently is dropped first
+RECORDINGS_PATH = "./recordings/"   # every received payload is recorded here per session, see replay_recording.py
+RECORDING_ENABLED = True
+RECORD_TELEMETRY = True     # also record the continuous flight data of the flight health monitor, one recording per plugin
+METRICS_PORT = 9102     # Prometheus metrics on http://127.0.0.1:9102/metrics, set to 0 to disable
+METRICS_LOG_INTERVAL_S = 300    # interval of the latency summary in the log, set to 0 to disable
+RETRIEVAL_K = 5     # chunks returned by the vector and the BM25 search each
+RETRIEVAL_WEIGHTS = {"vector": 0.5, "bm25": 0.5}    # weights of the reciprocal rank fusion
+RETRIEVAL_RRF_C = 60
+RERANK_MODEL = None     # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2" to rerank the fused chunks on the CPU (requires sentence-transformers)
+RERANK_TOP_N = 5    # chunks kept after reranking
+ECAM_TITLE_LOOKUP = True    # alerts and queries whose ECAM titles are known procedures skip the similarity search (needs CHUNKER = "qrh")
+LOG_QUEUE_SIZE = 10000     # log records waiting for the background writer, further records are dropped instead of delaying requests
+REQUEST_LOG_SAMPLE_RATE = 1.0   # share of the requests whose payload, context, prompt and answers are written to the json lines request log, traces are written for all
+REQUEST_LOG_MAX_FIELD_CHARS = 4000  # longer strings in the request log are truncated
+REQUEST_LOG_REDACT = []     # fields that are replaced by their length in the request log, e.g. "message" for the text entries of the pilots
+HISTORY_TOKEN_BUDGET = 6000     # tokens of the conversation history sent with a text entry follow-up, older turns are summarized
+
+SESSIONS = SessionStore(history_token_budget=HISTORY_TOKEN_BUDGET)
+METRICS = RelayMetrics()
+MONITORS = OrderedDict()    # plugin id -> FlightMonitor, in order of the last telemetry sample
+RECORDER = None     # FlightRecorder, started in main() if RECORDING_ENABLED
+MONITOR_BUDGET = LLMBudget(MONITOR_LLM_CALLS_PER_HOUR, MONITOR_LLM_BURST, MONITOR_COOLDOWN_S)
+REQUEST_OBSERVERS = []  # functions that are called with (payload, trace) after every answered request, e.g. by benchmark_pipeline.py
+RESPONSE_CACHE = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl_s=RESPONSE_CACHE_TTL_S, similarity_threshold=RESPONSE_CACHE_SIMILARITY)
 
 load_dotenv()
 
 def setup_logging():
+    # records are written by a background thread, see async_logging.py
     log_directory = "logs"
     if not os.path.exists(log_directory):
         os.makedirs(log_directory)
 
-    log_file = os.path.join(log_directory, f"{MODEL_NAME}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+    log_name = f"{MODEL_NAME}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    pipeline = LogPipeline(os.path.join(log_directory, f"{log_name}.log"),
+                           os.path.join(log_directory, f"{log_name}_requests.jsonl"),
+                           max_field_chars=REQUEST_LOG_MAX_FIELD_CHARS, redact_fields=REQUEST_LOG_REDACT,
+                           queue_size=LOG_QUEUE_SIZE)
+    pipeline.start()
+    return pipeline
 
-    file_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
-    file_handler.setLevel(logging.DEBUG)
+LOG_PIPELINE = setup_logging()
+logger = logging.getLogger()
+REQUEST_LOG = RequestLog(REQUEST_LOG_SAMPLE_RATE)
 
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-
-    return logger
-
-logger = setup_logging()
-
-def load_markdown_documents(directory):
-    documents = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.md'):
-            file_path = os.path.join(directory, filename)
-            loader = TextLoader(file_path)
-            documents.extend(loader.load())
-            logger.info(f"Loaded {len(documents)} Markdown documents from {directory}")
-    return documents
+def load_markdown_document(file_path):
+    loader = TextLoader(file_path)
+    return loader.load()
 
 def split_documents(documents):
-    text_splitter = MarkdownTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = text_splitter.split_documents(documents)
+    text_splitter = MarkdownTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    if CHUNKER == "qrh":
+        chunks = [chunk for document in documents for chunk in split_procedures(document, text_splitter, MAX_PROCEDURE_CHARS)]
+    else:
+        chunks = text_splitter.split_documents(documents)
     logger.info(f"Split documents into {len(chunks)} chunks")
     return chunks
 
-def create_ensemble_retriever(chunks):
+def setup_embedding_model():
+    model = LOCAL_EMBEDDING_MODEL if EMBEDDING_PROVIDER == "local" else EMBEDDING_MODEL
+    return setup_embeddings(EMBEDDING_PROVIDER, model, EMBEDDING_BATCH_SIZE, QUERY_EMBEDDING_CACHE_SIZE)
+
+def build_index(directory, embeddings):
+    """
+    Collect the chunks and embedding vectors of all markdown files in directory. Files that were indexed before with the
+    same content and settings are loaded from the on-disk cache, only new or changed files are split and embedded.
+
+    Returns:
+    - chunks: List of all chunk documents.
+    - vectors: List of embedding arrays, one per file, aligned with chunks.
+    """
+    chunker = f"qrh-{QRH_CHUNKER_VERSION}-{MAX_PROCEDURE_CHARS}" if CHUNKER == "qrh" else CHUNKER
+    cache = IndexCache(RAG_CACHE_PATH, CHUNK_SIZE, CHUNK_OVERLAP, embeddings.provider_id, chunker)
+    manifest_hashes = load_manifest_hashes(directory)     # files converted by pdf2md.py don't need to be hashed again
+    chunks = []
+    vectors = []
+    keys = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.md'):
+            continue
+        file_path = os.path.join(directory, filename)
+        key = cache.file_key(file_path, manifest_hashes.get(filename))
+        keys.append(key)
+
+        cached = cache.load(key)
+        if cached is not None:
+            file_chunks, file_vectors = cached
+            logger.info(f"Loaded {len(file_chunks)} cached chunks for {filename}")
+        else:
+            file_chunks = split_documents(load_markdown_document(file_path))
+            file_vectors = np.asarray(embeddings.embed_documents([c.page_content for c in file_chunks]), dtype=np.float32)
+            cache.save(key, file_chunks, file_vectors)
+            logger.info(f"Embedded {len(file_chunks)} chunks for {filename}")
+
+        chunks.extend(file_chunks)
+        vectors.append(file_vectors)
+
+    removed = cache.prune(keys)
+    if removed:
+        logger.info(f"Removed {removed} stale entries from the index cache")
+    logger.info(f"Index contains {len(chunks)} chunks from {len(keys)} Markdown documents in {directory}")
+    return chunks, vectors
+
+def create_hybrid_retriever(chunks, vectors, embeddings, rerank_model=RERANK_MODEL):
     try:
-        # Create FAISS vector store
-        embeddings = OpenAIEmbeddings()
-        vector_store = FAISS.from_documents(chunks, embeddings)
-        vector_retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-
-        # Create BM25 retriever
-        bm25_retriever = BM25Retriever.from_documents(chunks)
-        bm25_retriever.k = 5
-
-        # Create ensemble retriever
-        ensemble_retriever = EnsembleRetriever(
-            retrievers=[vector_retriever, bm25_retriever],
-            weights=[0.5, 0.5]
-        )
-        
-        logger.info("Created ensemble retriever")
-        return ensemble_retriever
+        reranker = CrossEncoderReranker(rerank_model, RERANK_TOP_N) if rerank_model else None
+        procedure_index = ProcedureIndex(chunks) if ECAM_TITLE_LOOKUP else None
+        # FAISS vector store from the precomputed embeddings and BM25, searched in parallel
+        hybrid_retriever = HybridRetriever(chunks, vectors, embeddings, k=RETRIEVAL_K, weights=RETRIEVAL_WEIGHTS,
+                                           rrf_c=RETRIEVAL_RRF_C, reranker=reranker, procedure_index=procedure_index,
+                                           max_workers=NUM_WORKERS)
+        logger.info(f"Created hybrid retriever{' with reranking by ' + rerank_model if rerank_model else ''}"
+                    f"{f', {len(procedure_index)} procedures by ECAM title' if procedure_index is not None else ''}")
+        return hybrid_retriever
     except ImportError as e:
         logger.error(f"Import error: {str(e)}. Make sure all required packages are installed.")
         raise
     except Exception as e:
-        logger.error(f"Error creating ensemble retriever: {str(e)}")
+        logger.error(f"Error creating hybrid retriever: {str(e)}")
         raise
 
 def setup_gpt_client():
-    logger.info("Setting up OpenAI client")
+    logger.info(f"Setting up {LLM_BACKEND} LLM backend")
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        logger.info("OpenAI client set up successfully")
+        if LLM_BACKEND == "openai":
+            # an OpenAI-compatible server like mock_llm_server.py does not check the key
+            api_key = OPENAI_API_KEY or ("unused" if LLM_BASE_URL else None)
+            client = create_backend(LLM_BACKEND, MODEL_NAME, LLM_BASE_URL, api_key=api_key)
+        else:
+            client = create_backend(LLM_BACKEND, MODEL_NAME)
+        logger.info(f"LLM backend set up successfully ({MODEL_NAME}{' at ' + LLM_BASE_URL if LLM_BASE_URL else ''})")
         return client
     except Exception as e:
-        logger.error(f"Failed to set up OpenAI client: {str(e)}")
+        logger.error(f"Failed to set up LLM backend: {str(e)}")
         raise
 
-def generate_gpt_response(client, context, question, history):
+def create_completion(client, messages, on_chunk=None, usage=None):
+    return client.complete(messages, on_chunk, usage)
+
+def generate_gpt_response(client, context, question, history, on_chunk=None, usage=None):
     messages = [
         {"role": "system", "content": "You are a pilot assistant to help the pilots of an Airbus A320 in stressful abnormal situations. Therefore, it is important that you provide concise and only immediateley relevant information to the pilots. Your primary source of information should be the provided markdown documents. However, you can also use additional information you have about aviation, if you deem it necessary. If the context doesn't contain relevant information, say so."},
         *history,
@@ -152,118 +229,74 @@ def generate_gpt_response(client, context, question, history):
     ]
     
     try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages
-        )
-        response = completion.choices[0].message.content
+        response = create_completion(client, messages, on_chunk, usage)
         return response
+    except RequestCancelled:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
-        return "I apologize, but I encountered an error while generating the response. Please try asking a simpler question or rephrasing your query."
+        response = ERROR_RESPONSE
+        if on_chunk is not None:
+            on_chunk(response)
+        return response
 
-def shorten_gpt_response(client, long_response):
+def shorten_gpt_response(client, long_response, on_chunk=None, usage=None):
     messages = [
         {"role": "system", "content": "You are a pilot assistant to help the pilots of an Airbus A320 in stressful abnormal situations. Therefore, it is important that you provide concise and only immediately relevant information to the pilots. You are provided with the verbose output of another model and your goal is to shorten this output as much as possible while keeping original structure in place. Keep in mind that you are producing output for trained A320 pilots. If the verbose text contains justifications for recommendations, make sure to include those justifications. You can shorten the language to the extent where your output does not include full sentences, but you cannot compromise on important content."},
         {"role": "user", "content": f"Verbos Response: {long_response}"}
     ]
     
     try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages
-        )
-        response = completion.choices[0].message.content
+        response = create_completion(client, messages, on_chunk, usage)
         # logger.info(f"Generated response: {response}")
         return response
+    except RequestCancelled:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
-        return "I apologize, but I encountered an error while generating the response. Please try asking a simpler question or rephrasing your query."
+        response = ERROR_RESPONSE
+        if on_chunk is not None:
+            on_chunk(response)
+        return response
     
 
-def format_ecam_message(ecam_data):
-    left_ecam_msgs = []
-    right_ecam_msgs = []
-    
-    for l in ECAM_LINES:
-        left_msg = None
-        right_msg = None
-        padded_colored_messages = []
-        for c in ECAM_COLORS:
-            padded_colored_messages.append(ecam_data[f"AirbusFBW/EWD{l}{c}Text"].ljust(48))
-        
-        #split in left and right
-        left_padded_colored_messages = [pcm[:24] for pcm in padded_colored_messages]
-        right_padded_colored_messages = [pcm[24:] for pcm in padded_colored_messages]
-        
-        for i,c in enumerate(ECAM_FULL_COLORS):   #invert the priority
-            if sum(1 for char in left_padded_colored_messages[i] if char != ' ') > 0:
-                left_msg = left_padded_colored_messages[i].rstrip().upper() + f" ({c})"
-            if sum(1 for char in right_padded_colored_messages[i] if char != ' ') > 0:    
-                right_msg = right_padded_colored_messages[i].rstrip().upper() + f" ({c})"
-        
-        if left_msg is not None:
-            left_ecam_msgs.append(left_msg)
-        if right_msg is not None:
-            right_ecam_msgs.append(right_msg)
+def summarize_conversation(client, messages):
+    # runs on the background thread of the conversation memory, errors are handled there
+    conversation = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    messages = [
+        {"role": "system", "content": "You are a pilot assistant to help the pilots of an Airbus A320 in stressful abnormal situations. You are provided with an earlier part of your conversation with the pilots. Summarize it as briefly as possible for your own later reference. Keep all questions of the pilots, decisions, values and recommendations that could still be relevant, and leave out everything else."},
+        {"role": "user", "content": f"Conversation: {conversation}"}
+    ]
+    return create_completion(client, messages)
+
+def generate_concise_gpt_response(client, context, question, history, on_chunk=None, usage=None):
+    # single pass alternative to generate_gpt_response + shorten_gpt_response
+    messages = [
+        {"role": "system", "content": "You are a pilot assistant to help the pilots of an Airbus A320 in stressful abnormal situations. Therefore, it is important that you provide concise and only immediately relevant information to the pilots. Your primary source of information should be the provided markdown documents. However, you can also use additional information you have about aviation, if you deem it necessary. If the context doesn't contain relevant information, say so. Keep in mind that you are producing output for trained A320 pilots. Keep your answer as short as possible: your output does not need to consist of full sentences, but you cannot compromise on important content. If you give recommendations, include short justifications for them."},
+        *history,
+        {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
+    ]
     
-    # build final ECAM messges
-    final_ecam_msg = '\n'.join(left_ecam_msgs+right_ecam_msgs)
+    try:
+        response = create_completion(client, messages, on_chunk, usage)
+        return response
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating response: {str(e)}")
+        response = ERROR_RESPONSE
+        if on_chunk is not None:
+            on_chunk(response)
+        return response
     
-    return final_ecam_msg
+
+def format_ecam_message(ecam_data):
+    # ecam_data can be the whole payload, only the ECAM datarefs are read
+    return ECAM_FORMATTER(ecam_data)
 
 def format_flight_data(flight_data):
-    fligh_data_msgs = []
-    
-    def ldg_pos_str(ldg_ind):
-        if ldg_ind == 0:
-            pos = "Up"
-        elif ldg_ind == 1:
-            pos = "Changing"
-        elif ldg_ind == 2:
-            pos = "Down"
-        elif ldg_ind == 3:
-            pos = "Changing"
-        else:
-            pos = "Unknown"
-            
-        return pos
-        
-    fligh_data_msgs.append(f"Latitude: {flight_data['sim/flightmodel/position/latitude']:.6f} deg")
-    fligh_data_msgs.append(f"Longitude: {flight_data['sim/flightmodel/position/longitude']:.6f} deg")
-    fligh_data_msgs.append(f"Altitde MSL: {int(flight_data['sim/flightmodel/position/elevation'] * 3.28084)} ft")
-    fligh_data_msgs.append(f"Altitde AGL: {int(flight_data['sim/flightmodel/position/y_agl'] * 3.28084)} ft")
-    fligh_data_msgs.append(f"Magnetic Heading: {flight_data['sim/flightmodel/position/mag_psi']:.1f} deg")
-    fligh_data_msgs.append(f"Pitch Angle: {flight_data['toliss_airbus/pfdoutputs/captain/pitch_angle']:.1f} deg")
-    fligh_data_msgs.append(f"Roll Angle: {flight_data['toliss_airbus/pfdoutputs/captain/roll_angle']:.1f} deg")
-    fligh_data_msgs.append(f"Angle of Attack: {flight_data['sim/flightmodel/position/alpha']:.1f} deg")
-    fligh_data_msgs.append(f"Sideslip Angle: {flight_data['sim/flightmodel/position/beta']:.1f} deg")
-    fligh_data_msgs.append(f"Inidcated Airspeed: {flight_data['sim/flightmodel/position/indicated_airspeed']:.1f} kt")
-    fligh_data_msgs.append(f"Groundspeed: {flight_data['sim/flightmodel/position/groundspeed'] * 1.94384:.1f} kt")
-    fligh_data_msgs.append(f"Vertical Speed: {int(flight_data['sim/flightmodel/position/vh_ind_fpm'])} ft/min")
-    fligh_data_msgs.append(f"Left N1: {flight_data['AirbusFBW/fmod/eng/N1Array'][0]:.1f}%")
-    fligh_data_msgs.append(f"Right N1: {flight_data['AirbusFBW/fmod/eng/N1Array'][1]:.1f}%")
-    fligh_data_msgs.append(f"Left Flaps Deployment: {flight_data['sim/flightmodel2/controls/flap1_deploy_ratio']*100:.1f}%")
-    fligh_data_msgs.append(f"Right Flaps Deployment: {flight_data['sim/flightmodel2/controls/flap2_deploy_ratio']*100:.1f}%")
-    fligh_data_msgs.append(f"Left Slats Deployment: {flight_data['AirbusFBW/SlatPositionLWing']*100/27:.1f}%")  # originally in deg
-    fligh_data_msgs.append(f"Right Slats Deployment: {flight_data['AirbusFBW/SlatPositionRWing']*100/27:.1f}%") 
-    fligh_data_msgs.append(f"Left Landing Gear Position: {ldg_pos_str(flight_data['AirbusFBW/LeftGearInd'])}")
-    fligh_data_msgs.append(f"Right Landing Gear Position: {ldg_pos_str(flight_data['AirbusFBW/RightGearInd'])}")
-    fligh_data_msgs.append(f"Nose Landing Gear Position: {ldg_pos_str(flight_data['AirbusFBW/NoseGearInd'])}")
-    fligh_data_msgs.append(f"Wheels Ground Contact: {bool(np.any(flight_data['sim/flightmodel2/gear/on_ground']))}")
-    fligh_data_msgs.append(f"Estimated Fuel on Board: {int(flight_data['sim/flightmodel/weight/m_fuel_total'])} kg")
-    fligh_data_msgs.append(f"Fuel Mass Center Tank: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][0])} kg (max capcity: 6500kg)")
-    fligh_data_msgs.append(f"Fuel Mass Main Wing Tanks: Left: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][1])} kg, Right: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][2])} kg (max capacity per side: 5400 kg)")
-    fligh_data_msgs.append(f"Fuel Mass Tip Tank: Left: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][3])} kg,  Right: {int(flight_data['toliss_airbus/fuelTankContent_kgs'][4])} kg (max capacity per side: 680 kg)")
-    fligh_data_msgs.append(f"Auto Pilot 1 Active: {bool(flight_data['AirbusFBW/AP1Engage'])}")
-    fligh_data_msgs.append(f"Auto Pilot 2 Active: {bool(flight_data['AirbusFBW/AP2Engage'])}")
-    fligh_data_msgs.append(f"Auto Throttle Active: {flight_data['AirbusFBW/ATHRmode'] > 0}") 
-    fligh_data_msgs.append(f"Outside Air Temperature: {int(flight_data['sim/cockpit2/temperature/outside_air_temp_deg'])} C")
-    fligh_data_msgs.append(f"Wind Direction and Speed: {int(flight_data['sim/cockpit2/gauges/indicators/wind_heading_deg_mag'])}/{int(flight_data['sim/cockpit2/gauges/indicators/wind_speed_kts'])} ")
-    
-    final_flight_data_msg = '\n'.join(fligh_data_msgs)
-    
-    return final_flight_data_msg
+    # flight_data can be the whole payload, only the datarefs of FLIGHT_DATA_SCHEMA are read
+    return FLIGHT_DATA_FORMATTER(flight_data)
 
 def format_alternate_airports(flight_data):
     latitude = flight_data['sim/flightmodel/position/latitude']
@@ -282,13 +315,17 @@ def format_alternate_airports(flight_data):
     return altn_apts_message
             
         
-def format_prompt(data):
-    ecam_data = {dr:data[dr] for dr in ECAM_DREFS}
-    flight_data = {dr:data[dr] for dr in FLIGHT_DREFS}
-    
-    formatted_ecam_message = format_ecam_message(ecam_data)
-    formatted_flight_data_message = format_flight_data(flight_data)
-    formatted_altn_apts_message = format_alternate_airports(flight_data)
+def print_prompt(title, prompt):
+    print("-"*80)
+    print(f"{title}:")
+    print(prompt)
+
+def format_prompt(data, trace=None):
+    formatted_ecam_message = format_ecam_message(data)
+    formatted_flight_data_message = format_flight_data(data)
+    t_lookup = time.perf_counter()
+    formatted_altn_apts_message = format_alternate_airports(data)
+    add_span(trace, "airport_lookup", t_lookup)
 
 
     prompt = f"""Given the following flight data and ECAM messages for an A320, what are the immediate next steps a pilot should take given the situation. If the airplane is in a dangerous state, the primary goal is to recover the aircraft as quickly. If the aircraft is not in a dangerous state, you should acknowledge this to avoid false positive alarms and stressing pilots unnecessarily. This also means you should not display flight data that is already displayed in the cockpit unless it is relevant for a failure. Use the provided flight data and ECAM messages to determine if the airplane is in a dangerous state. You should reason if there are any anomalies in the flight data. Be as concise as possible, but give justifications for your suggestions. If you discover an unsafe state, use the alternate airports list and take the METAR weather reports at those airports into consideration for giving a recommendation to which airport to deviate to. If there are multiple airports that are suitable, rank them and provide justifications. If no diversion is necessary, do not list alternate airports. Under no circumstances should you hallucinate. If you are uncertain, you should state this. The relevant sections of the Quick Reference Handbook and Flight Crew Training Manual are given to you in the context.
@@ -302,9 +339,8 @@ ECAM messages:
 Alternate Airports:
 {formatted_altn_apts_message}
 """
-    print("-"*80)
-    print("Prompt:")
-    print(prompt)
+    if PROMPT_SINK is not None:
+        PROMPT_SINK("Prompt", prompt)
     return prompt
 
 
@@ -315,105 +351,511 @@ def format_retrieval_prompt(data):
 {data["message"]}"""
     
     else:
-        ecam_data = {dr:data[dr] for dr in ECAM_DREFS}
-        
-        formatted_ecam_message = format_ecam_message(ecam_data)
+        formatted_ecam_message = format_ecam_message(data)
 
 
-        prompt = f"""Given the following ECAM messages, what are important considerations?
-
-{formatted_ecam_message}"""
+        prompt = format_ecam_retrieval_prompt(formatted_ecam_message)
 
     return prompt
 
+def format_ecam_retrieval_prompt(formatted_ecam_message):
+    # also used by benchmark_retrieval.py for the labeled ECAM messages
+    return f"""Given the following ECAM messages, what are important considerations?
+
+{formatted_ecam_message}"""
+
 def format_flight_health_prompt(data):
-    flight_data = {dr:data[dr] for dr in FLIGHT_DREFS}
-    
-    formatted_flight_data_message = format_flight_data(flight_data)
+    formatted_flight_data_message = format_flight_data(data)
     
     prompt = f"""Given the following flight data for an A320, do you detect any anomalies that would warrent an intervention. Justify your answers and be as concise as possible. Under no circumstances hallucinate. If you are not sure, state so.
 
 Flight data:
 {formatted_flight_data_message}
 """
-    print("-"*80)
-    print("Flight Data Prompt:")
-    print(prompt)
+    if PROMPT_SINK is not None:
+        PROMPT_SINK("Flight Data Prompt", prompt)
     return prompt
 
 def format_prompt_text_entry(data):
     return data["message"]
     
 
+def retrieve(retriever, query, trace=None):
+    # same as retriever.invoke(query), but the searches, the fusion and the reranking are traced
+    return retriever.retrieve(query, trace)
+
+def retrieve_for_payload(retriever, payload, trace=None):
+    # alerts and queries get the procedures of known ECAM titles directly, the search only runs if a title is unknown
+    t_stage = time.perf_counter()
+    retrieval_prompt = format_retrieval_prompt(payload)
+    add_span(trace, "retrieval_prompt", t_stage)
+    looked_up = []
+    if payload["trigger_source"] != "text_entry":
+        looked_up, complete = retriever.lookup(format_ecam_message(payload), trace)
+        if looked_up and complete:
+            return looked_up
+    return merge_documents(looked_up, retrieve(retriever, retrieval_prompt, trace))
+
+def merge_usage(usage, stage_usage):
+    if usage is None:
+        return
+    for name, count in stage_usage.items():
+        usage[name] = usage.get(name, 0) + count
+
+def generate_answer(payload, history, retriever, client, on_chunk=None, usage=None, is_cancelled=None, trace=None):
+    """
+    Run retrieval and generation for a request without touching any session state.
+
+    Parameters:
+    - history: Chat history the question is asked in.
+    - on_chunk: If given, the final answer is streamed through it while it is being generated.
+    - usage: If given, the token counts of all LLM calls are added to it.
+    - is_cancelled: If given, it is checked before every LLM call and the generation is aborted once it returns True.
+    - trace: If given, a span is added to it for every pipeline stage (retrieval, prompt, generation, shortening).
+
+    Returns:
+    - (prompt, response, shortened_response) or None if the generation was cancelled.
+    """
+    response_mode = payload.get("response_mode", RESPONSE_MODE)
+    if response_mode not in RESPONSE_MODES:
+        raise ValueError(f"Unknown response mode '{response_mode}', expected one of {RESPONSE_MODES}")
+
+    relevant_docs = retrieve_for_payload(retriever, payload, trace)
+    context = "\n".join([doc.page_content for doc in relevant_docs])
+    if trace is not None:
+        trace.details["context"] = context
+
+    t_stage = time.perf_counter()
+    if payload["trigger_source"] == "text_entry":
+        prompt = format_prompt_text_entry(payload)
+    else:
+        prompt = format_prompt(payload, trace)
+    t_stage = add_span(trace, "prompt", t_stage)
+
+    if is_cancelled is not None and is_cancelled():
+        return None
+
+    stage_usage = {}
+    if response_mode == "concise":
+        response = generate_concise_gpt_response(client, context, prompt, history, on_chunk, stage_usage)
+        shortened_response = response
+        add_span(trace, "generation", t_stage, **stage_usage)
+        merge_usage(usage, stage_usage)
+    else:
+        response = generate_gpt_response(client, context, prompt, history, usage=stage_usage)
+        t_stage = add_span(trace, "generation", t_stage, **stage_usage)
+        merge_usage(usage, stage_usage)
+        if is_cancelled is not None and is_cancelled():
+            return None
+        stage_usage = {}
+        shortened_response = shorten_gpt_response(client, response, on_chunk, stage_usage)
+        add_span(trace, "shortening", t_stage, **stage_usage)
+        merge_usage(usage, stage_usage)
+
+    return prompt, response, shortened_response
+
+def speculation_key(payload):
+    return format_ecam_message(payload), payload.get("response_mode", RESPONSE_MODE)
+
+def response_cache_key(payload):
+    """
+    Compute the response cache key of an alert or query: the normalized ECAM messages, the coarse flight state and the
+    alternate airports, since the answer ranks the diversions to the airports of the prompt.
+
+    Returns:
+    - (ecam_text, state) where state contains the flight state buckets, the ICAO codes of the alternate airports and
+      the response mode.
+    """
+    alternates = tuple(APT_FINDER.records[i]["ICAO"] for i in APT_FINDER.nearest(payload["sim/flightmodel/position/latitude"],
+                                                                                 payload["sim/flightmodel/position/longitude"])[0])
+    gear_down = all(payload[dr] == 2 for dr in ["AirbusFBW/LeftGearInd", "AirbusFBW/RightGearInd", "AirbusFBW/NoseGearInd"])
+    flaps_extended = payload["sim/flightmodel2/controls/flap1_deploy_ratio"] > 0 or payload["AirbusFBW/SlatPositionLWing"] > 0
+    state = flight_state_buckets(payload["sim/flightmodel/position/y_agl"] * 3.28084,
+                                 payload["sim/flightmodel/position/indicated_airspeed"],
+                                 np.any(payload["sim/flightmodel2/gear/on_ground"]), gear_down, flaps_extended)
+    return normalize_ecam_text(format_ecam_message(payload)), state + (alternates, payload.get("response_mode", RESPONSE_MODE))
+
+def is_cacheable(payload):
+    # a query without ECAM messages asks about the flight data itself (e.g. an N1 split or a fuel imbalance), which the
+    # key only covers in coarse bands, so its answer must not be reused
+    return RESPONSE_CACHE.max_entries > 0 and payload["trigger_source"] != "text_entry" \
+        and normalize_ecam_text(format_ecam_message(payload)) != ""
+
+def use_response_cache(payload):
+    # "use_cache": false in a request skips the lookup, e.g. to get a fresh answer for a scenario
+    return is_cacheable(payload) and payload.get("use_cache", True)
+
+def speculate(speculation, payload, retriever, client):
+    # runs on a worker thread, the answer is only used if an alert or query with the same ECAM state arrives
+    if use_response_cache(payload) and RESPONSE_CACHE.contains(*response_cache_key(payload)):
+        return None     # the request will be answered from the response cache
+    answer = generate_answer(payload, [], retriever, client, is_cancelled=speculation.is_cancelled)
+    if answer is None:
+        logger.info("Speculation cancelled, the ECAM state changed")
+    return answer
+
+def handle_request(payload, session, retriever, client, on_chunk=None, usage=None, trace=None, is_cancelled=None):
+    """
+    Answer a single alert, query or text entry request for the given session. If on_chunk is given, the final answer
+    is streamed through it while it is being generated. If usage is given, the token counts of all LLM calls are added
+    to it. If trace is given, a span is added to it for every pipeline stage. If is_cancelled is given, generation is
+    aborted once it returns True.
+
+    Returns:
+    - shortened_response: The answer that is sent back to the plugin, or None if the request was cancelled.
+    """
+    answer = None
+    from_cache = False
+    t_stage = time.perf_counter()
+    if use_response_cache(payload):
+        cached = RESPONSE_CACHE.get(*response_cache_key(payload))
+        if cached is not None:
+            from_cache = True
+            session.speculation.cancel()
+            # the cached answer may have been given for different flight data within the same bands, the history gets
+            # the current prompt
+            answer = (format_prompt(payload), cached[1], cached[2])
+            logger.info(f"Using cached answer, response cache hit rate {RESPONSE_CACHE.hit_rate():.0%} ({len(RESPONSE_CACHE)} entries)")
+            if on_chunk is not None:
+                on_chunk(answer[2])
+    elif is_cacheable(payload):
+        RESPONSE_CACHE.count_bypass()   # "use_cache": false
+    t_stage = add_span(trace, "response_cache", t_stage, hit=from_cache)
+
+    if answer is None and payload["trigger_source"] != "text_entry":
+        # if the answer for this ECAM state was already (or is being) computed speculatively, use it
+        speculation = session.speculation.claim(speculation_key(payload))
+        if speculation is not None:
+            try:
+                answer = speculation.future.result()
+            except Exception as e:
+                logger.error(f"Speculation failed: {str(e)}")
+            if answer is not None:
+                logger.info(f"Using speculative answer computed {time.monotonic() - speculation.created:.1f} s ago")
+                if on_chunk is not None:
+                    on_chunk(answer[2])
+            add_span(trace, "speculation", t_stage, used=answer is not None)
+
+    if answer is None:
+        # alerts and queries are triggerd through Query button or Master Warn/Caution, so we want to erase everything
+        history = session.memory.messages() if payload["trigger_source"] == "text_entry" else []
+        answer = generate_answer(payload, history, retriever, client, on_chunk, usage, is_cancelled, trace)
+        if answer is None:
+            return None     # cancelled, the session is left as it is
+    prompt, response, shortened_response = answer
+
+    if not from_cache and is_cacheable(payload) and ERROR_RESPONSE not in (response, shortened_response):
+        RESPONSE_CACHE.put(*response_cache_key(payload), answer)
+
+    # add to history after the answer to avoid double use
+    if payload["trigger_source"] == "text_entry":
+        session.memory.add_turn(payload["message"], shortened_response,
+                                summarize=lambda messages: summarize_conversation(client, messages))
+    else:
+        session.memory.reset(prompt, shortened_response)
+
+    if trace is not None:
+        trace.details.update(prompt=prompt, response=response, answer=shortened_response)
+
+    return shortened_response
+
+def decode_message(wire_decoder, message):
+    """
+    Decode a request or telemetry message of a plugin, either in the binary wire format (see wire_format.py) or json.
+
+    Returns:
+    - payload: The message as a dict with the dataref paths as keys.
+    """
+    if is_binary(message):
+        return wire_decoder.decode(message)
+    return json.loads(message.decode())
+
+def validate_request(payload):
+    # runs on the socket thread, a malformed request must be rejected here instead of stopping the loop for all cockpits
+    if not isinstance(payload, dict):
+        raise ValueError(f"expected a json object, got {type(payload).__name__}")
+    if not isinstance(payload.get("trigger_source"), str):
+        raise ValueError("missing trigger_source")
+    if payload["trigger_source"] == "state_change":
+        missing = [dr for dr in ECAM_DREFS if not isinstance(payload.get(dr), str)]
+        if missing:
+            raise ValueError(f"state_change without the ECAM datarefs {missing[:3]}...")
+    return payload
+
+
+def get_worker_socket(zmq_context, worker_sockets, name, uri):
+    # zmq sockets must not be shared between threads, so every worker has its own PUSH sockets to the socket thread
+    if not hasattr(worker_sockets, name):
+        worker_socket = zmq_context.socket(zmq.PUSH)
+        worker_socket.connect(uri)
+        setattr(worker_sockets, name, worker_socket)
+    return getattr(worker_sockets, name)
+
+def format_monitor_prompt(sample, findings):
+    prompt = format_flight_health_prompt(sample)
+    return prompt + "\nThe automatic flight data monitoring flagged:\n" + "\n".join(f"- {message}" for message in findings) + "\n"
+
+def assess_flight_health(zmq_context, worker_sockets, plugin_id, sample, findings, retriever, client):
+    # runs on a worker thread when a detector of the flight health monitor tripped and the LLM budget allows it
+    try:
+        relevant_docs = retrieve(retriever, "Given the following flight data anomalies, what are important considerations?\n\n" + "\n".join(findings))
+        context = "\n".join([doc.page_content for doc in relevant_docs])
+        assessment = generate_concise_gpt_response(client, context, format_monitor_prompt(sample, findings), [])
+    except Exception as e:
+        logger.error(f"Flight health assessment for plugin {plugin_id} failed: {str(e)}")
+        return
+    if assessment == ERROR_RESPONSE:
+        return  # the detector findings were already published
+    logger.info(f"Flight health assessment for plugin {plugin_id}: {assessment}")
+    advisory = {"kind": "assessment", "findings": findings, "text": assessment}
+    get_worker_socket(zmq_context, worker_sockets, "advisory", ADVISORY_URI).send_multipart([plugin_id.encode('utf-8'), json.dumps(advisory).encode('utf-8')])
+
+def monitor_flight(sample):
+    """
+    Run the flight health monitor of the sending plugin on a telemetry sample.
+
+    Returns:
+    - advisory: Dict that is published to the plugin if the set of tripped detectors changed, otherwise None.
+    - escalate: True if an LLM health assessment should be made (a detector tripped and the budget allows it).
+    """
+    # only called on the socket thread, so MONITORS needs no lock
+    monitor = MONITORS.get(sample["plugin_id"])
+    if monitor is None:
+        monitor = MONITORS[sample["plugin_id"]] = FlightMonitor()
+        if len(MONITORS) > MAX_MONITORS:
+            MONITORS.popitem(last=False)    # a plugin that reconnected with a new id, or stopped sending
+    else:
+        MONITORS.move_to_end(sample["plugin_id"])
+    tripped, cleared = monitor.update(sample)
+    if not tripped and not cleared:
+        return None, False
+    if tripped:
+        logger.info(f"Flight health monitor of plugin {sample['plugin_id']}: {'; '.join(tripped.values())}")
+    advisory = {"kind": "detectors", "findings": list(monitor.active.values())}
+    return advisory, bool(tripped) and MONITOR_BUDGET.try_acquire(monitor)
+
+def serve_request(zmq_context, worker_sockets, envelope, payload, session, generation, retriever, client, trace):
+    # runs on a worker thread. An arm or cancel request of the same session (a newer generation) aborts this request
+    t_stage = trace.add("queue", trace.last_end())
+    reply_socket = get_worker_socket(zmq_context, worker_sockets, "reply", REPLY_URI)
+
+    stream = bool(payload.get("stream", False))
+    t_first = None
+    usage = {}
+
+    def is_cancelled():
+        return session.generation != generation
+
+    def send_chunk(text):
+        # streaming replies are sent as a sequence of [kind, data] messages, kind is b"chunk" or b"end"
+        nonlocal t_first
+        if is_cancelled():
+            raise RequestCancelled()    # stops reading the LLM stream
+        if t_first is None:
+            t_first = time.perf_counter()
+        reply_socket.send_multipart(envelope + [b"chunk", text.encode('utf-8')])
+
+    try:
+        with session.lock:
+            trace.add("session_lock", t_stage)
+            if is_cancelled():
+                raise RequestCancelled()    # superseded while it was waiting for the previous request of the session
+            reply = handle_request(payload, session, retriever, client, send_chunk if stream else None, usage, trace, is_cancelled)
+        if reply is None:
+            raise RequestCancelled()
+    except RequestCancelled:
+        logger.info(f"Request {trace.request_id} of session {trace.session_id} was cancelled")
+        trace.attributes["cancelled"] = True
+        reply = "cancelled"
+    except Exception as e:
+        logger.error(f"Error handling request of session {session.session_id.hex()}: {str(e)}")
+        reply = ERROR_RESPONSE
+        if stream:
+            try:
+                send_chunk(reply)
+            except RequestCancelled:
+                trace.attributes["cancelled"] = True    # the end message and the bookkeeping below still have to run
+
+    t_stage = time.perf_counter()
+    if stream:
+        reply_socket.send_multipart(envelope + [b"end", b""])
+    else:
+        reply_socket.send_multipart(envelope + [reply.encode('utf-8')])
+    t_last = trace.add("send", t_stage)
+
+    if t_first is None:
+        t_first = t_last
+    trace.total_s = t_last - trace.t_received
+    trace.first_token_s = t_first - trace.t_received
+    trace.attributes.update(usage)
+    logger.info(f"Request {trace.request_id} of session {trace.session_id} {trace.trigger_source}: time to first token {trace.first_token_s:.3f} s, time to last token {trace.total_s:.3f} s")
+    REQUEST_LOG.log(trace, payload=payload, **trace.details)
+    METRICS.record(trace)
+    for observer in REQUEST_OBSERVERS:
+        observer(payload, trace)
+
 def main():
+    global RECORDER
     logger.info("Starting main function")
     context = zmq.Context()
-    socket = context.socket(zmq.REP)
+    # ROUTER front end, every plugin connects with its own REQ socket and is told apart by its routing id
+    socket = context.socket(zmq.ROUTER)
     socket.setsockopt(zmq.RCVBUF, 10 * 1024 * 1024)  # Set receive buffer to 10 MB
     socket.setsockopt(zmq.SNDBUF, 10 * 1024 * 1024)  # Set send buffer to 10 MB
-    socket.bind("tcp://*:5555")
-    
-    global CHAT_HISTORY
+    socket.bind(SERVER_BIND_URI)
+    replies = context.socket(zmq.PULL)
+    replies.bind(REPLY_URI)
     
-    documents = load_markdown_documents(MD_RAG_FILE_PATH)
-    if not documents:
+    embeddings = setup_embedding_model()
+    chunks, vectors = build_index(MD_RAG_FILE_PATH, embeddings)
+    if not chunks:
         logger.warning(f"No Markdown documents found in the '{MD_RAG_FILE_PATH}' directory.")
         print(f"No Markdown documents found. Please add .md files to the '{MD_RAG_FILE_PATH}' directory and try again.")
         return
 
-    chunks = split_documents(documents)
-    retriever = create_ensemble_retriever(chunks)
+    retriever = create_hybrid_retriever(chunks, vectors, embeddings)
+    RESPONSE_CACHE.embed_query = embeddings.embed_query     # near matches of the ECAM messages are found by embedding similarity
+    RESPONSE_CACHE.embed_documents = embeddings.embed_documents
     
     client = setup_gpt_client()
+    load_tokenizer()    # counts the tokens of the follow-up history, may download the encoding
     
+    if METAR_REFRESH_INTERVAL_S > 0:
+        fetcher = MetarFetcher(os.getenv("METAR_BASE_URL", METAR_BASE_URL), max_age_s=METAR_MAX_AGE_S)     # point METAR_BASE_URL to mock_metar_server.py for testing
+        # until the first refresh is done, the METARs of ./data/metars.csv are used if they are recent enough
+        initial_metars, expired = fetcher.drop_stale(APT_FINDER.get_metars())
+        if expired:
+            logger.warning(f"{expired} METARs of {APT_FINDER.metars_path} are older than {METAR_MAX_AGE_S} s, they are not used")
+            APT_FINDER.set_metars(initial_metars)
+        metar_refresher = MetarRefresher(fetcher, [r["ICAO"] for r in APT_FINDER.records], APT_FINDER.set_metars,
+                                         METAR_REFRESH_INTERVAL_S, initial_metars)
+        metar_refresher.start()
+    
+    METRICS.add_gauge("relay_log_dropped", "Log records the background writer could not keep up with", lambda: LOG_PIPELINE.dropped)
+    METRICS.add_gauge("relay_sessions", "Number of active plugin sessions", lambda: len(SESSIONS))
+    METRICS.add_gauge("relay_response_cache_hit_ratio", "Share of alerts and queries answered from the response cache", RESPONSE_CACHE.hit_rate)
+    METRICS.add_gauge("relay_query_embedding_cache_hits", "Retrieval prompts whose embedding was cached", lambda: embeddings.hits)
+    METRICS.add_gauge("relay_query_embedding_cache_misses", "Retrieval prompts that had to be embedded", lambda: embeddings.misses)
+    if METRICS_PORT > 0:
+        start_metrics_server(METRICS, METRICS_PORT)
+        logger.info(f"Serving metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+    if METRICS_LOG_INTERVAL_S > 0:
+        MetricsLogger(METRICS, METRICS_LOG_INTERVAL_S).start()
+
+    if RECORDING_ENABLED:
+        RECORDER = FlightRecorder(RECORDINGS_PATH)
+        RECORDER.start()
+        METRICS.add_gauge("relay_recorder_dropped", "Payloads the flight recorder could not keep up with", lambda: RECORDER.dropped)
+        logger.info(f"Recording all payloads to {RECORDINGS_PATH}")
+
+    workers = ThreadPoolExecutor(max_workers=NUM_WORKERS, thread_name_prefix="relay_worker")
+    worker_sockets = threading.local()
+    wire_decoder = WireDecoder()  # key frames of the binary telemetry streams
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(replies, zmq.POLLIN)
+
+    if MONITOR_ENABLED:
+        # the plugins publish their flight data, advisories go back on a separate PUB socket with the plugin id as topic
+        telemetry = context.socket(zmq.SUB)
+        telemetry.setsockopt(zmq.SUBSCRIBE, b"telemetry")
+        telemetry.bind(TELEMETRY_BIND_URI)
+        advisory_pub = context.socket(zmq.PUB)
+        advisory_pub.bind(ADVISORY_BIND_URI)
+        advisories = context.socket(zmq.PULL)
+        advisories.bind(ADVISORY_URI)
+        poller.register(telemetry, zmq.POLLIN)
+        poller.register(advisories, zmq.POLLIN)
+        METRICS.add_gauge("relay_monitor_llm_calls", "LLM health assessments made by the flight health monitor", lambda: MONITOR_BUDGET.granted)
+        METRICS.add_gauge("relay_monitor_llm_calls_denied", "LLM health assessments skipped because of the budget", lambda: MONITOR_BUDGET.denied)
+        logger.info(f"Flight health monitor listening on {TELEMETRY_BIND_URI}, advisories on {ADVISORY_BIND_URI}")
+
+    logger.info(f"Relay server listening on {SERVER_BIND_URI} with {NUM_WORKERS} workers")
 
     while True:
-        #  Wait for next request from client
-        message = socket.recv()
-        payload = json.loads(message.decode())
-        print("----------------------MESSAGE RECEIVED----------------------")
-        print("-"*80)
-        print(payload)
-        print("-"*80)
+        events = dict(poller.poll())
+
+        # forward finished answers to their plugins
+        if replies in events:
+            socket.send_multipart(replies.recv_multipart())
+
+        if MONITOR_ENABLED and advisories in events:
+            advisory_pub.send_multipart(advisories.recv_multipart())
+
+        if MONITOR_ENABLED and telemetry in events:
+            # telemetry messages are [b"telemetry", sample] with the sample in json or the binary wire format, the detectors
+            # are cheap enough to run right here
+            try:
+                sample = decode_message(wire_decoder, telemetry.recv_multipart()[-1])
+                if RECORDER is not None and RECORD_TELEMETRY:
+                    RECORDER.record(sample["plugin_id"], "telemetry", sample)
+                advisory, escalate = monitor_flight(sample)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                logger.error(f"Could not process telemetry: {str(e)}")
+                advisory, escalate = None, False
+            if advisory is not None:
+                advisory_pub.send_multipart([sample["plugin_id"].encode('utf-8'), json.dumps(advisory).encode('utf-8')])
+            if escalate:
+                workers.submit(assess_flight_health, context, worker_sockets, sample["plugin_id"], sample,
+                               advisory["findings"], retriever, client)
+
+        if socket not in events:
+            continue
+
+        #  Next request from one of the clients: [routing id, empty delimiter, message]
+        #  Requests with "stream": true are answered with several [kind, data] messages, this needs a DEALER client
+        frames = socket.recv_multipart()
+        t_received = time.perf_counter()
+        envelope, message = frames[:-1], frames[-1]
+        session = SESSIONS.get(envelope[0])
+        payload = None
+        try:
+            payload = decode_message(wire_decoder, message)
+            validate_request(payload)
+        except ValueError as e:     # includes WireFormatError
+            logger.error(f"Rejected malformed message of session {session.session_id.hex()}: {str(e)}")
+            if isinstance(payload, dict) and payload.get("stream"):
+                # streaming clients wait for the end message
+                socket.send_multipart(envelope + [b"chunk", ERROR_RESPONSE.encode('utf-8')])
+                socket.send_multipart(envelope + [b"end", b""])
+            else:
+                socket.send_multipart(envelope + ["error: malformed request".encode('utf-8')])
+            continue
+        trace = Trace(session.session_id.hex(), t_received)
+        trace.trigger_source = payload.get("trigger_source")
+        trace.add("decode", t_received)
+        if RECORDER is not None:
+            RECORDER.record(session.session_id.hex(), "request", payload)
         
         if payload["trigger_source"] == "arm":
-            CHAT_HISTORY = []
-            socket.send("ok".encode('utf-8'))
-
-        else:
-            retrieval_prompt = format_retrieval_prompt(payload)            
-            relevant_docs = retriever.get_relevant_documents(retrieval_prompt)
-            context = "\n".join([doc.page_content for doc in relevant_docs])
-            
-            # Print the context used
-            print("\nContext used:")
-            print(context)
-            print("\n" + "-"*50 + "\n")
-            
-
-            if payload["trigger_source"] == "text_entry":
-                prompt = format_prompt_text_entry(payload)
-                response = generate_gpt_response(client, context, prompt, CHAT_HISTORY)
-                CHAT_HISTORY.append({"role":"user", "content":payload["message"]})  # add to history after to avoid double use
-                shortened_response = shorten_gpt_response(client, response)
-                CHAT_HISTORY.append({"role":"assistant", "content": shortened_response})
-            
+            # resetting is cheap, answer right away instead of queueing behind running LLM calls, which are aborted
+            session.supersede()
+            session.memory.reset()
+            if "wire_schema" in payload:
+                # handshake of plugins that support the binary wire format, they only use it if our schema is the same
+                reply = json.dumps({"wire_version": WIRE_VERSION, "wire_schema": payload["wire_schema"] == schema_hash()})
+                socket.send_multipart(envelope + [reply.encode('utf-8')])
             else:
-                prompt = format_prompt(payload)
-                CHAT_HISTORY = []   # this is triggerd through Query button or Master Warn/Caution, so we want to erase everything
-                response = generate_gpt_response(client, context, prompt, CHAT_HISTORY)
-                CHAT_HISTORY = [{"role":"user", "content":prompt},]     
-                shortened_response = shorten_gpt_response(client, response)
-                CHAT_HISTORY.append({"role":"assistant", "content": shortened_response})
-            
-            print(f"\nQuestion: {prompt}")
-            print(f"\nLong Answer: {response}")
-            print("-"*80)
-            print(f"\nShort Answer: {shortened_response}")
-
+                socket.send_multipart(envelope + ["ok".encode('utf-8')])
+
+        elif payload["trigger_source"] == "cancel":
+            # the plugin is no longer interested in its running requests, e.g. because it sent a new query
+            session.supersede()
+            socket.send_multipart(envelope + ["ok".encode('utf-8')])
+
+        elif payload["trigger_source"] == "state_change":
+            # snapshot that the plugin pushes whenever the ECAM messages change, start working on the answer right away
+            key = speculation_key(payload)
+            if key[0]:
+                if session.speculation.start(key, lambda speculation: workers.submit(speculate, speculation, payload, retriever, client)):
+                    logger.info(f"Session {session.session_id.hex()}: started speculation for ECAM state {key[0]!r}")
+            else:
+                session.speculation.cancel()
+            socket.send_multipart(envelope + ["ok".encode('utf-8')])
 
-            #  Send reply back to client
-            socket.send(shortened_response.encode('utf-8'))
+        else:
+            workers.submit(serve_request, context, worker_sockets, envelope, payload, session, session.generation,
+                           retriever, client, trace)
 
     
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+# METAR download and live refresh for the relay server.
+# MetarFetcher downloads the METARs of many stations concurrently over pooled keep-alive connections and uses the
+# per-station ETag/Last-Modified headers, so unchanged reports are answered with a cheap 304 instead of a full download.
+# The worker threads and their sessions live as long as the fetcher, so the connections are reused across refreshes.
+# METARs whose observation time (the day/time group, e.g. "181553Z") is more than max_age_s ago are dropped, whether
+# they were just downloaded, kept from a failed refresh or loaded from ./data/metars.csv, so an outdated report is never
+# presented as the current weather.
+# MetarRefresher runs the fetcher periodically in a background thread and hands every new METAR table to a callback
+# (e.g. AirportFinder.set_metars), so request handling never waits for the network.
+
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import requests
+from requests.adapters import HTTPAdapter
+
+METAR_BASE_URL = 'https://tgftp.nws.noaa.gov/data/observations/metar/stations/'
+OBSERVATION_TIME = re.compile(r"\b(\d{2})(\d{2})(\d{2})Z\b")    # day of month, hour and minute in UTC
+CLOCK_SKEW_S = 3600     # observation times up to this far in the future are accepted
+
+logger = logging.getLogger(__name__)
+
+
+def parse_metar(text):
+    # the station files contain the observation time in the first line and the METAR in the second line
+    lines = text.split('\n')
+    return lines[1].strip() if len(lines) > 1 else ""
+
+
+def observation_time(metar, now=None):
+    """
+    Observation time of a METAR. The day/time group has no month, it is taken as the latest date with that day of the
+    month that is not in the future.
+
+    Returns:
+    - time: Aware datetime in UTC, or None if the METAR has no valid day/time group.
+    """
+    match = OBSERVATION_TIME.search(metar)
+    if match is None:
+        return None
+    day, hour, minute = (int(g) for g in match.groups())
+    now = now or datetime.now(timezone.utc)
+    year, month = now.year, now.month
+    for _ in range(3):  # e.g. the 31st is in the month before the last on March 1st
+        try:
+            observed = datetime(year, month, day, hour, minute, tzinfo=timezone.utc)
+            if observed <= now + timedelta(seconds=CLOCK_SKEW_S):
+                return observed
+        except ValueError:
+            pass
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return None
+
+
+def metar_age_s(metar, now=None):
+    # None if the METAR has no observation time
+    now = now or datetime.now(timezone.utc)
+    observed = observation_time(metar, now)
+    return None if observed is None else (now - observed).total_seconds()
+
+
+class MetarFetcher():
+    def __init__(self, base_url=METAR_BASE_URL, max_workers=32, timeout_s=10, max_age_s=None):
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.timeout_s = timeout_s
+        self.max_age_s = max_age_s  # METARs observed longer ago are dropped, None to keep them
+        self.validators = {}    # ICAO -> (ETag, Last-Modified) of the last successful download
+        self.lock = threading.Lock()
+        self.local = threading.local()  # one keep-alive session per worker thread
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metar")
+
+    def get_session(self):
+        if not hasattr(self.local, "session"):
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return self.local.session
+
+    def fetch(self, icao):
+        """
+        Download the METAR of a single station.
+
+        Returns:
+        - (status, metar) where status is "updated", "not_modified" or "failed". metar is None unless updated.
+        """
+        with self.lock:
+            etag, last_modified = self.validators.get(icao, (None, None))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        try:
+            response = self.get_session().get(self.base_url + icao + '.TXT', headers=headers, timeout=self.timeout_s)
+            if response.status_code == 304:
+                return "not_modified", None
+            response.raise_for_status()  # Raise an error for bad status codes
+        except requests.RequestException as e:
+            logger.debug(f"Error fetching the METAR of {icao}: {e}")
+            return "failed", None
+
+        with self.lock:
+            self.validators[icao] = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return "updated", parse_metar(response.text)
+
+    def drop_stale(self, metars):
+        """
+        Returns:
+        - metars: The METAR table with an empty string for every METAR that is older than max_age_s or has no
+          observation time.
+        - expired: Number of dropped METARs.
+        """
+        if self.max_age_s is None:
+            return dict(metars), 0
+        now = datetime.now(timezone.utc)
+        current = {}
+        expired = 0
+        for icao, metar in metars.items():
+            age_s = metar_age_s(metar, now) if metar else None
+            if metar and (age_s is None or age_s > self.max_age_s):
+                metar = ""
+                expired += 1
+            current[icao] = metar
+        return current, expired
+
+    def fetch_all(self, icao_list, previous=None):
+        """
+        Download the METARs of all stations in icao_list concurrently.
+
+        Parameters:
+        - icao_list: List of station identifiers.
+        - previous: Previous METAR table (ICAO -> METAR). Stations that are not modified or fail keep their previous METAR.
+          METARs older than max_age_s are dropped.
+
+        Returns:
+        - metars: New METAR table (ICAO -> METAR, empty string if no METAR is available).
+        - stats: Number of stations per status.
+        """
+        previous = previous or {}
+        metars = {}
+        stats = {"updated": 0, "not_modified": 0, "failed": 0}
+        for icao, (status, metar) in zip(icao_list, self.pool.map(self.fetch, icao_list)):
+            stats[status] += 1
+            metars[icao] = metar if status == "updated" else previous.get(icao, "")
+        metars, stats["expired"] = self.drop_stale(metars)
+        return metars, stats
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+class MetarRefresher(threading.Thread):
+    def __init__(self, fetcher, icao_list, on_update, interval_s=1800, initial=None, refresh_on_start=True):
+        super().__init__(daemon=True, name="metar_refresher")
+        self.fetcher = fetcher
+        self.icao_list = list(icao_list)
+        self.on_update = on_update
+        self.interval_s = interval_s
+        self.refresh_on_start = refresh_on_start
+        self.metars = dict(initial or {})
+        self.stop_event = threading.Event()
+
+    def refresh(self):
+        t_start = time.perf_counter()
+        self.metars, stats = self.fetcher.fetch_all(self.icao_list, self.metars)
+        self.on_update(self.metars)
+        logger.info(f"Refreshed METARs of {len(self.icao_list)} stations in {time.perf_counter() - t_start:.1f} s: "
+                    f"{stats['updated']} updated, {stats['not_modified']} not modified, {stats['failed']} failed, "
+                    f"{stats['expired']} expired")
+
+    def run(self):
+        wait_s = 0 if self.refresh_on_start else self.interval_s
+        while not self.stop_event.wait(wait_s):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"METAR refresh failed: {str(e)}")
+            wait_s = self.interval_s
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,156 @@
+# Metrics of the relay server. RelayMetrics aggregates the finished request traces (see tracing.py) into histograms per
+# pipeline stage and per request type plus token counters. They are served in the Prometheus text format on
+# http://127.0.0.1:<port>/metrics, and a summary with the percentiles of the most recent requests is logged periodically.
+
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram():
+    def __init__(self, buckets=LATENCY_BUCKETS_S, window=1000):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)  # for the percentiles in the log summary
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentiles(self, q=(50, 95, 99)):
+        return np.percentile(np.fromiter(self.recent, dtype=float), q) if self.recent else [0.0] * len(q)
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RelayMetrics():
+    def __init__(self, window=1000):
+        self.window = window
+        self.stages = {}    # stage -> Histogram
+        self.requests = {}  # trigger source -> Histogram of the time to the last token
+        self.first_token = {}   # trigger source -> Histogram of the time to the first token
+        self.tokens = {}    # (stage, kind) -> count
+        self.gauges = {}    # name -> (help, function that returns the current value)
+        self.lock = threading.Lock()
+
+    def add_gauge(self, name, help_text, value):
+        self.gauges[name] = (help_text, value)
+
+    def record(self, trace):
+        with self.lock:
+            for span in trace.spans:
+                self.stages.setdefault(span.name, Histogram(window=self.window)).observe(span.duration)
+                for kind in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                    if kind in span.attributes:
+                        key = (span.name, kind)
+                        self.tokens[key] = self.tokens.get(key, 0) + span.attributes[kind]
+            self.requests.setdefault(trace.trigger_source, Histogram(window=self.window)).observe(trace.total_s)
+            self.first_token.setdefault(trace.trigger_source, Histogram(window=self.window)).observe(trace.first_token_s)
+
+    def render(self):
+        """
+        Returns:
+        - text: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            lines.append("# HELP relay_request_duration_seconds Time from receiving a request to sending the last reply")
+            lines.append("# TYPE relay_request_duration_seconds histogram")
+            for source, histogram in self.requests.items():
+                lines.extend(histogram.render("relay_request_duration_seconds", f'trigger_source="{source}"'))
+            lines.append("# HELP relay_time_to_first_token_seconds Time from receiving a request to sending the first part of the answer")
+            lines.append("# TYPE relay_time_to_first_token_seconds histogram")
+            for source, histogram in self.first_token.items():
+                lines.extend(histogram.render("relay_time_to_first_token_seconds", f'trigger_source="{source}"'))
+            lines.append("# HELP relay_stage_duration_seconds Duration of the pipeline stages")
+            lines.append("# TYPE relay_stage_duration_seconds histogram")
+            for stage, histogram in self.stages.items():
+                lines.extend(histogram.render("relay_stage_duration_seconds", f'stage="{stage}"'))
+            lines.append("# HELP relay_llm_tokens_total LLM tokens per pipeline stage")
+            lines.append("# TYPE relay_llm_tokens_total counter")
+            for (stage, kind), count in self.tokens.items():
+                lines.append(f'relay_llm_tokens_total{{stage="{stage}",kind="{kind.removesuffix("_tokens")}"}} {count}')
+        for name, (help_text, value) in self.gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns:
+        - text: p50/p95/p99 in ms of the most recent requests per request type and stage.
+        """
+        lines = []
+        with self.lock:
+            histograms = [(f"request {s}", h) for s, h in self.requests.items()] + list(self.stages.items())
+            for name, histogram in histograms:
+                p50, p95, p99 = histogram.percentiles()
+                lines.append(f"{name:<28} n={len(histogram.recent):<5} p50 {p50 * 1000:9.1f} ms  p95 {p95 * 1000:9.1f} ms  p99 {p99 * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.rstrip('/') != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(metrics, port):
+    MetricsRequestHandler.metrics = metrics
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics_server").start()
+    return server
+
+
+class MetricsLogger(threading.Thread):
+    def __init__(self, metrics, interval_s=300):
+        super().__init__(daemon=True, name="metrics_logger")
+        self.metrics = metrics
+        self.interval_s = interval_s
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_s):
+            summary = self.metrics.summary()
+            if summary:
+                logger.info(f"Latency of the last {self.metrics.window} requests per stage:\n{summary}")
+
+    def stop(self):
+        self.stop_event.set()
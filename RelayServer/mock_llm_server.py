@@ -0,0 +1,95 @@
+# Local stand-in for the OpenAI chat completion API. Replays the recorded completions in ./data/recorded_completions.json
+# (see ReplayBackend in llm_backend.py) with a configurable time to first token and generation speed, streamed as
+# server-sent events like the real API. This gives deterministic LLM latency, so the overhead of the relay can be
+# measured end-to-end, including the HTTP client.
+# Usage: python3 mock_llm_server.py --ttft 0.5 --tokens-per-s 50, then start the relay server with
+# LLM_BASE_URL=http://127.0.0.1:8002/v1
+
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm_backend import RECORDED_COMPLETIONS_PATH, ReplayBackend
+
+
+class ChatCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, the streamed answers use chunked transfer encoding
+    backend = None
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, body):
+        data = f"data: {body if isinstance(body, str) else json.dumps(body)}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", self.backend.model)
+        usage = {}
+
+        if not request.get("stream", False):
+            content = self.backend.complete(request["messages"], usage=usage)
+            self.send_json(200, {"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                                 "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                              "finish_reason": "stop"}],
+                                 "usage": {"prompt_tokens": usage["prompt_tokens"],
+                                           "completion_tokens": usage["completion_tokens"],
+                                           "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        self.send_event(chunk({"role": "assistant", "content": ""}))
+        self.backend.complete(request["messages"], on_chunk=lambda text: self.send_event(chunk({"content": text})), usage=usage)
+        self.send_event(chunk({}, "stop"))
+        if request.get("stream_options", {}).get("include_usage", False):
+            self.send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                             "choices": [],
+                             "usage": {"prompt_tokens": usage["prompt_tokens"],
+                                       "completion_tokens": usage["completion_tokens"],
+                                       "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"]}})
+        self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8002, recordings_path=RECORDED_COMPLETIONS_PATH, time_to_first_token_s=0.5, tokens_per_s=50.0,
+          words_per_chunk=1):
+    ChatCompletionHandler.backend = ReplayBackend("mock", recordings_path, time_to_first_token_s, tokens_per_s, words_per_chunk)
+    server = ThreadingHTTPServer(("127.0.0.1", port), ChatCompletionHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completion API")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--recordings", default=RECORDED_COMPLETIONS_PATH, help="json file with the recorded completions")
+    parser.add_argument("--ttft", type=float, default=0.5, help="time to first token in seconds")
+    parser.add_argument("--tokens-per-s", type=float, default=50.0, help="generation speed after the first token")
+    parser.add_argument("--words-per-chunk", type=int, default=1, help="words per streamed chunk")
+    args = parser.parse_args()
+    print(f"Serving recorded completions from {args.recordings} on http://127.0.0.1:{args.port}/v1")
+    serve(args.port, args.recordings, args.ttft, args.tokens_per_s, args.words_per_chunk).serve_forever()
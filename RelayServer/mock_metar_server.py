@@ -0,0 +1,82 @@
+# Local stand-in for the NOAA METAR station server. Serves the <ICAO>.TXT files in ./data/metar_fixtures with ETag and
+# Last-Modified headers and answers conditional requests with 304, like the real server does. Edit a fixture file to
+# simulate a new observation: the observation time in the served file is the modification time of the fixture, since
+# the relay drops METARs that were observed too long ago.
+# Usage: python3 mock_metar_server.py, then start the relay server with METAR_BASE_URL=http://127.0.0.1:8001/
+
+import argparse
+import hashlib
+import os
+import re
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_PATH = "./data/metar_fixtures/"
+
+
+def with_observation_time(body, mtime):
+    # the first line is the observation time ("2024/10/18 15:53"), the METAR has it as day/time group ("181553Z")
+    observed = time.gmtime(mtime)
+    lines = body.decode('utf-8').split('\n')
+    lines[0] = time.strftime("%Y/%m/%d %H:%M", observed)
+    if len(lines) > 1:
+        lines[1] = re.sub(r"\b\d{6}Z\b", time.strftime("%d%H%MZ", observed), lines[1], count=1)
+    return '\n'.join(lines).encode('utf-8')
+
+
+class MetarRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real server
+    fixture_path = FIXTURE_PATH
+
+    def do_GET(self):
+        file_path = os.path.join(self.fixture_path, os.path.basename(self.path))
+        if not os.path.isfile(file_path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        mtime = int(os.path.getmtime(file_path))
+        with open(file_path, 'rb') as f:
+            body = with_observation_time(f.read(), mtime)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+        not_modified = False
+        if self.headers.get("If-None-Match") is not None:
+            not_modified = self.headers.get("If-None-Match") == etag
+        elif self.headers.get("If-Modified-Since") is not None:
+            try:
+                not_modified = mtime <= parsedate_to_datetime(self.headers.get("If-Modified-Since")).timestamp()
+            except (TypeError, ValueError):
+                pass
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        if not_modified:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8001, fixture_path=FIXTURE_PATH):
+    MetarRequestHandler.fixture_path = fixture_path
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetarRequestHandler)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the NOAA METAR server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--fixtures", default=FIXTURE_PATH, help="directory with <ICAO>.TXT files")
+    args = parser.parse_args()
+    print(f"Serving METARs from {args.fixtures} on http://127.0.0.1:{args.port}/")
+    serve(args.port, args.fixtures).serve_forever()
@@ -0,0 +1,53 @@
+# Simulates the flight data stream of the X-Plane plugin for the flight health monitor of the relay server. Publishes the
+# flight data of mock_xp_plugin.py at a fixed rate, lets engine 2 fail after a few seconds and prints the advisories
+# the relay publishes back.
+# Usage: python3 mock_telemetry.py [--rate 2] [--duration 30] [--failure-after 5] [--binary]
+
+import argparse
+import json
+import time
+import uuid
+import zmq
+from mock_xp_plugin import DATA
+from wire_format import WireEncoder
+
+TELEMETRY_URI = "127.0.0.1:5556"
+ADVISORY_URI = "127.0.0.1:5557"
+
+
+def telemetry_sample(plugin_id, t, engine_failed):
+    sample = {dr: value for dr, value in DATA.items() if not dr.startswith("AirbusFBW/EWD")}
+    sample.pop("trigger_source")
+    if engine_failed:
+        sample["AirbusFBW/fmod/eng/N1Array"] = [sample["AirbusFBW/fmod/eng/N1Array"][0], 4.0, 0.0, 0.0]
+    return sample | {"plugin_id": plugin_id, "time": t}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated flight data stream for the flight health monitor")
+    parser.add_argument("--rate", type=float, default=2.0, help="samples per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--failure-after", type=float, default=5.0, help="seconds after which engine 2 fails")
+    parser.add_argument("--binary", action="store_true", help="send the samples in the binary wire format instead of json")
+    args = parser.parse_args()
+
+    plugin_id = uuid.uuid4().hex
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.connect(f"tcp://{TELEMETRY_URI}")
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.SUBSCRIBE, plugin_id.encode('utf-8'))
+    subscriber.connect(f"tcp://{ADVISORY_URI}")
+
+    encoder = WireEncoder()
+    t_start = time.monotonic()
+    t_next = t_start
+    while time.monotonic() - t_start < args.duration:
+        t = time.monotonic() - t_start
+        if time.monotonic() >= t_next:
+            sample = telemetry_sample(plugin_id, t, t >= args.failure_after)
+            publisher.send_multipart([b"telemetry", encoder.encode(sample) if args.binary else json.dumps(sample).encode('utf-8')])
+            t_next += 1 / args.rate
+        if subscriber.poll(10):
+            advisory = json.loads(subscriber.recv_multipart()[-1].decode())
+            print(f"{t:6.1f} s {advisory['kind']}: {advisory.get('text') or advisory['findings']}")
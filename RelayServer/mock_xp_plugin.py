@@ -78,14 +78,38 @@ DATA = {'trigger_source': 'alert',
 
 SERVER_URI = "127.0.0.1:5555"
 
-context = zmq.Context()
-socket = context.socket(zmq.REQ)
-socket.setsockopt(zmq.RCVBUF, 10 * 1024 * 1024)  # Set receive buffer to 10 MB
-socket.setsockopt(zmq.SNDBUF, 10 * 1024 * 1024)  # Set send buffer to 10 MB
-socket.connect(f"tcp://{SERVER_URI}")
+def connect(context, server_uri=SERVER_URI, socket_type=zmq.REQ):
+    socket = context.socket(socket_type)
+    socket.setsockopt(zmq.RCVBUF, 10 * 1024 * 1024)  # Set receive buffer to 10 MB
+    socket.setsockopt(zmq.SNDBUF, 10 * 1024 * 1024)  # Set send buffer to 10 MB
+    socket.connect(f"tcp://{server_uri}")
+    return socket
 
+def send_request(socket, data):
+    socket.send(json.dumps(data).encode('utf-8'))
+    return socket.recv().decode()
 
-socket.send(json.dumps(DATA).encode('utf-8'))
-message = socket.recv().decode()
+def stream_request(socket, data):
+    # needs a DEALER socket, yields the chunks of the answer as they arrive
+    socket.send_multipart([b"", json.dumps(data | {"stream": True}).encode('utf-8')])
+    while True:
+        frames = socket.recv_multipart()
+        if frames[-2] == b"":
+            yield frames[-1].decode()   # a single reply instead of a stream, e.g. to a request the relay rejected
+            return
+        if frames[-2] == b"end":
+            return
+        yield frames[-1].decode()
 
-print(message)
+
+if __name__ == "__main__":
+    context = zmq.Context()
+    socket = connect(context)
+    message = send_request(socket, DATA)
+
+    print(message)
+
+    # Example how to receive the answer as a stream
+    # socket = connect(context, socket_type=zmq.DEALER)
+    # for chunk in stream_request(socket, DATA):
+    #     print(chunk, end="", flush=True)
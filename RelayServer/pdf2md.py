@@ -1,16 +1,88 @@
 # This script converts all the pdf files that are located in the pdf_rag_files directory into markdown and saves the resulting markdown in md_rag_files directory
+# The conversion is spread over a process pool in page ranges. PDFs whose content did not change since the last run are skipped.
+# A manifest (md_rag_files/manifest.json, see rag_manifest.py) records the hashes of every PDF and its markdown file, the relay server uses it to tell which markdown files changed.
+# The markdown files of PDFs that were removed are deleted, so they are no longer indexed.
 
+import pymupdf
 import pymupdf4llm
+from pymupdf4llm.helpers.pymupdf_rag import IdentifyHeaders
 import pathlib
 from glob import glob
+import hashlib
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from rag_manifest import file_sha256, write_atomic, load_manifest, save_manifest
 
-os.makedirs("./data/md_rag_files",exist_ok=True)
+PDF_RAG_FILE_PATH = "./data/pdf_rag_files/"
+MD_RAG_FILE_PATH = "./data/md_rag_files/"
+PAGES_PER_TASK = 16     # number of pages a worker converts at once
 
-for fn in glob("./data/pdf_rag_files/*.pdf"):
 
-    md_text = pymupdf4llm.to_markdown(fn)
-    
-    file_stem = pathlib.Path(fn).stem
-    
-    pathlib.Path(f"./data/md_rag_files/{file_stem}.md").write_bytes(md_text.encode())    
\ No newline at end of file
+def identify_headers(fn):
+    # header levels are derived from the font sizes of the whole document, so they are computed once per PDF and shared by all page ranges
+    with pymupdf.open(fn) as doc:
+        return doc.page_count, IdentifyHeaders(doc)
+
+
+def convert_pages(fn, pages, hdr_info):
+    return pymupdf4llm.to_markdown(fn, pages=pages, hdr_info=hdr_info, show_progress=False)
+
+
+def main():
+    os.makedirs(MD_RAG_FILE_PATH,exist_ok=True)
+    manifest = load_manifest(MD_RAG_FILE_PATH)
+    entries = {}
+    todo = []
+
+    for fn in sorted(glob(os.path.join(PDF_RAG_FILE_PATH, "*.pdf"))):
+        name = os.path.basename(fn)
+        md_path = os.path.join(MD_RAG_FILE_PATH, f"{pathlib.Path(fn).stem}.md")
+        pdf_sha256 = file_sha256(fn)
+        entry = manifest["files"].get(name)
+        if entry is not None and entry["pdf_sha256"] == pdf_sha256 and os.path.exists(md_path) and file_sha256(md_path) == entry["md_sha256"]:
+            entries[name] = entry
+            print(f"Unchanged: {name}")
+        else:
+            todo.append((fn, name, md_path, pdf_sha256))
+
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor() as pool:
+        headers = list(pool.map(identify_headers, [t[0] for t in todo]))
+
+        # one task per page range, results are collected per file in page order
+        futures = []
+        for (fn, _, _, _), (page_count, hdr_info) in zip(todo, headers):
+            futures.append([pool.submit(convert_pages, fn, list(range(start, min(start + PAGES_PER_TASK, page_count))), hdr_info)
+                            for start in range(0, page_count, PAGES_PER_TASK)])
+
+        for (fn, name, md_path, pdf_sha256), (page_count, _), file_futures in zip(todo, headers, futures):
+            md_text = "".join(f.result() for f in file_futures).encode()
+            write_atomic(md_path, md_text)
+            stat = os.stat(md_path)
+            entries[name] = {"pdf_sha256": pdf_sha256,
+                             "markdown": os.path.basename(md_path),
+                             "md_sha256": hashlib.sha256(md_text).hexdigest(),
+                             "md_size": stat.st_size,
+                             "md_mtime_ns": stat.st_mtime_ns,
+                             "pages": page_count,
+                             "converted_at": datetime.now(timezone.utc).isoformat()}
+            print(f"Converted: {name} ({page_count} pages)")
+
+    # markdown files converted from PDFs that are gone, files that were not converted by this script are kept
+    outputs = {entry["markdown"] for entry in entries.values()}
+    for name, entry in manifest["files"].items():
+        if name not in entries and entry.get("markdown") and entry["markdown"] not in outputs:
+            try:
+                os.remove(os.path.join(MD_RAG_FILE_PATH, entry["markdown"]))
+                print(f"Removed: {entry['markdown']} ({name} no longer exists)")
+            except FileNotFoundError:
+                pass
+
+    save_manifest(MD_RAG_FILE_PATH, entries)
+    print(f"Converted {len(todo)} of {len(entries)} PDF files in {time.perf_counter() - t_start:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
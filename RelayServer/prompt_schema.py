@@ -0,0 +1,184 @@
+# Declarative schema of the flight data lines of the prompts, compiled once into a formatter. Every line of the flight
+# data is a template with the values it shows: a dataref, optionally an index into an array dataref and a conversion
+# (unit, mapping). CompiledSchema generates one function from the schema (like collections.namedtuple generates its
+# classes) that reads and converts all values and returns them in a single f-string, so formatting the flight data of a
+# request is one call without a list of per-line strings and intermediate dicts. The ECAM formatter precomputes the datarefs of every ECAM line in order of their priority.
+# The output is exactly that of the previous f-string formatting (see benchmark_prompt_formatting.py), typos included,
+# so that the prompts, the response cache keys and the recorded prompts stay comparable.
+
+from collections import namedtuple
+from string import Formatter
+import numpy as np
+
+FEET_PER_METER = 3.28084
+KNOTS_PER_METER_PER_SECOND = 1.94384
+SLAT_FULL_DEFLECTION_DEG = 27
+ECAM_HALF_WIDTH = 24    # every ECAM line is 48 characters wide, the left and right halves are separate messages
+
+Value = namedtuple("Value", ["dataref", "index", "convert"], defaults=[None, None])
+Line = namedtuple("Line", ["template", "values"])
+
+
+def feet(meters):
+    return int(meters * FEET_PER_METER)
+
+
+def knots(meters_per_second):
+    return meters_per_second * KNOTS_PER_METER_PER_SECOND
+
+
+def percent(ratio):
+    return ratio * 100
+
+
+def slat_percent(deg):
+    return deg * 100 / SLAT_FULL_DEFLECTION_DEG
+
+
+def gear_position(gear_ind):
+    return GEAR_POSITIONS.get(gear_ind, "Unknown")
+
+
+def any_true(values):
+    if isinstance(values, (list, tuple)):
+        return any(values)  # np.any converts the list to an array first, which costs more than the rest of the line
+    return bool(np.any(values))
+
+
+def is_positive(value):
+    return value > 0
+
+
+GEAR_POSITIONS = {0: "Up", 1: "Changing", 2: "Down", 3: "Changing"}
+FUEL_TANKS = "toliss_airbus/fuelTankContent_kgs"    # [0] center, [1] left inner, [2] right inner, [3] left tip, [4] right tip
+
+FLIGHT_DATA_SCHEMA = [
+    Line("Latitude: {:.6f} deg", [Value("sim/flightmodel/position/latitude")]),
+    Line("Longitude: {:.6f} deg", [Value("sim/flightmodel/position/longitude")]),
+    Line("Altitde MSL: {} ft", [Value("sim/flightmodel/position/elevation", convert=feet)]),
+    Line("Altitde AGL: {} ft", [Value("sim/flightmodel/position/y_agl", convert=feet)]),
+    Line("Magnetic Heading: {:.1f} deg", [Value("sim/flightmodel/position/mag_psi")]),
+    Line("Pitch Angle: {:.1f} deg", [Value("toliss_airbus/pfdoutputs/captain/pitch_angle")]),
+    Line("Roll Angle: {:.1f} deg", [Value("toliss_airbus/pfdoutputs/captain/roll_angle")]),
+    Line("Angle of Attack: {:.1f} deg", [Value("sim/flightmodel/position/alpha")]),
+    Line("Sideslip Angle: {:.1f} deg", [Value("sim/flightmodel/position/beta")]),
+    Line("Inidcated Airspeed: {:.1f} kt", [Value("sim/flightmodel/position/indicated_airspeed")]),
+    Line("Groundspeed: {:.1f} kt", [Value("sim/flightmodel/position/groundspeed", convert=knots)]),
+    Line("Vertical Speed: {} ft/min", [Value("sim/flightmodel/position/vh_ind_fpm", convert=int)]),
+    Line("Left N1: {:.1f}%", [Value("AirbusFBW/fmod/eng/N1Array", 0)]),
+    Line("Right N1: {:.1f}%", [Value("AirbusFBW/fmod/eng/N1Array", 1)]),
+    Line("Left Flaps Deployment: {:.1f}%", [Value("sim/flightmodel2/controls/flap1_deploy_ratio", convert=percent)]),
+    Line("Right Flaps Deployment: {:.1f}%", [Value("sim/flightmodel2/controls/flap2_deploy_ratio", convert=percent)]),
+    Line("Left Slats Deployment: {:.1f}%", [Value("AirbusFBW/SlatPositionLWing", convert=slat_percent)]),
+    Line("Right Slats Deployment: {:.1f}%", [Value("AirbusFBW/SlatPositionRWing", convert=slat_percent)]),
+    Line("Left Landing Gear Position: {}", [Value("AirbusFBW/LeftGearInd", convert=gear_position)]),
+    Line("Right Landing Gear Position: {}", [Value("AirbusFBW/RightGearInd", convert=gear_position)]),
+    Line("Nose Landing Gear Position: {}", [Value("AirbusFBW/NoseGearInd", convert=gear_position)]),
+    Line("Wheels Ground Contact: {}", [Value("sim/flightmodel2/gear/on_ground", convert=any_true)]),   # [0] nose, [1] left, [2] right gear
+    Line("Estimated Fuel on Board: {} kg", [Value("sim/flightmodel/weight/m_fuel_total", convert=int)]),
+    Line("Fuel Mass Center Tank: {} kg (max capcity: 6500kg)", [Value(FUEL_TANKS, 0, int)]),
+    Line("Fuel Mass Main Wing Tanks: Left: {} kg, Right: {} kg (max capacity per side: 5400 kg)",
+         [Value(FUEL_TANKS, 1, int), Value(FUEL_TANKS, 2, int)]),
+    Line("Fuel Mass Tip Tank: Left: {} kg,  Right: {} kg (max capacity per side: 680 kg)",
+         [Value(FUEL_TANKS, 3, int), Value(FUEL_TANKS, 4, int)]),
+    Line("Auto Pilot 1 Active: {}", [Value("AirbusFBW/AP1Engage", convert=bool)]),
+    Line("Auto Pilot 2 Active: {}", [Value("AirbusFBW/AP2Engage", convert=bool)]),
+    Line("Auto Throttle Active: {}", [Value("AirbusFBW/ATHRmode", convert=is_positive)]),
+    Line("Outside Air Temperature: {} C", [Value("sim/cockpit2/temperature/outside_air_temp_deg", convert=int)]),
+    Line("Wind Direction and Speed: {}/{} ", [Value("sim/cockpit2/gauges/indicators/wind_heading_deg_mag", convert=int),
+                                              Value("sim/cockpit2/gauges/indicators/wind_speed_kts", convert=int)]),
+]
+
+
+def schema_datarefs(schema):
+    # datarefs of a schema in the order of their first use
+    return list(dict.fromkeys(value.dataref for line in schema for value in line.values))
+
+
+def value_source(value, namespace):
+    # python expression of a value, the conversion functions are added to namespace
+    source = f"data[{value.dataref!r}]"
+    if value.index is not None:
+        source += f"[{int(value.index)}]"
+    if value.convert is not None:
+        name = f"convert_{len(namespace)}"
+        namespace[name] = value.convert
+        source = f"{name}({source})"
+    return source
+
+
+class CompiledSchema():
+    """
+    Formatter of a list of Lines, called with a dict that contains (at least) the datarefs of the schema.
+
+    Parameters:
+    - schema: List of Lines, every "{}" in a template (with an optional format spec) is filled by one of its values.
+    """
+    def __init__(self, schema):
+        self.datarefs = schema_datarefs(schema)
+        namespace = {}
+        statements = []
+        pieces = []
+        for line in schema:
+            fields = list(Formatter().parse(line.template))     # (literal, field name, format spec, conversion)
+            names = [name for _, name, _, _ in fields if name is not None]
+            if len(names) != len(line.values) or any(names):
+                raise ValueError(f"Template '{line.template}' needs one '{{}}' field per value, it has {len(line.values)} values")
+            values = iter(line.values)
+            for literal, name, format_spec, conversion in fields:
+                pieces.append(literal.replace("{", "{{").replace("}", "}}"))
+                if name is None:
+                    continue
+                variable = f"v{len(statements)}"
+                statements.append(f"    {variable} = {value_source(next(values), namespace)}\n")
+                conversion = f"!{conversion}" if conversion else ""
+                format_spec = f":{format_spec}" if format_spec else ""
+                pieces.append("{" + variable + conversion + format_spec + "}")
+            pieces.append("\n")
+        # the generated function assigns every value to a local variable and returns all lines in one f-string
+        self.source = "def format_schema(data):\n" + "".join(statements) + f"    return f{''.join(pieces[:-1])!r}\n"
+        exec(self.source, namespace)
+        self.format = namespace["format_schema"]
+
+    def __call__(self, data):
+        return self.format(data)
+
+
+class EcamFormatter():
+    """
+    Formatter of the ECAM messages: for both halves of every ECAM line, the text of the highest priority color is shown
+    as "<TEXT> (<color>)". The messages of the left halves come before those of the right halves.
+
+    Parameters:
+    - lines: ECAM line numbers.
+    - colors: Color letters of the datarefs, lowest priority first.
+    - color_names: Names of the colors in the same order.
+    """
+    def __init__(self, lines, colors, color_names):
+        # per ECAM line the datarefs and " (<color>)" suffixes, highest priority first
+        self.lines = [[(f"AirbusFBW/EWD{l}{c}Text", f" ({name})") for c, name in reversed(list(zip(colors, color_names)))]
+                      for l in lines]
+        self.datarefs = [dataref for line in self.lines for dataref, _ in reversed(line)]
+
+    def __call__(self, data):
+        left_msgs = []
+        right_msgs = []
+        for slots in self.lines:
+            left_msg = None
+            right_msg = None
+            for dataref, suffix in slots:
+                text = data[dataref]
+                if not text:
+                    continue
+                # a half is shown if it has any character other than a space, like the display
+                if left_msg is None and text[:ECAM_HALF_WIDTH].strip(" "):
+                    left_msg = text[:ECAM_HALF_WIDTH].rstrip().upper() + suffix
+                if right_msg is None and text[ECAM_HALF_WIDTH:].strip(" "):
+                    right_msg = text[ECAM_HALF_WIDTH:].rstrip().upper() + suffix
+                if left_msg is not None and right_msg is not None:
+                    break
+            if left_msg is not None:
+                left_msgs.append(left_msg)
+            if right_msg is not None:
+                right_msgs.append(right_msg)
+        return "\n".join(left_msgs + right_msgs)
@@ -0,0 +1,167 @@
+# Structure-aware chunking of the QRH/FCTM markdown files (as converted by pdf2md.py). Instead of cutting the text every
+# 500 characters, every section under a heading (a procedure like "ENG 1(2) FIRE" with all its checklist items) becomes
+# one chunk with a procedure id, so retrieval returns whole procedures. Sections longer than max_chars are split between
+# checklist items, every part starts with the title and keeps the procedure id. Text before the first heading is split
+# with the generic splitter.
+# ProcedureIndex maps the normalized ECAM titles of the procedures to their ids. "1(2)", "L(R)", "G(Y)" in a title stand
+# for either side, so "ENG 1(2) FIRE" is found for the ECAM message "ENG 2 FIRE"; an alert whose titles are all in the
+# index gets their procedures directly, without a similarity search.
+
+import os
+import re
+from langchain_core.documents import Document
+
+QRH_CHUNKER_VERSION = 1     # part of the index cache key, increment when the chunks change
+MAX_PROCEDURE_CHARS = 4000
+
+HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+CHECKLIST_ITEM = re.compile(r"^\s*([-*•]|\d+[.)]|[A-Z0-9/ ]+\.{3,})")
+ALTERNATIVE = re.compile(r"\b(\w+)\((\w+)\)")   # "1(2)", "L(R)", "G(Y)"
+ECAM_COLOR = re.compile(r"\s*\((red|amber|white|green|blue)\)$")
+NON_PROCEDURE_TITLES = {"LAND ASAP"}    # red/amber lines that come with a failure but have no procedure of their own
+
+
+def normalize_title(text):
+    text = re.sub(r"[*_#`]", "", text).upper()
+    text = re.sub(r"\s*([+/])\s*", r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def ecam_title_keys(title):
+    """
+    Returns:
+    - keys: The normalized ECAM titles a procedure title stands for, e.g. "ENG 1 FIRE" and "ENG 2 FIRE" for
+      "ENG 1(2) FIRE", or "F/CTL FLAPS FAULT" and "F/CTL FLAPS LOCKED" for "F/CTL FLAPS FAULT/LOCKED".
+    """
+    keys = [normalize_title(title)]
+    words = keys[0].split(" ")
+    if len(words) > 1 and "/" in words[-1]:
+        keys = [" ".join(words[:-1] + [alternative]) for alternative in words[-1].split("/")]
+    expanded = []
+    while keys:
+        key = keys.pop()
+        match = ALTERNATIVE.search(key)
+        if match is None:
+            expanded.append(key)
+            continue
+        keys.extend(key[:match.start()] + alternative + key[match.end():] for alternative in match.groups())
+    return sorted(set(expanded))
+
+
+def slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def split_section(lines, max_chars):
+    # split the lines of a section into parts of at most max_chars, preferably before a checklist item or blank line
+    parts = [[]]
+    size = 0
+    for line in lines:
+        if size + len(line) > max_chars and parts[-1] and (not line.strip() or CHECKLIST_ITEM.match(line) or size > max_chars):
+            parts.append([])
+            size = 0
+        parts[-1].append(line)
+        size += len(line) + 1
+    return parts
+
+
+def split_procedures(document, fallback_splitter, max_chars=MAX_PROCEDURE_CHARS):
+    """
+    Split a markdown document into one chunk per section.
+
+    Parameters:
+    - document: Document of a markdown file, with the file path in metadata["source"].
+    - fallback_splitter: Text splitter for the text before the first heading.
+    - max_chars: Sections longer than this are split into parts.
+
+    Returns:
+    - chunks: List of documents. Section chunks have "procedure" (the title), "procedure_id", "section" (the titles of
+      the enclosing headings) and "part" in their metadata.
+    """
+    source = document.metadata.get("source", "")
+    file_id = os.path.splitext(os.path.basename(source))[0]
+    sections = []   # (level, title, lines)
+    preamble = []
+    for line in document.page_content.split("\n"):
+        match = HEADING.match(line.strip())
+        if match is not None:
+            sections.append((len(match.group(1)), normalize_title(match.group(2)), [line]))
+        elif sections:
+            sections[-1][2].append(line)
+        else:
+            preamble.append(line)
+
+    chunks = []
+    if "\n".join(preamble).strip():
+        chunks.extend(fallback_splitter.split_documents([Document(page_content="\n".join(preamble), metadata=document.metadata)]))
+
+    parents = []    # (level, title) of the enclosing headings
+    ids = set()
+    for level, title, lines in sections:
+        while parents and parents[-1][0] >= level:
+            parents.pop()
+        section = " > ".join(t for _, t in parents)
+        parents.append((level, title))
+        if not "\n".join(lines[1:]).strip():
+            continue    # only a heading, e.g. a chapter title, it is kept in the section of the procedures below it
+        procedure_id = f"{file_id}/{slug(title)}"
+        n = 2
+        while procedure_id in ids:
+            procedure_id = f"{file_id}/{slug(title)}-{n}"
+            n += 1
+        ids.add(procedure_id)
+        parts = split_section(lines, max_chars)
+        for i, part in enumerate(parts):
+            text = "\n".join(part).strip()
+            if i > 0:
+                text = f"{title} (continued)\n{text}"
+            chunks.append(Document(page_content=text, metadata=document.metadata | {
+                "procedure": title, "procedure_id": procedure_id, "section": section, "part": i, "parts": len(parts)}))
+    return chunks
+
+
+class ProcedureIndex():
+    """
+    Lookup of the procedure chunks by the ECAM titles, built from the chunks of split_procedures.
+    """
+    def __init__(self, chunks):
+        self.procedures = {}    # procedure id -> chunks in the order of their parts
+        self.titles = {}    # normalized ECAM title -> procedure id
+        for chunk in chunks:
+            procedure_id = chunk.metadata.get("procedure_id")
+            if procedure_id is None:
+                continue
+            self.procedures.setdefault(procedure_id, []).append(chunk)
+            for key in ecam_title_keys(chunk.metadata["procedure"]):
+                self.titles.setdefault(key, procedure_id)   # the first procedure with a title wins, in file name order
+
+    def __len__(self):
+        return len(self.procedures)
+
+    def lookup(self, ecam_message):
+        """
+        Parameters:
+        - ecam_message: ECAM messages as formatted by format_ecam_message in main.py, one "<text> (<color>)" per line.
+
+        Returns:
+        - chunks: The chunks of the procedures of all red and amber titles that are in the index, in the order of the
+          ECAM messages. Empty if none of them is known.
+        - complete: True if every red and amber title was found, otherwise the chunks cover only part of the failures.
+        """
+        chunks = []
+        found = set()
+        complete = True
+        for line in ecam_message.split("\n"):
+            color = ECAM_COLOR.search(line)
+            if color is None or color.group(1) not in ("red", "amber") or line.lstrip().startswith("-"):
+                continue
+            title = normalize_title(line[:color.start()])
+            if title in NON_PROCEDURE_TITLES:
+                continue
+            procedure_id = self.titles.get(title)
+            if procedure_id is None:
+                complete = False
+            elif procedure_id not in found:
+                found.add(procedure_id)
+                chunks.extend(self.procedures[procedure_id])
+        return chunks, complete
@@ -0,0 +1,68 @@
+# Manifest of the markdown files of the RAG index (md_rag_files/manifest.json). pdf2md.py writes it with the hashes of
+# every PDF and the markdown file converted from it, the relay server (index_cache.py) reads it to tell which markdown
+# files changed without reading and hashing them again.
+
+import hashlib
+import json
+import os
+import tempfile
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def write_atomic(path, data):
+    # write to a temporary file in the same directory and rename it, readers never see a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_manifest(md_dir):
+    """
+    Returns:
+    - manifest: {"files": {PDF file name -> entry}}, without entries if there is no readable manifest.
+    """
+    try:
+        with open(os.path.join(md_dir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), dict):
+        return {"files": {}}
+    return manifest
+
+
+def save_manifest(md_dir, entries):
+    write_atomic(os.path.join(md_dir, MANIFEST_NAME), json.dumps({"files": entries}, indent=1).encode())
+
+
+def load_manifest_hashes(md_dir):
+    """
+    Read the content hashes of the markdown files from the manifest. Entries of files that were modified after the
+    conversion (different size or modification time) are left out.
+
+    Returns:
+    - hashes: Dict of markdown file name -> sha256 hex digest.
+    """
+    hashes = {}
+    for entry in load_manifest(md_dir)["files"].values():
+        try:
+            stat = os.stat(os.path.join(md_dir, entry["markdown"]))
+        except (OSError, KeyError, TypeError):
+            continue
+        if stat.st_size == entry.get("md_size") and stat.st_mtime_ns == entry.get("md_mtime_ns"):
+            hashes[entry["markdown"]] = entry["md_sha256"]
+    return hashes
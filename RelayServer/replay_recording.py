@@ -0,0 +1,90 @@
+# Replays recordings of the flight recorder (flight_recorder.py) through the prompt formatting and retrieval of the relay
+# server, to reproduce what the relay saw around an incident. Several recordings (e.g. the requests of a session and the
+# telemetry of its plugin) are merged by their receive time. Telemetry rows are fed through the flight health monitor,
+# so its detectors trip at the same moments as during the flight. No LLM calls are made.
+# Usage: python3 replay_recording.py ./recordings/<recording> [more recordings] [--speed 1] [--no-retrieval] [--telemetry]
+#        --speed 0 replays as fast as possible
+
+import argparse
+import time
+import main
+from flight_monitor import FlightMonitor
+from flight_recorder import Recording
+
+REPLAYED_TRIGGERS = ["alert", "query", "state_change"]
+
+
+def merged_rows(recordings):
+    # (receive time, recording, row) of all recordings in the order they were received
+    return sorted((float(r.times[i]), j, i) for j, r in enumerate(recordings) for i in range(len(r)))
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description="Replay flight recorder recordings through the relay pipeline")
+    parser.add_argument("recordings", nargs="+", help="recording directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 is real time and 0 as fast as possible")
+    parser.add_argument("--no-retrieval", action="store_true", help="only format the prompts")
+    parser.add_argument("--telemetry", action="store_true", help="print every telemetry row, not only detector changes")
+    args = parser.parse_args()
+
+    main.PROMPT_SINK = main.print_prompt
+    recordings = [Recording(path) for path in args.recordings]
+    rows = merged_rows(recordings)
+    if not rows:
+        print("The recordings are empty")
+        return
+    print(f"Replaying {len(rows)} rows ({rows[-1][0] - rows[0][0]:.1f} s) of {len(recordings)} recordings")
+
+    retriever = None
+    if not args.no_retrieval:
+        embeddings = main.setup_embedding_model()
+        chunks, vectors = main.build_index(main.MD_RAG_FILE_PATH, embeddings)
+        retriever = main.create_hybrid_retriever(chunks, vectors, embeddings)
+
+    monitors = {}   # plugin id -> FlightMonitor
+    t_first = rows[0][0]
+    t_start = time.monotonic()
+    for t, j, i in rows:
+        if args.speed > 0:
+            delay = (t - t_first) / args.speed - (time.monotonic() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+        recording = recordings[j]
+        payload = recording.payload(i)
+        offset = f"{t - t_first:8.1f} s"
+
+        if recording.kind(i) == "telemetry":
+            monitor = monitors.setdefault(payload.get("plugin_id"), FlightMonitor())
+            tripped, cleared = monitor.update(payload)
+            if args.telemetry:
+                print(f"{offset} telemetry: IAS {payload.get('sim/flightmodel/position/indicated_airspeed', float('nan')):.0f} kt, "
+                      f"N1 {payload.get('AirbusFBW/fmod/eng/N1Array')}")
+            for message in tripped.values():
+                print(f"{offset} detector tripped: {message}")
+            for name in cleared:
+                print(f"{offset} detector cleared: {name}")
+            continue
+
+        trigger_source = payload.get("trigger_source")
+        if trigger_source == "text_entry":
+            print(f"{offset} text_entry: {payload.get('message')}")
+            continue
+        if trigger_source not in REPLAYED_TRIGGERS:
+            print(f"{offset} {trigger_source}")
+            continue
+
+        print("=" * 80)
+        print(f"{offset} {trigger_source}")
+        t_format = time.perf_counter()
+        prompt = main.format_prompt(payload)     # printed by the prompt sink
+        t_formatted = time.perf_counter()
+        print(f"Prompt of {len(prompt)} characters formatted in {(t_formatted - t_format) * 1000:.1f} ms")
+        if retriever is not None:
+            docs = main.retrieve_for_payload(retriever, payload)
+            print(f"Retrieved {len(docs)} documents in {(time.perf_counter() - t_formatted) * 1000:.1f} ms:")
+            for doc in docs:
+                print(f"- {doc.metadata.get('source', '')}: {doc.page_content[:100]!r}")
+
+
+if __name__ == "__main__":
+    main_replay()
@@ -0,0 +1,177 @@
+# Response cache for the relay server. In training the same failure scenarios are flown over and over again, so alerts
+# and queries are answered from the cache if the ECAM messages and the coarse flight state (altitude band, airspeed band,
+# on ground, gear and flaps) match an earlier request. If there is no exact match, the ECAM text is compared with the
+# cached ones by embedding similarity, so small differences in the ECAM lines (e.g. an already completed action) still hit.
+# Only entries with the same red and amber titles and the same engine/side tokens (1/2, L/R, G/B/Y) are compared: the
+# texts of "ENG 1 FIRE" and "ENG 2 FIRE" differ in a single character and are far more similar than the threshold, but
+# their procedures act on opposite engines.
+# Entries expire after ttl_s and the least recently used entries are evicted once max_entries is reached.
+
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+ALTITUDE_BAND_FT = 5000
+AIRSPEED_BAND_KT = 50
+SIDE_TOKEN = re.compile(r"(?<![\w.])(1|2|L|R|G|B|Y)(?![\w])")   # "ENG 2", "HYD G", "1(2)", not "10" or "0.1"
+TITLE_LINE = re.compile(r"^[^-].*\((RED|AMBER)\)$")
+
+
+def normalize_ecam_text(ecam_text):
+    # the amount of padding and dots between an action and its target depends on the line layout
+    lines = [re.sub(r"\.{2,}", "..", re.sub(r"\s+", " ", line)).strip() for line in ecam_text.upper().split('\n')]
+    return '\n'.join(line for line in lines if line)
+
+
+def ecam_signature(ecam_text):
+    """
+    Part of a normalized ECAM text that must match exactly for a near match.
+
+    Returns:
+    - signature: Tuple of (red and amber title lines, set of the engine/side tokens of all lines).
+    """
+    lines = ecam_text.split('\n')
+    titles = tuple(line for line in lines if TITLE_LINE.match(line))
+    sides = frozenset(token for line in lines for token in SIDE_TOKEN.findall(line.rsplit(" (", 1)[0]))
+    return titles, sides
+
+
+def flight_state_buckets(altitude_ft, airspeed_kt, on_ground, gear_down, flaps_extended):
+    """
+    Reduce the flight state to the coarse values that are part of the cache key.
+
+    Returns:
+    - buckets: Tuple of (altitude band, airspeed band, on ground, gear down, flaps extended).
+    """
+    return (int(altitude_ft // ALTITUDE_BAND_FT), int(airspeed_kt // AIRSPEED_BAND_KT), bool(on_ground), bool(gear_down),
+            bool(flaps_extended))
+
+
+class CacheEntry():
+    def __init__(self, ecam_text, state, answer, vector=None):
+        self.ecam_text = ecam_text
+        self.state = state      # everything of the key except the ECAM text, only entries with equal state are similar
+        self.answer = answer
+        self.signature = ecam_signature(ecam_text)
+        self.vector = vector
+        self.created = time.monotonic()
+
+
+class ResponseCache():
+    def __init__(self, embed_query=None, max_entries=256, ttl_s=3600, similarity_threshold=0.97, embed_documents=None):
+        """
+        Parameters:
+        - embed_query: Function that returns the embedding vector of a text, used for near matches. Without it, only
+          exact matches hit.
+        - embed_documents: Function that returns the embedding vectors of a list of texts in one call, used for the
+          cached ECAM texts. Without it, they are embedded one by one with embed_query.
+        - max_entries: Number of answers that are kept, the least recently used one is evicted first.
+        - ttl_s: Age after which an answer is no longer used (the METARs in it get outdated).
+        - similarity_threshold: Minimum cosine similarity of the ECAM texts for a near match.
+        """
+        self.embed_query = embed_query
+        self.embed_documents = embed_documents
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()    # (ecam_text, state) -> CacheEntry, in order of last use
+        self.lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "bypassed": 0, "expired": 0, "evicted": 0}
+
+    def is_expired(self, entry, now):
+        return now - entry.created > self.ttl_s
+
+    def normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def embed(self, ecam_text):
+        return self.normalize(self.embed_query(ecam_text))
+
+    def embed_many(self, ecam_texts):
+        if self.embed_documents is None:
+            return [self.embed(text) for text in ecam_texts]
+        return [self.normalize(vector) for vector in self.embed_documents(ecam_texts)]
+
+    def get(self, ecam_text, state):
+        """
+        Look up the answer for an ECAM text and flight state.
+
+        Parameters:
+        - ecam_text: Normalized ECAM messages (see normalize_ecam_text).
+        - state: Hashable tuple with the rest of the key (flight state buckets, response mode, ...).
+
+        Returns:
+        - answer: The cached answer or None.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((ecam_text, state))
+            if entry is not None and self.is_expired(entry, now):
+                del self.entries[(ecam_text, state)]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end((ecam_text, state))
+                self.stats["exact_hits"] += 1
+                return entry.answer
+            signature = ecam_signature(ecam_text)
+            candidates = [(k, e) for k, e in self.entries.items()
+                          if e.state == state and e.signature == signature and not self.is_expired(e, now)]
+
+        if self.embed_query is not None and candidates:
+            # embedding takes a network round trip, so it is only done on a miss and if there is something to compare
+            # to. Entries are embedded on their first comparison, all that are new in a single batch call, so a miss
+            # costs at most two round trips however many candidates there are.
+            vector = self.embed(ecam_text)
+            new = [e for _, e in candidates if e.vector is None]
+            if new:
+                for e, new_vector in zip(new, self.embed_many([e.ecam_text for e in new])):
+                    e.vector = new_vector
+            similarities = np.array([float(np.dot(vector, e.vector)) for _, e in candidates])
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                key, entry = candidates[best]
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                    self.stats["similar_hits"] += 1
+                return entry.answer
+
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+
+    def contains(self, ecam_text, state):
+        # exact lookup that does not count towards the hit rate, used to skip work that is already cached
+        with self.lock:
+            entry = self.entries.get((ecam_text, state))
+            return entry is not None and not self.is_expired(entry, time.monotonic())
+
+    def put(self, ecam_text, state, answer):
+        with self.lock:
+            self.entries[(ecam_text, state)] = CacheEntry(ecam_text, state, answer)
+            self.entries.move_to_end((ecam_text, state))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def count_bypass(self):
+        # a cacheable request that asked for a fresh answer
+        with self.lock:
+            self.stats["bypassed"] += 1
+
+    def hit_rate(self):
+        with self.lock:
+            hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+            lookups = hits + self.stats["misses"]
+        return hits / lookups if lookups else 0.0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
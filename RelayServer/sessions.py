@@ -0,0 +1,56 @@
+# Per-client state of the relay server. Every connected X-Plane plugin gets its own session (identified by the zmq
+# routing id of its socket), so several cockpits can share one relay without mixing up their conversations.
+
+import threading
+import time
+from speculation import SpeculationSlot
+from conversation_memory import ConversationMemory, HISTORY_TOKEN_BUDGET
+
+
+class RequestCancelled(Exception):
+    # raised on the worker that answers a request once the plugin superseded it (see Session.generation)
+    pass
+
+
+class Session():
+    def __init__(self, session_id, history_token_budget=HISTORY_TOKEN_BUDGET):
+        self.session_id = session_id
+        self.memory = ConversationMemory(history_token_budget)    # history of the text entry follow-ups
+        self.speculation = SpeculationSlot()
+        self.lock = threading.Lock()    # held by the worker that is currently answering for this session
+        self.last_seen = time.monotonic()
+        self.generation = 0     # incremented by arm and cancel requests, requests of older generations are aborted
+
+    def supersede(self):
+        # only called on the socket thread
+        self.generation += 1
+
+
+class SessionStore():
+    def __init__(self, idle_timeout_s=4*3600, history_token_budget=HISTORY_TOKEN_BUDGET):
+        self.idle_timeout_s = idle_timeout_s
+        self.history_token_budget = history_token_budget
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Return the session for session_id, creating it if necessary. Sessions that have not been used for longer than
+        idle_timeout_s are dropped on the way.
+        """
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self.history_token_budget)
+                self.sessions[session_id] = session
+            session.last_seen = now
+
+            stale = [sid for sid, s in self.sessions.items() if now - s.last_seen > self.idle_timeout_s]
+            for sid in stale:
+                del self.sessions[sid]
+
+        return session
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,81 @@
+# Speculative answers for the relay server. The plugin pushes a snapshot whenever the ECAM messages change, the relay
+# then starts retrieval and generation right away, before the Master Warning/Caution or the Query button triggers the
+# actual request. If the request arrives with the same ECAM state, the (possibly still running) speculation is used.
+
+import threading
+import time
+
+
+class Speculation():
+    def __init__(self, key):
+        self.key = key
+        self.created = time.monotonic()
+        self.cancelled = False
+        self.future = None
+
+    def cancel(self):
+        # a speculation that is already running cannot be interrupted, but it checks is_cancelled between LLM calls
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        return self.cancelled
+
+
+class SpeculationSlot():
+    """
+    Holds the latest speculation of a session. Starting a speculation for a new ECAM state cancels the previous one.
+    """
+    def __init__(self, max_age_s=60):
+        self.max_age_s = max_age_s  # the flight data of the snapshot gets outdated, older speculations are not used
+        self.current = None
+        self.lock = threading.Lock()
+
+    def is_stale(self, speculation):
+        return speculation.cancelled or time.monotonic() - speculation.created > self.max_age_s
+
+    def start(self, key, submit):
+        """
+        Start a speculation for key, unless one for the same key is already running or finished.
+
+        Parameters:
+        - key: ECAM state the speculation is computed for.
+        - submit: Function that takes the new speculation and returns the future of its computation.
+
+        Returns:
+        - started: True if a new speculation was started.
+        """
+        with self.lock:
+            if self.current is not None:
+                if self.current.key == key and not self.is_stale(self.current):
+                    return False
+                self.current.cancel()
+            speculation = Speculation(key)
+            speculation.future = submit(speculation)
+            self.current = speculation
+        return True
+
+    def claim(self, key):
+        """
+        Take the speculation for key out of the slot. A speculation for a different ECAM state is cancelled.
+
+        Returns:
+        - speculation: The matching speculation or None.
+        """
+        with self.lock:
+            speculation = self.current
+            self.current = None
+        if speculation is None:
+            return None
+        if speculation.key != key or self.is_stale(speculation):
+            speculation.cancel()
+            return None
+        return speculation
+
+    def cancel(self):
+        with self.lock:
+            speculation = self.current
+            self.current = None
+        if speculation is not None:
+            speculation.cancel()
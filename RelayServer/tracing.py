@@ -0,0 +1,79 @@
+# Per-request tracing for the relay server. Every alert, query and text entry gets a Trace with a request id, to which
+# the pipeline adds one span per stage (decode, retrieval, prompt formatting, generation, ...) with its duration and
+# attributes like token counts. Finished traces are written to the request log (see async_logging.py) as a single json
+# line and handed to the metrics.
+# Recording a span is a perf_counter call and a list append, so tracing stays enabled in production.
+
+import itertools
+import json
+import time
+
+REQUEST_IDS = itertools.count(1)
+
+
+class Span():
+    __slots__ = ("name", "start", "duration", "attributes")
+
+    def __init__(self, name, start, duration, attributes):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.attributes = attributes
+
+
+class Trace():
+    def __init__(self, session_id, t_received):
+        self.request_id = next(REQUEST_IDS)
+        self.session_id = session_id
+        self.t_received = t_received
+        self.trigger_source = None
+        self.total_s = None     # time to the last token, set once the reply was sent
+        self.first_token_s = None
+        self.spans = []
+        self.attributes = {}
+        self.details = {}   # large fields for the request log (context, prompt, answers), not part of the trace itself
+
+    def add(self, name, t_start, t_end=None, **attributes):
+        """
+        Add a span that started at t_start (perf_counter) and ends at t_end or now.
+
+        Returns:
+        - t_end: End of the span, so consecutive stages can be chained.
+        """
+        if t_end is None:
+            t_end = time.perf_counter()
+        self.spans.append(Span(name, t_start, t_end - t_start, attributes))
+        return t_end
+
+    def last_end(self):
+        span = self.spans[-1]
+        return span.start + span.duration
+
+    def durations(self):
+        # stages that occur several times in a request (e.g. a retry) are added up
+        durations = {}
+        for span in self.spans:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return durations
+
+    def to_dict(self):
+        return {"request_id": self.request_id,
+                "session_id": self.session_id,
+                "trigger_source": self.trigger_source,
+                "total_ms": round(self.total_s * 1000, 3) if self.total_s is not None else None,
+                "first_token_ms": round(self.first_token_s * 1000, 3) if self.first_token_s is not None else None,
+                **self.attributes,
+                "spans": [{"name": s.name,
+                           "start_ms": round((s.start - self.t_received) * 1000, 3),
+                           "duration_ms": round(s.duration * 1000, 3),
+                           **s.attributes} for s in self.spans]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+def add_span(trace, name, t_start, **attributes):
+    # like Trace.add, but does nothing if the request is not traced (e.g. speculations)
+    if trace is None:
+        return time.perf_counter()
+    return trace.add(name, t_start, **attributes)
@@ -7,66 +7,38 @@ from XPPython3 import xp
 from XPPython3 import xp_imgui # type: ignore
 import imgui  # type: ignore
 import imgui.integrations.opengl as gl
-import threading
 import time
 import zmq
 import json
 import re
+import uuid
+from ai_assistant_wire import WireEncoder, schema_hash
+from ai_assistant_client import AssistantClient
+from ai_assistant_pagination import Paginator
+from ai_assistant_datarefs import DatarefRegistry
+from ai_assistant_ecam import EcamWatcher
 
-# need a dummy function for retrieving arrays
-def getvf(dr):
-    values = []
-    xp.getDatavf(dr,values)
-    return values
-
-# need a dummy function for retrieving arrays
-def getvi(dr):
-    values = []
-    xp.getDatavi(dr,values)
-    return values
+SERVER_URI = "127.0.0.1:5555"
+TELEMETRY_URI = "127.0.0.1:5556"    # flight data for the flight health monitor of the relay server
+ADVISORY_URI = "127.0.0.1:5557"     # advisories of the flight health monitor
+TELEMETRY_INTERVAL_S = 0.5
+ECAM_SETTLE_FRAMES = 5     # frames the ECAM messages have to stay the same before an alert is sent
+PLUGIN_ID = uuid.uuid4().hex    # topic of the advisories for this plugin
 
-ECAM_COLORS = ["w", "g", "b", "a", "r"]
-ECAM_LINES = [1, 2, 3, 4, 5, 6, 7]
-ECAM_DREFS = [f"AirbusFBW/EWD{l}{c}Text" for l in ECAM_LINES for c in ECAM_COLORS]
+context = zmq.Context.instance()   # the requests to the relay go through the socket of the AssistantClient
 
-FLIGHT_DREFS = [("sim/flightmodel/position/latitude",xp.getDataf),
-                ("sim/flightmodel/position/longitude",xp.getDataf),
-                ("sim/flightmodel/position/elevation",xp.getDataf),
-                ("sim/flightmodel/position/y_agl",xp.getDataf),
-                ("sim/flightmodel/position/mag_psi",xp.getDataf),
-                ("toliss_airbus/pfdoutputs/captain/pitch_angle",xp.getDataf),
-                ("toliss_airbus/pfdoutputs/captain/roll_angle",xp.getDataf),
-                ("sim/flightmodel/position/alpha",xp.getDataf),
-                ("sim/flightmodel/position/beta",xp.getDataf),
-                ("sim/flightmodel/position/indicated_airspeed",xp.getDataf),
-                ("sim/flightmodel/position/groundspeed",xp.getDataf),
-                ("sim/flightmodel/position/vh_ind_fpm",xp.getDataf),
-                ("AirbusFBW/fmod/eng/N1Array", getvf),  # array of N1
-                ("sim/flightmodel2/controls/flap1_deploy_ratio",xp.getDataf),
-                ("sim/flightmodel2/controls/flap2_deploy_ratio",xp.getDataf),
-                ("AirbusFBW/SlatPositionLWing",xp.getDataf), 
-                ("AirbusFBW/SlatPositionRWing",xp.getDataf),
-                ("AirbusFBW/RightGearInd",xp.getDatai),
-                ("AirbusFBW/LeftGearInd",xp.getDatai),
-                ("AirbusFBW/NoseGearInd",xp.getDatai),
-                ("sim/flightmodel2/gear/on_ground",getvi),  # array where [0] is nose gear, [1] is left gear, [2] is right gear
-                ("sim/flightmodel/weight/m_fuel_total",xp.getDataf), 
-                ("toliss_airbus/fuelTankContent_kgs",getvf), # array where [0] is center tank, [1] is left inner tank, [2] right inner tank, [3] is left tip tank, [4] is right tip tank
-                ("AirbusFBW/AP1Engage",xp.getDatai),
-                ("AirbusFBW/AP2Engage",xp.getDatai),
-                ("AirbusFBW/ATHRmode",xp.getDatai),   # >0 indicates that athr is activated    
-                ("sim/cockpit2/temperature/outside_air_temp_deg",xp.getDataf),
-                ("sim/cockpit2/gauges/indicators/wind_heading_deg_mag",xp.getDataf),
-                ("sim/cockpit2/gauges/indicators/wind_speed_kts",xp.getDataf),
-                ]
+telemetry_socket = context.socket(zmq.PUB)  # only used in the flight loop
+telemetry_socket.setsockopt(zmq.SNDHWM, 10)     # drop samples instead of queueing them if the relay is not reachable
+telemetry_socket.connect(f"tcp://{TELEMETRY_URI}")
+advisory_socket = context.socket(zmq.SUB)   # only used in the flight loop
+advisory_socket.setsockopt(zmq.SUBSCRIBE, PLUGIN_ID.encode('utf-8'))
+advisory_socket.connect(f"tcp://{ADVISORY_URI}")
 
-SERVER_URI = "127.0.0.1:5555"
+request_encoder = WireEncoder(key_frame_interval=1)    # requests are rare, every one is a full key frame
+telemetry_encoder = WireEncoder()
 
-context = zmq.Context()
-socket = context.socket(zmq.REQ)
-socket.setsockopt(zmq.RCVBUF, 10 * 1024 * 1024)  # Set receive buffer to 10 MB
-socket.setsockopt(zmq.SNDBUF, 10 * 1024 * 1024)  # Set send buffer to 10 MB
-socket.connect(f"tcp://{SERVER_URI}")
+def clean_llm_text(text):
+    return re.sub(r'[^\x00-\x7F]+', ' ', text).replace("**","")
 
 class PythonInterface:
     def __init__(self):
@@ -88,10 +60,21 @@ class PythonInterface:
         self.font_path = './Resources/fonts/tahomabd.ttf'   # this is relative to the X-Plane home directory
         self.font_size = 20
         self.text_box_entry = ""
-        
-               
-        threading.Thread(target=self.listen).start()
-        # asyncio.create_task(self.listen_warn_caut())
+        self.health_findings = ""   # detectors of the flight health monitor that are currently tripped
+        self.telemetry_loop = None
+        self.ecam_loop = None
+        self.ecam_watcher = None    # EcamWatcher, created in XPluginStart
+        self.datarefs = None    # DatarefRegistry, created in XPluginStart
+        self.binary_wire = False    # set once the relay confirmed our wire format schema
+        self.arm_request = None
+        self.response_request = None    # id of the request whose answer is streamed into the pages
+        self.response_prefix = ""
+        self.response_text = ""
+        self.response_times = None  # (trigger source, sent, first chunk) for the latency printout
+        self.call_pending = False   # alert/query that is sent once the ECAM messages have settled
+        self.paginator = None   # created in the draw loop, it needs the font
+        self.client = AssistantClient(SERVER_URI, request_encoder)
+        self.client.start()
     
     
         
@@ -101,18 +84,41 @@ class PythonInterface:
                                     "Create IMGUI window")
         xp.registerCommandHandler(self.cmd, self.commandHandler, 1, self.cmdRef)
         xp.appendMenuItemWithCommand(xp.findPluginsMenu(), 'A320 LLM', self.cmd)
+        self.datarefs = DatarefRegistry(xp)
+        self.ecam_watcher = EcamWatcher(self.read_warnings, lambda: self.datarefs.snapshot("ecam"),
+                                        settle_frames=ECAM_SETTLE_FRAMES)
 
         return 'A320 LLM v1.0', 'xppython3.imgui_test', 'An LLM Interface for an Airbus A320'
 
     def XPluginEnable(self):
+        # the flight data is read on the main thread in a flight loop and published for the flight health monitor
+        self.telemetry_loop = xp.createFlightLoop(self.publish_telemetry)
+        xp.scheduleFlightLoop(self.telemetry_loop, TELEMETRY_INTERVAL_S)
+        # the warning lights and ECAM messages are checked every frame
+        self.ecam_loop = xp.createFlightLoop(self.watch_ecam)
+        xp.scheduleFlightLoop(self.ecam_loop, -1)
+        self.send_arm()     # wire format handshake
         return 1
   
     def XPluginStop(self):
         # unregister command and clean up menu
         xp.unregisterCommandHandler(self.cmd, self.commandHandler, 1, self.cmdRef)
         xp.clearAllMenuItems(xp.findPluginsMenu())
+        self.client.stop()
+        print(f"AI Assistant dataref snapshots: {self.datarefs.timing_summary()}")
+  
+    def XPluginReceiveMessage(self, inFromWho, inMessage, inParam):
+        # the datarefs of the ToLiss A320 only exist once it is loaded
+        if inMessage == xp.MSG_PLANE_LOADED and inParam == 0:
+            self.datarefs.resolve()
   
     def XPluginDisable(self):
+        if self.telemetry_loop is not None:
+            xp.destroyFlightLoop(self.telemetry_loop)
+            self.telemetry_loop = None
+        if self.ecam_loop is not None:
+            xp.destroyFlightLoop(self.ecam_loop)
+            self.ecam_loop = None
         # delete any imgui_windows, clear the structure
         for x in list(self.imgui_windows):
             self.imgui_windows[x]['instance'].delete()
@@ -157,80 +163,111 @@ class PythonInterface:
 
         return
     
-    def listen(self,):
-        dataRef_WARN = xp.findDataRef('AirbusFBW/MasterWarn')
-        dataRef_CAUT = xp.findDataRef('AirbusFBW/MasterCaut')
-        
-        while True:
-            time.sleep(0.5)
-            self.master_warn = xp.getDatai(dataRef_WARN)
-            self.master_caut = xp.getDatai(dataRef_CAUT)
-            
-            # if (self.master_warn or self.master_caut) and self.state == "Armed":
-                
-            
+    def read_warnings(self,):
+        warnings = self.datarefs.snapshot("warnings")
+        self.master_warn = warnings["master_warning"]
+        self.master_caut = warnings["master_caution"]
+        return warnings
     
-    def paginate_text(self,text, wrap_width, page_height):
-        words = text.split(' ')
-        current_page = []
-        pages = []
-        current_text = ""
-        # with imgui.font(self.font):
-            
-        for word in words:
-            # Try adding the next word
-            test_text = current_text + (" " if current_text else "") + word
-            
-            text_size = imgui.calc_text_size(test_text, wrap_width=wrap_width)
-
-            # Check if adding this word would exceed the page height
-            if text_size[1] > page_height:
-                # If it would exceed, finalize the current page and start a new one
-                pages.append(" ".join(current_page))
-                current_text = word
-                current_page = [word]
-
-            else:
-                # Otherwise, add the word and continue
-                current_page.append(word)
-                current_text = test_text
-
-        # Add any remaining text as the last page
-        if current_page:
-            pages.append(" ".join(current_page))
-
-        return pages
+    def watch_ecam(self, sinceLast, elapsedTime, counter, refCon):
+        now = time.monotonic()
+        # push the new state to the relay when the ECAM messages change, so it can already start working on an answer
+        if self.ecam_watcher.update(now) and self.state == "Armed":
+            self.send_state_change()
+        self.check_master_warn_caut(now)
+        self.send_pending_call(now)
+        return -1   # every frame
+    
+    def publish_telemetry(self, sinceLast, elapsedTime, counter, refCon):
+        sample = self.datarefs.snapshot("flight") | {"plugin_id": PLUGIN_ID, "time": time.monotonic()}
+        message = telemetry_encoder.encode(sample) if self.binary_wire else json.dumps(sample).encode('utf-8')
+        try:
+            telemetry_socket.send_multipart([b"telemetry", message], zmq.NOBLOCK)
+        except zmq.Again:
+            pass
+        while advisory_socket.poll(0):
+            self.handle_advisory(json.loads(advisory_socket.recv_multipart()[-1].decode()))
+        return TELEMETRY_INTERVAL_S
+    
+    def handle_advisory(self, advisory):
+        if advisory["kind"] == "detectors":
+            self.health_findings = "; ".join(advisory["findings"])
+        elif advisory["kind"] == "assessment" and self.state == "Armed":
+            # only shown if the pilots are not already working with an answer
+            self.text_all_pages = "Flight health monitor:\n" + clean_llm_text(advisory["text"])
+            self.raw_llm_response = self.text_all_pages
+                
     
     def process_llm_response(self,):
+        # has to be called with the font of the window pushed, the paginator measures the words with it
+        font = (id(self.font), imgui.get_font_size())
+        if self.paginator is None:
+            self.paginator = Paginator(lambda word: imgui.calc_text_size(word)[0], imgui.get_text_line_height(), font)
+        self.paginator.set_font(font, imgui.get_text_line_height())
+        if self.raw_llm_response is None and self.paginator.needs_reflow(self.window_width, self.window_height*0.7):
+            self.raw_llm_response = self.paginator.text     # the window was resized, or the font changed
         if self.raw_llm_response is not None:    
-            self.llm_text_pages = self.paginate_text(self.raw_llm_response, self.window_width, self.window_height*0.7)
+            self.llm_text_pages = self.paginator.update(self.raw_llm_response, self.window_width, self.window_height*0.7)
             self.no_pages = len(self.llm_text_pages)
             self.curr_page = min(self.curr_page, self.no_pages-1)
             self.llm_text = self.llm_text_pages[self.curr_page]
             self.raw_llm_response = None
         
+    def stream_llm_response(self, data, prefix):
+        # the answer is appended to prefix chunk by chunk in process_client_events, a newer request replaces this one.
+        # Not retried: the relay may still be generating the answer, a timeout is shown as an error instead
+        self.response_request = self.client.submit(data, stream=True, binary=self.binary_wire, retries=0)
+        self.response_prefix = prefix
+        self.response_text = ""
+        self.response_times = (data['trigger_source'], time.perf_counter(), None)
+    
+    def process_client_events(self,):
+        # called from the draw loop, the AssistantClient never blocks it
+        for request_id, kind, text in self.client.poll_events():
+            if request_id == self.arm_request and kind == "reply":
+                # older relays answer "ok", newer ones tell us whether they know our binary wire format
+                self.binary_wire = text != "ok" and json.loads(text)["wire_schema"]
+            if request_id != self.response_request:
+                continue    # superseded, or a request without an answer to display
+            trigger_source, t_start, t_first = self.response_times
+            if kind == "chunk":
+                if t_first is None:
+                    self.response_times = (trigger_source, t_start, time.perf_counter())
+                self.response_text += text
+                self.text_all_pages = self.response_prefix + clean_llm_text(self.response_text)
+                self.raw_llm_response = self.text_all_pages
+            elif kind == "done":
+                t_last = time.perf_counter()
+                if t_first is None:
+                    t_first = t_last
+                print(f"{trigger_source}: time to first token {t_first - t_start:.3f} s, time to last token {t_last - t_start:.3f} s")
+                self.response_request = None
+            elif kind == "error":
+                self.text_all_pages = self.response_prefix + clean_llm_text(self.response_text) + f"\n\nError: {text}"
+                self.raw_llm_response = self.text_all_pages
+                self.response_request = None
+        
+    def read_datarefs(self,):
+        # master warning/caution, ECAM messages and flight data, with the dataref paths as keys
+        return self.datarefs.snapshot("all")
+        
+    def send_state_change(self,):
+        # the relay answers with "ok" right away
+        self.client.submit({"trigger_source": "state_change"} | self.read_datarefs(), binary=self.binary_wire)
+        
     def llm_call(self,):
         self.raw_llm_response = "Retrieving Response from LLM..."
         self.state = "Active"
-        
-        time.sleep(0.5) # ECAM messages show up with a small time delay sometimes
-        
-        ecam_drefs = [xp.findDataRef(dr) for dr in ECAM_DREFS]
-        flight_drefs = [xp.findDataRef(dr[0]) for dr in FLIGHT_DREFS]
-        # encode the master warning we got and send it along
-        ecam_values = [xp.getDatas(edr) for edr in ecam_drefs]
-        flight_values = [f[1](fdr) for fdr,f in zip(flight_drefs,FLIGHT_DREFS)]
-        socket.send(json.dumps({
+        self.call_pending = True
+    
+    def send_pending_call(self, now):
+        # ECAM messages show up with a small delay sometimes, the call waits until they have settled
+        if not self.call_pending or not self.ecam_watcher.settled(now):
+            return
+        self.call_pending = False
+        self.stream_llm_response({
             "trigger_source": "alert" if (self.master_caut or self.master_warn) else "query",
-            "master_warning": self.master_warn,
-            "master_caution": self.master_caut,
-        }|{dr:val for dr,val in zip(ECAM_DREFS, ecam_values)}|
-                                {dr[0]:val for dr,val in zip(FLIGHT_DREFS, flight_values)}).encode('utf-8'))
-        message = socket.recv().decode()
-        message = re.sub(r'[^\x00-\x7F]+', ' ', message).replace("**","")
-
-        self.text_all_pages = message
-        self.raw_llm_response = self.text_all_pages
+        } | self.read_datarefs(), "")
 
     def llm_call_follow_up(self,):
         msg = self.text_box_entry
@@ -242,38 +279,33 @@ class PythonInterface:
         # else:
         #     self.raw_llm_response += f"\n\nQ: {msg}"
             
-        socket.send(json.dumps({
+        self.text_box_entry = ""    # clear text box after submission
+        self.stream_llm_response({
             "trigger_source": "text_entry",
             "message": msg,
-        }).encode('utf-8'))
-        self.text_box_entry = ""    # clear text box after submission
-        message = socket.recv().decode()
-        message = re.sub(r'[^\x00-\x7F]+', ' ', message).replace("**","")
-        
-        
-        self.text_all_pages = self.text_all_pages + f"\n\nA: {message}"
-        self.raw_llm_response = self.text_all_pages
+        }, self.text_all_pages + "\n\nA: ")
         print(self.text_all_pages)
         
     def send_arm(self,):
-        socket.send(json.dumps({"trigger_source": "arm"}).encode("utf-8"))
-        _ = socket.recv().decode()  # need to receive a message or ZMQ is unhappy
+        # pre-empts the requests in flight, the reply is handled in process_client_events
+        self.call_pending = False
+        self.response_request = None
+        self.arm_request = self.client.submit({"trigger_source": "arm", "wire_schema": schema_hash()})
     
-    def check_master_warn_caut(self,):
-        if (self.master_caut or self.master_warn) and self.state == "Armed":
+    def check_master_warn_caut(self, now):
+        if self.ecam_watcher.alert_ready(now) and self.state == "Armed":
             self.state = "Active"
-            threading.Thread(target=self.llm_call).start()
-            # asyncio.create_task(self.llm_call())
+            self.llm_call()
     
     def query(self,):
         self.state = "Active"
         self.text_all_pages = ""
         self.llm_text_pages = ["",]
-        threading.Thread(target=self.llm_call).start()
-        # asyncio.create_task(self.llm_call())
+        self.llm_call()
         
     def clear(self,):
         self.llm_text = ""
+        self.raw_llm_response = ""  # also clears the text of the paginator, so a resize does not bring it back
         self.llm_text_pages = ["",]
         self.text_box_entry = ""
         self.text_all_pages = ""
@@ -282,7 +314,7 @@ class PythonInterface:
         self.state = "Armed"
         
         # send arm command to server
-        threading.Thread(target=self.send_arm).start()
+        self.send_arm()
         
     
     def next_page(self,):
@@ -297,7 +329,7 @@ class PythonInterface:
     
     def text_box_subm_button(self):
         self.state = "Interactive"
-        threading.Thread(target=self.llm_call_follow_up).start()
+        self.llm_call_follow_up()
     
     # this method is called every time the window is refreshed. No compute-heavy steps advised in here
     def drawWindow(self, windowID, refCon):     
@@ -309,8 +341,7 @@ class PythonInterface:
         button_height = button_width/3
         y_position = imgui.get_cursor_pos_y()
         
-        # check the master warn/caut for each drawing cycle 
-        self.check_master_warn_caut()
+        self.process_client_events()
         
         with imgui.font(self.font):
             self.process_llm_response()
@@ -358,6 +389,11 @@ class PythonInterface:
                 
             imgui.spacing()
             
+            if self.health_findings:
+                imgui.push_text_wrap_pos(0.0)
+                imgui.text_colored(f"Monitor: {self.health_findings}", 1.0, 0.75, 0.0)
+                imgui.pop_text_wrap_pos()
+            
             imgui.text_wrapped(self.llm_text)
             
             # text box entry
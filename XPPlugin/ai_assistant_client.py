@@ -0,0 +1,176 @@
+# Client of the relay server for the X-Plane plugin. A single worker thread owns the zmq DEALER socket, so requests from
+# the draw loop and the listen thread never use the socket concurrently. Every request is sent with a correlation id
+# frame in front of the empty delimiter, which the relay echoes back with every reply, so replies of superseded requests
+# can be told apart and dropped. Requests time out if the relay stays silent, and are retried if nothing was received yet.
+# The relay may still be generating the answer of a silent alert, query or text entry, so their retries first cancel
+# the requests of the session, otherwise the relay would answer (and bill) the same request twice.
+# New alerts and queries cancel the ones still in flight, and an arm request pre-empts everything; the relay aborts the
+# cancelled requests of the session.
+# Replies are handed to the draw loop through a deque of (request id, kind, text) events, kind is "chunk", "done",
+# "reply" or "error". deque.append and deque.popleft are atomic, so neither side ever waits for the other.
+
+import collections
+import itertools
+import json
+import queue
+import threading
+import time
+import zmq
+
+REQUEST_TIMEOUT_S = 60  # maximum time without any reply from the relay
+REQUEST_RETRIES = 1     # resends of requests the relay has not answered at all
+POLL_INTERVAL_MS = 50
+SUPERSEDING_TRIGGERS = ["alert", "query"]   # these cancel the alerts, queries and text entries in flight
+LLM_TRIGGERS = SUPERSEDING_TRIGGERS + ["text_entry"]   # requests that are answered by the LLM
+
+
+class Request():
+    def __init__(self, request_id, data, stream, binary, timeout_s, retries):
+        self.request_id = request_id
+        self.data = data
+        self.stream = stream
+        self.binary = binary
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.attempts = 0
+        self.correlation_id = None  # of the current attempt
+        self.received = False
+        self.last_activity = None
+
+
+class AssistantClient(threading.Thread):
+    """
+    Parameters:
+    - server_uri: host:port of the relay server.
+    - encoder: WireEncoder for the requests that are sent in the binary wire format.
+    """
+    def __init__(self, server_uri, encoder, timeout_s=REQUEST_TIMEOUT_S, retries=REQUEST_RETRIES):
+        super().__init__(daemon=True, name="ai_assistant_client")
+        self.server_uri = server_uri
+        self.encoder = encoder
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.commands = queue.SimpleQueue()     # ("send", Request) or ("cancel", None)
+        self.events = collections.deque()   # (request id, kind, text), consumed by the draw loop
+        self.request_ids = itertools.count(1)
+        self.correlation_ids = itertools.count(1)
+        self.in_flight = {}     # correlation id -> Request
+        self.stop_event = threading.Event()
+
+    def submit(self, data, stream=False, binary=False, timeout_s=None, retries=None):
+        """
+        Queue a request, can be called from any thread.
+
+        Returns:
+        - request_id: Id of the events of this request.
+        """
+        request = Request(next(self.request_ids), data, stream, binary,
+                          self.timeout_s if timeout_s is None else timeout_s, self.retries if retries is None else retries)
+        self.commands.put(("send", request))
+        return request.request_id
+
+    def cancel(self):
+        # cancel all requests in flight, can be called from any thread
+        self.commands.put(("cancel", None))
+
+    def poll_events(self):
+        while True:
+            try:
+                yield self.events.popleft()
+            except IndexError:
+                return
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        context = zmq.Context.instance()
+        socket = context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.RCVBUF, 10 * 1024 * 1024)
+        socket.setsockopt(zmq.SNDBUF, 10 * 1024 * 1024)
+        socket.setsockopt(zmq.IMMEDIATE, 1)     # do not queue requests while the relay is not connected
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(f"tcp://{self.server_uri}")
+        while not self.stop_event.is_set():
+            while True:
+                try:
+                    command, argument = self.commands.get_nowait()
+                except queue.Empty:
+                    break
+                if command == "send":
+                    self.send(socket, argument)
+                else:
+                    self.supersede(socket, list(self.in_flight.values()))
+
+            if socket.poll(POLL_INTERVAL_MS):
+                while True:
+                    try:
+                        self.receive(socket.recv_multipart(zmq.NOBLOCK))
+                    except zmq.Again:
+                        break
+
+            now = time.monotonic()
+            for request in list(self.in_flight.values()):
+                if now - request.last_activity > request.timeout_s:
+                    del self.in_flight[request.correlation_id]
+                    if not request.received and request.attempts <= request.retries:
+                        if request.data.get("trigger_source") in LLM_TRIGGERS:
+                            self.drop(self.llm_requests())
+                            self.send_cancel(socket)
+                        self.send(socket, request)
+                    else:
+                        self.events.append((request.request_id, "error", "The relay server did not respond"))
+        socket.close()
+
+    def send(self, socket, request):
+        trigger_source = request.data.get("trigger_source")
+        if trigger_source == "arm":
+            self.drop(list(self.in_flight.values()))    # the relay aborts them when it receives the arm request
+        elif trigger_source in SUPERSEDING_TRIGGERS:
+            self.supersede(socket, self.llm_requests())
+
+        request.attempts += 1
+        request.correlation_id = str(next(self.correlation_ids)).encode('utf-8')
+        request.last_activity = time.monotonic()
+        data = (request.data | {"stream": True}) if request.stream else request.data
+        message = self.encoder.encode(data) if request.binary else json.dumps(data).encode('utf-8')
+        try:
+            socket.send_multipart([request.correlation_id, b"", message], zmq.NOBLOCK)
+        except zmq.Again:
+            pass    # not connected, the request times out and is retried like a lost one
+        self.in_flight[request.correlation_id] = request
+
+    def drop(self, requests):
+        for request in requests:
+            del self.in_flight[request.correlation_id]
+
+    def llm_requests(self):
+        return [r for r in self.in_flight.values() if r.data.get("trigger_source") in LLM_TRIGGERS]
+
+    def send_cancel(self, socket):
+        # the relay aborts all requests of the session that are still waiting or generating
+        self.send(socket, Request(next(self.request_ids), {"trigger_source": "cancel"}, False, False, self.timeout_s, 0))
+
+    def supersede(self, socket, requests):
+        # drop the requests and tell the relay to abort them
+        if requests:
+            self.drop(requests)
+            self.send_cancel(socket)
+
+    def receive(self, frames):
+        # [correlation id, b"", reply] or [correlation id, b"", kind, data] for streamed answers
+        request = self.in_flight.get(frames[0])
+        if request is None or b"" not in frames:
+            return  # cancelled or timed out
+        body = frames[frames.index(b"") + 1:]
+        request.received = True
+        request.last_activity = time.monotonic()
+        if len(body) == 1:
+            # a streamed request only gets a single reply if the relay rejected it
+            del self.in_flight[frames[0]]
+            self.events.append((request.request_id, "error" if request.stream else "reply", body[0].decode()))
+        elif body[0] == b"chunk":
+            self.events.append((request.request_id, "chunk", body[1].decode()))
+        elif body[0] == b"end":
+            del self.in_flight[frames[0]]
+            self.events.append((request.request_id, "done", ""))
@@ -0,0 +1,98 @@
+# Registry of the datarefs the plugin sends to the relay server. The handles of all datarefs are looked up once (when
+# the plugin starts and again when an aircraft is loaded, since the ToLiss datarefs only exist once the A320 is
+# loaded), and every dataref gets a reader for its type with a preallocated buffer for the arrays. snapshot() reads a
+# group of datarefs in one call and keeps track of its cost in microseconds, which runs in the sim frame when it is
+# called from a flight loop.
+# The datarefs and their types are the ones of the wire format schema (ai_assistant_wire.py), so the snapshots have the
+# same keys as the messages the relay expects.
+
+import time
+from ai_assistant_wire import SCHEMA
+
+# entries of the schema that are not named by their dataref path
+DATAREF_PATHS = {"master_warning": "AirbusFBW/MasterWarn",
+                 "master_caution": "AirbusFBW/MasterCaut"}
+DEFAULTS = {"f": 0.0, "d": 0.0, "i": 0, "s": "", "vf": [], "vi": []}
+
+
+def dataref_group(name):
+    if name in DATAREF_PATHS:
+        return "warnings"
+    if name.startswith("AirbusFBW/EWD"):
+        return "ecam"
+    return "flight"
+
+
+class DatarefRegistry():
+    """
+    Parameters:
+    - xp: The XPPython3 xp module.
+    - schema: List of (name, type) of the datarefs, types as in the wire format.
+    Groups: "warnings" (master warning and caution), "ecam" (ECAM lines), "flight" (flight data) and "all".
+    """
+    def __init__(self, xp, schema=SCHEMA):
+        self.xp = xp
+        self.schema = schema
+        self.readers = {}   # group -> list of (name, reader)
+        self.missing = []
+        self.timings = {}   # group -> [snapshots, total us, max us]
+        self.resolve()
+
+    def resolve(self):
+        readers = {"all": []}
+        self.missing = []
+        for name, kind in self.schema:
+            reader = self.make_reader(DATAREF_PATHS.get(name, name), kind)
+            if reader is None:
+                self.missing.append(name)
+                default = DEFAULTS[kind]
+                reader = lambda default=default: default
+            readers["all"].append((name, reader))
+            readers.setdefault(dataref_group(name), []).append((name, reader))
+        self.readers = readers
+        if self.missing:
+            print(f"AI Assistant: {len(self.missing)} datarefs not found, e.g. {self.missing[0]}")
+
+    def make_reader(self, path, kind):
+        xp = self.xp
+        ref = xp.findDataRef(path)
+        if ref is None:
+            return None
+        if kind == "f":
+            get = xp.getDataf
+            return lambda: get(ref)
+        if kind == "d":
+            get = xp.getDatad
+            return lambda: get(ref)
+        if kind == "i":
+            get = xp.getDatai
+            return lambda: get(ref)
+        if kind == "s":
+            get = xp.getDatas
+            return lambda: get(ref)
+        get = xp.getDatavf if kind == "vf" else xp.getDatavi
+        count = get(ref)    # without a list, the number of elements is returned
+        buffer = [DEFAULTS[kind[1]]] * count
+
+        def read_array():
+            get(ref, buffer, 0, count)
+            return buffer[:count]
+        return read_array
+
+    def snapshot(self, group="all"):
+        """
+        Returns:
+        - values: Dict of name -> current value of all datarefs of the group.
+        """
+        t_start = time.perf_counter()
+        values = {name: read() for name, read in self.readers[group]}
+        elapsed_us = (time.perf_counter() - t_start) * 1e6
+        timing = self.timings.setdefault(group, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += elapsed_us
+        timing[2] = max(timing[2], elapsed_us)
+        return values
+
+    def timing_summary(self):
+        return ", ".join(f"{group}: {n} snapshots, mean {total / n:.1f} us, max {maximum:.1f} us"
+                         for group, (n, total, maximum) in self.timings.items())
@@ -0,0 +1,80 @@
+# Change detection of the ECAM messages and warning lights for the plugin. The watcher is updated from a flight loop
+# every frame, hashes the ECAM text datarefs and counts for how many frames the content stayed the same. When the Master
+# Warning or Caution lights up, the ECAM messages often appear a few frames later, so an alert is only ready once the
+# content has settled for settle_frames frames (or max_settle_s has passed, e.g. with flashing messages), instead of
+# waiting a fixed time.
+# The dataref reads are passed in as functions, so the debouncing runs without X-Plane with any fake dataref source.
+
+SETTLE_FRAMES = 5   # about 80 ms at 60 fps
+MAX_SETTLE_S = 1.0
+
+
+class EcamWatcher():
+    """
+    Parameters:
+    - read_warnings: Function that returns the master warning and master caution as a dict or tuple of two values.
+    - read_ecam: Function that returns the texts of the ECAM lines (dict of dataref -> text, or a list).
+    """
+    def __init__(self, read_warnings, read_ecam, settle_frames=SETTLE_FRAMES, max_settle_s=MAX_SETTLE_S):
+        self.read_warnings = read_warnings
+        self.read_ecam = read_ecam
+        self.settle_frames = settle_frames
+        self.max_settle_s = max_settle_s
+        self.ecam_hash = None
+        self.ecam_empty = True
+        self.changed_at = None  # time of the last change of the ECAM content
+        self.changing_since = None  # time of the first change after the content had settled
+        self.stable_frames = 0
+        self.reported_hash = None   # ECAM content that was last reported as changed
+        self.warning = False    # master warning or caution lit
+        self.warning_since = None   # time the warning lit up, kept while the light flashes
+        self.warning_off_at = None
+
+    def update(self, now):
+        """
+        Read the datarefs of the current frame.
+
+        Returns:
+        - changed: True if the ECAM content has settled to something new since the last report and is not empty.
+        """
+        warnings = self.read_warnings()
+        warning = any(warnings.values() if isinstance(warnings, dict) else warnings)
+        if warning and not self.warning and \
+                (self.warning_off_at is None or now - self.warning_off_at > self.max_settle_s):
+            self.warning_since = now
+        elif self.warning and not warning:
+            self.warning_off_at = now
+        self.warning = warning
+
+        ecam = self.read_ecam()
+        texts = tuple(ecam.values() if isinstance(ecam, dict) else ecam)
+        ecam_hash = hash(texts)
+        if ecam_hash != self.ecam_hash:
+            if self.changed_at is None or self.stable_frames >= self.settle_frames:
+                self.changing_since = now
+            self.ecam_hash = ecam_hash
+            self.ecam_empty = not any(text.strip() for text in texts)
+            self.changed_at = now
+            self.stable_frames = 0
+        else:
+            self.stable_frames += 1
+
+        if self.settled(now) and ecam_hash != self.reported_hash:
+            self.reported_hash = ecam_hash
+            return not self.ecam_empty
+        return False
+
+    def settled(self, now):
+        # the ECAM content did not change for settle_frames frames, or it keeps changing for longer than max_settle_s
+        return self.changed_at is not None and \
+            (self.stable_frames >= self.settle_frames or now - self.changing_since >= self.max_settle_s)
+
+    def alert_ready(self, now):
+        # a warning light is on and the ECAM messages that came up with it have settled. If the ECAM does not change
+        # (e.g. the messages were already displayed), the alert is ready max_settle_s after the light came on.
+        if self.warning_since is None or \
+                (not self.warning and now - self.warning_off_at > self.max_settle_s):
+            return False    # a flashing light counts as lit
+        if self.changed_at >= self.warning_since and self.settled(now):
+            return True
+        return now - self.warning_since >= self.max_settle_s
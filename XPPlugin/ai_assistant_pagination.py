@@ -0,0 +1,114 @@
+# Pagination of the answers in the plugin window. The text is laid out word by word with a greedy line wrap like
+# imgui.text_wrapped, and the width of every word is measured only once per font and then cached (the cache is cleared
+# when the font or its scale changes). While an answer is
+# streamed, the text only grows, so only the appended part is laid out; the last word may still be incomplete and is
+# laid out again with the next update. The whole text is only laid out again if the window size changes or the text was
+# replaced.
+# The width function is passed in, so the pagination also runs outside of X-Plane (see benchmark_pagination.py).
+
+
+class Paginator():
+    """
+    Parameters:
+    - measure: Function that returns the width of a single word (imgui.calc_text_size(word)[0] in the plugin).
+    - line_height: Height of a line of text.
+    - font: Any value that identifies the font and its scale, e.g. (id(font), imgui.get_font_size()).
+    """
+    def __init__(self, measure, line_height, font=None):
+        self.measure = measure
+        self.line_height = line_height
+        self.font = font
+        self.widths = {}    # word -> width, only valid for self.font
+        self.space_width = measure(" ")
+        self.reset(None, None)
+
+    def set_font(self, font, line_height):
+        # the cached widths and the layout only hold for one font, after a change the text has to be laid out again
+        if font != self.font:
+            self.font = font
+            self.line_height = line_height
+            self.widths = {}
+            self.space_width = self.measure(" ")
+            self.wrap_width = None  # needs_reflow is true until the next update
+
+    def reset(self, wrap_width, page_height):
+        self.text = ""
+        self.committed = 0  # length of the prefix of text that is laid out for good, it ends at a space or line break
+        self.wrap_width = wrap_width
+        self.page_height = page_height
+        self.max_lines = max(1, int(page_height // self.line_height)) if page_height else 1
+        self.pages = []     # text of the full pages
+        self.parts = []     # text of the current page
+        self.lines = 1  # lines on the current page
+        self.line_width = 0.0
+        self.line_empty = True
+
+    def width(self, word):
+        width = self.widths.get(word)
+        if width is None:
+            width = self.widths[word] = self.measure(word)
+        return width
+
+    def needs_reflow(self, wrap_width, page_height):
+        return wrap_width != self.wrap_width or page_height != self.page_height
+
+    def update(self, text, wrap_width, page_height):
+        """
+        Returns:
+        - pages: The text split into pages.
+        """
+        if self.needs_reflow(wrap_width, page_height) or not text.startswith(self.text[:self.committed]):
+            self.reset(wrap_width, page_height)
+        self.text = text
+
+        end = max(text.rfind(" "), text.rfind("\n")) + 1
+        if end > self.committed:
+            self.layout(text[self.committed:end])
+            self.committed = end
+
+        tail = text[self.committed:]
+        if not tail:
+            return self.pages + ["".join(self.parts)]
+        # the last word may still grow, lay it out on a copy of the state
+        state = (len(self.pages), list(self.parts), self.lines, self.line_width, self.line_empty)
+        self.layout(tail)
+        pages = self.pages + ["".join(self.parts)]
+        n_pages, self.parts, self.lines, self.line_width, self.line_empty = state
+        del self.pages[n_pages:]
+        return pages
+
+    def layout(self, text):
+        for i, paragraph in enumerate(text.split("\n")):
+            if i > 0:
+                self.new_line("\n")
+            for word in paragraph.split(" "):
+                if word:
+                    self.add_word(word)
+
+    def add_word(self, word):
+        width = self.width(word)
+        if self.line_empty:
+            self.parts.append(word)
+            self.line_width = width
+            self.line_empty = False
+            if width > self.wrap_width:     # imgui breaks words that are wider than a line
+                self.lines += int(width // self.wrap_width)
+        elif self.line_width + self.space_width + width <= self.wrap_width:
+            self.parts.append(" " + word)
+            self.line_width += self.space_width + width
+        else:
+            self.new_line(" ")
+            self.add_word(word)
+
+    def new_line(self, separator):
+        # " " for a wrapped line, "\n" for a line break in the text
+        if self.lines + 1 > self.max_lines:
+            self.pages.append("".join(self.parts))
+            self.parts = []
+            self.lines = 1
+        else:
+            if separator == "\n" or not self.line_empty:
+                self.parts.append(separator)
+            self.lines += 1
+        self.line_width = 0.0
+        self.line_empty = True
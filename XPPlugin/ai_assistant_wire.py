@@ -0,0 +1,211 @@
+# Compact binary wire format between the X-Plane plugin and the relay server. Instead of json with the full dataref
+# paths as keys, a frame packs the dataref values in the order of SCHEMA, so the position in the schema is the numeric
+# dataref id. Delta frames only carry the ids and values that differ from the last key frame of the same stream, which
+# keeps the frames of the high-rate telemetry small. Fields that are not in the schema (trigger source, follow-up message,
+# plugin id, ...) are appended as a short json object.
+# The relay keeps accepting the json messages of older plugins; a plugin only switches to the binary format after the
+# relay confirmed the hash of its schema during the arm handshake.
+# This file is shared by the relay server and the X-Plane plugin (copied there as ai_assistant_wire.py), keep both copies
+# identical.
+
+import hashlib
+import json
+import random
+import struct
+from collections import OrderedDict
+
+WIRE_VERSION = 1
+MAGIC = b"LW"   # json messages always start with "{"
+FRAME_KEY = 0
+FRAME_DELTA = 1
+KEY_FRAME_INTERVAL = 10     # frames between two key frames, a lost key frame costs at most this many frames
+MAX_STREAMS = 256   # key frames kept by a decoder
+
+ECAM_COLORS = ["w", "g", "b", "a", "r"]
+ECAM_LINES = [1, 2, 3, 4, 5, 6, 7]
+
+# value types: f float32, d float64 (the position, float32 is only accurate to metres there), i int32, s utf-8 string,
+# vf/vi arrays of float32/int32 (arrays are padded, their length varies)
+SCHEMA = [("master_warning", "i"),
+          ("master_caution", "i"),
+          ] + [(f"AirbusFBW/EWD{l}{c}Text", "s") for l in ECAM_LINES for c in ECAM_COLORS] + [
+          ("sim/flightmodel/position/latitude", "d"),
+          ("sim/flightmodel/position/longitude", "d"),
+          ("sim/flightmodel/position/elevation", "f"),
+          ("sim/flightmodel/position/y_agl", "f"),
+          ("sim/flightmodel/position/mag_psi", "f"),
+          ("toliss_airbus/pfdoutputs/captain/pitch_angle", "f"),
+          ("toliss_airbus/pfdoutputs/captain/roll_angle", "f"),
+          ("sim/flightmodel/position/alpha", "f"),
+          ("sim/flightmodel/position/beta", "f"),
+          ("sim/flightmodel/position/indicated_airspeed", "f"),
+          ("sim/flightmodel/position/groundspeed", "f"),
+          ("sim/flightmodel/position/vh_ind_fpm", "f"),
+          ("AirbusFBW/fmod/eng/N1Array", "vf"),    # array of N1
+          ("sim/flightmodel2/controls/flap1_deploy_ratio", "f"),
+          ("sim/flightmodel2/controls/flap2_deploy_ratio", "f"),
+          ("AirbusFBW/SlatPositionLWing", "f"),
+          ("AirbusFBW/SlatPositionRWing", "f"),
+          ("AirbusFBW/RightGearInd", "i"),
+          ("AirbusFBW/LeftGearInd", "i"),
+          ("AirbusFBW/NoseGearInd", "i"),
+          ("sim/flightmodel2/gear/on_ground", "vi"),   # array where [0] is nose gear, [1] is left gear, [2] is right gear
+          ("sim/flightmodel/weight/m_fuel_total", "f"),
+          ("toliss_airbus/fuelTankContent_kgs", "vf"),     # [0] center tank, [1]/[2] left/right inner tank, [3]/[4] left/right tip tank
+          ("AirbusFBW/AP1Engage", "i"),
+          ("AirbusFBW/AP2Engage", "i"),
+          ("AirbusFBW/ATHRmode", "i"),     # >0 indicates that athr is activated
+          ("sim/cockpit2/temperature/outside_air_temp_deg", "f"),
+          ("sim/cockpit2/gauges/indicators/wind_heading_deg_mag", "f"),
+          ("sim/cockpit2/gauges/indicators/wind_speed_kts", "f"),
+          ]
+
+# magic, version, frame kind, schema hash, stream id, key frame id, length of the json extras
+HEADER = struct.Struct("<2sBBIIHH")
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def schema_hash(schema=SCHEMA):
+    return int.from_bytes(hashlib.sha1(json.dumps(schema).encode('utf-8')).digest()[:4], "little")
+
+
+def is_binary(message):
+    return message[:2] == MAGIC
+
+
+def pack_value(kind, value, parts):
+    if kind == "f" or kind == "d":
+        parts.append(struct.pack(f"<{kind}", value))
+    elif kind == "i":
+        parts.append(struct.pack("<i", value))
+    elif kind == "s":
+        encoded = value.encode('utf-8')
+        parts.append(struct.pack("<H", len(encoded)))
+        parts.append(encoded)
+    else:
+        parts.append(struct.pack(f"<B{len(value)}{kind[1]}", len(value), *value))
+
+
+def unpack_value(kind, data, offset):
+    # returns the value and the offset behind it
+    if kind == "f" or kind == "i":
+        return struct.unpack_from(f"<{kind}", data, offset)[0], offset + 4
+    if kind == "d":
+        return struct.unpack_from("<d", data, offset)[0], offset + 8
+    if kind == "s":
+        (length,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+    (length,) = struct.unpack_from("<B", data, offset)
+    offset += 1
+    return list(struct.unpack_from(f"<{length}{kind[1]}", data, offset)), offset + 4 * length
+
+
+class WireEncoder():
+    """
+    Encodes messages of a single stream (a socket of the plugin) into key frames and delta frames.
+    Parameters:
+    - key_frame_interval: Every key_frame_interval-th frame is a key frame with all values. 1 sends only key frames,
+      which is what requests need, since the relay may have restarted between two of them.
+    """
+    def __init__(self, schema=SCHEMA, key_frame_interval=KEY_FRAME_INTERVAL):
+        self.schema = schema
+        self.ids = {name: i for i, (name, _) in enumerate(schema)}
+        self.hash = schema_hash(schema)
+        self.key_frame_interval = key_frame_interval
+        self.stream_id = random.getrandbits(32)
+        self.key_frame_id = 0
+        self.key_values = None  # values of the last key frame, by dataref id, None for the ones it did not contain
+        self.frames_since_key = 0
+
+    def encode(self, message):
+        """
+        Parameters:
+        - message: Dict like the json messages, with the dataref paths as keys.
+        Returns:
+        - frame: The encoded frame.
+        """
+        values = [message.get(name) for name, _ in self.schema]
+        extras = json.dumps({k: v for k, v in message.items() if k not in self.ids}).encode('utf-8')
+        parts = []
+        # a delta needs a key frame with the same datarefs, e.g. telemetry only contains the flight data
+        if self.key_values is None or self.frames_since_key + 1 >= self.key_frame_interval \
+                or [v is None for v in values] != [v is None for v in self.key_values]:
+            kind = FRAME_KEY
+            self.key_frame_id = (self.key_frame_id + 1) % 65536
+            self.key_values = values
+            self.frames_since_key = 0
+            if None in values:
+                parts.append(struct.pack("<H", sum(v is not None for v in values)))
+                for i, ((_, value_kind), value) in enumerate(zip(self.schema, values)):
+                    if value is not None:
+                        parts.append(struct.pack("<H", i))
+                        pack_value(value_kind, value, parts)
+            else:
+                parts.append(struct.pack("<H", 0xFFFF))     # all values follow in schema order
+                for (_, value_kind), value in zip(self.schema, values):
+                    pack_value(value_kind, value, parts)
+        else:
+            kind = FRAME_DELTA
+            self.frames_since_key += 1
+            changed = [i for i, (value, key_value) in enumerate(zip(values, self.key_values)) if value != key_value]
+            parts.append(struct.pack("<H", len(changed)))
+            for i in changed:
+                parts.append(struct.pack("<H", i))
+                pack_value(self.schema[i][1], values[i], parts)
+        header = HEADER.pack(MAGIC, WIRE_VERSION, kind, self.hash, self.stream_id, self.key_frame_id, len(extras))
+        return b"".join([header, extras] + parts)
+
+
+class WireDecoder():
+    """
+    Decodes frames of any number of streams back into the dicts the json messages would have been. Keeps the last
+    key frame of up to max_streams streams.
+    """
+    def __init__(self, schema=SCHEMA, max_streams=MAX_STREAMS):
+        self.schema = schema
+        self.hash = schema_hash(schema)
+        self.max_streams = max_streams
+        self.key_frames = OrderedDict()    # stream id -> (key frame id, values by dataref name)
+
+    def decode(self, data):
+        if len(data) < HEADER.size:
+            raise WireFormatError("frame shorter than its header")
+        magic, version, kind, hash_, stream_id, key_frame_id, extras_length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != WIRE_VERSION:
+            raise WireFormatError(f"unsupported wire format version {version}")
+        if hash_ != self.hash:
+            raise WireFormatError(f"unknown schema {hash_:08x}")
+        offset = HEADER.size
+        try:
+            message = json.loads(bytes(data[offset:offset + extras_length]).decode('utf-8'))
+            if not isinstance(message, dict):
+                raise WireFormatError(f"extras are a json {type(message).__name__}, not an object")
+            offset += extras_length
+            (count,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            values = {}
+            if count == 0xFFFF:
+                for name, value_kind in self.schema:
+                    values[name], offset = unpack_value(value_kind, data, offset)
+            else:
+                for _ in range(count):
+                    (i,) = struct.unpack_from("<H", data, offset)
+                    name, value_kind = self.schema[i]
+                    values[name], offset = unpack_value(value_kind, data, offset + 2)
+        except (struct.error, IndexError, UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise WireFormatError(f"truncated or corrupt frame: {str(e)}")
+
+        if kind == FRAME_KEY:
+            self.key_frames[stream_id] = (key_frame_id, values)
+            self.key_frames.move_to_end(stream_id)
+            if len(self.key_frames) > self.max_streams:
+                self.key_frames.popitem(last=False)
+            return message | values
+        key_frame = self.key_frames.get(stream_id)
+        if key_frame is None or key_frame[0] != key_frame_id:
+            raise WireFormatError(f"delta frame of stream {stream_id:08x} without its key frame")
+        return message | key_frame[1] | values
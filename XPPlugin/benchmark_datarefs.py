@@ -0,0 +1,83 @@
+# Headless benchmark of the dataref reads of the plugin. Runs outside of X-Plane with a stand-in for the XPPython3 xp
+# module that serves the flight data of the relay's mock_xp_plugin.py, so it measures the Python side of a snapshot:
+# the previous read_datarefs (looking up every handle on every call, new lists for the arrays) against the
+# DatarefRegistry. In X-Plane, the cost of the calls into the sim comes on top; the plugin prints the measured snapshot
+# times when it is stopped.
+# Usage: python3 benchmark_datarefs.py [--snapshots 10000]
+
+import argparse
+import os
+import sys
+import time
+from ai_assistant_datarefs import DatarefRegistry, DATAREF_PATHS
+from ai_assistant_wire import SCHEMA
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RelayServer"))
+from mock_xp_plugin import DATA  # noqa: E402
+
+
+class FakeXP():
+    def __init__(self, data):
+        names = {path: name for name, path in DATAREF_PATHS.items()}
+        self.refs = {path: ref for ref, path in enumerate(list(data) + list(names))}
+        self.by_ref = {ref: data.get(names.get(path, path)) for path, ref in self.refs.items()}
+
+    def findDataRef(self, path):
+        return self.refs.get(path)
+
+    def getDataf(self, ref):
+        return self.by_ref[ref]
+
+    getDatad = getDataf
+    getDatai = getDataf
+    getDatas = getDataf
+
+    def getDatavf(self, ref, values=None, offset=0, count=-1):
+        data = self.by_ref[ref]
+        if values is None:
+            return len(data)
+        values[:] = data[offset:offset + count if count >= 0 else None]
+        return len(values)
+
+    getDatavi = getDatavf
+
+
+def previous_read_datarefs(xp):
+    # the lookups and reads of the previous read_datarefs
+    def getv(get, ref):
+        values = []
+        get(ref, values)
+        return values
+    snapshot = {}
+    for name, kind in SCHEMA:
+        ref = xp.findDataRef(DATAREF_PATHS.get(name, name))
+        if kind in ("vf", "vi"):
+            snapshot[name] = getv(xp.getDatavf if kind == "vf" else xp.getDatavi, ref)
+        else:
+            snapshot[name] = {"f": xp.getDataf, "d": xp.getDatad, "i": xp.getDatai, "s": xp.getDatas}[kind](ref)
+    return snapshot
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Headless benchmark of the dataref snapshots of the plugin")
+    parser.add_argument("--snapshots", type=int, default=10000, help="number of snapshots")
+    args = parser.parse_args()
+
+    xp = FakeXP(DATA)
+    registry = DatarefRegistry(xp)
+    assert registry.snapshot() == previous_read_datarefs(xp), "snapshots differ"
+
+    t_start = time.perf_counter()
+    for _ in range(args.snapshots):
+        previous_read_datarefs(xp)
+    t_previous = (time.perf_counter() - t_start) / args.snapshots
+    registry.timings = {}
+    for _ in range(args.snapshots):
+        registry.snapshot()
+        registry.snapshot("flight")
+    print(f"previous read_datarefs: {t_previous * 1e6:.1f} us per snapshot")
+    print(f"DatarefRegistry: {registry.timing_summary()}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,94 @@
+# Headless benchmark of the alert detection of the plugin. Runs outside of X-Plane with a fake dataref source: a failure
+# lights the Master Warning (steady or flashing) and its ECAM messages appear line by line over the following frames. Compares the time from
+# the warning light to the sent alert, and whether the alert contained all ECAM messages, of the previous detection
+# (polling thread every 0.5 s, then the alert is sent 0.5 s later) and of the EcamWatcher, which is updated every frame.
+# Usage: python3 benchmark_ecam.py [--fps 30] [--runs 200] [--settle-frames 5]
+
+import argparse
+import random
+from ai_assistant_ecam import EcamWatcher
+
+LINES = ["ENG 2 FIRE", "- THR LEVER 2.....IDLE", "- ENG MASTER 2.....OFF", "- ENG 2 FIRE P/B.....PUSH",
+         "- AGENT 1 AFTER 10 S.....DISCH"]
+POLL_INTERVAL_S = 0.5
+CALL_DELAY_S = 0.5
+
+
+class FakeSource():
+    """
+    Parameters:
+    - warning_at: Time at which the Master Warning lights up.
+    - line_delays: Delay of every ECAM line after the warning.
+    - flashing: The Master Warning flashes, on and off for 0.4 s each.
+    """
+    def __init__(self, warning_at, line_delays, flashing=False):
+        self.warning_at = warning_at
+        self.line_delays = line_delays
+        self.flashing = flashing
+        self.now = 0.0
+
+    def read_warnings(self):
+        lit = self.now >= self.warning_at
+        if self.flashing and lit and int((self.now - self.warning_at) / 0.4) % 2:
+            lit = False
+        return {"master_warning": int(lit), "master_caution": 0}
+
+    def read_ecam(self):
+        return [text if self.now >= self.warning_at + delay else "" for text, delay in zip(LINES, self.line_delays)]
+
+    def complete(self):
+        return all(self.read_ecam()[1:]) and self.now >= self.warning_at + max(self.line_delays)
+
+
+def run_previous(source, fps, phase):
+    # polling thread: the lights are checked every 0.5 s, the alert reads the ECAM messages 0.5 s after that
+    t = phase
+    while not source.read_warnings()["master_warning"]:
+        t += POLL_INTERVAL_S
+        source.now = t
+    source.now = t + CALL_DELAY_S
+    return source.now - source.warning_at, source.complete()
+
+
+def run_watcher(source, fps, settle_frames):
+    watcher = EcamWatcher(source.read_warnings, source.read_ecam, settle_frames=settle_frames)
+    frame = 0
+    while True:
+        source.now = frame / fps
+        watcher.update(source.now)
+        if watcher.alert_ready(source.now):
+            return source.now - source.warning_at, source.complete()
+        frame += 1
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Headless benchmark of the alert detection")
+    parser.add_argument("--fps", type=float, default=30, help="frame rate of the sim")
+    parser.add_argument("--runs", type=int, default=200, help="number of simulated failures")
+    parser.add_argument("--settle-frames", type=int, default=5, help="frames the ECAM messages have to stay the same")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for flashing in [False, True]:
+        results = {"previous": [], "EcamWatcher": []}
+        for _ in range(args.runs):
+            warning_at = 2.0 + rng.random()
+            # the messages follow the warning light within a few hundred ms, the lines within a few frames
+            first = rng.uniform(0.0, 0.3)
+            line_delays = [first]
+            for _ in LINES[1:]:
+                line_delays.append(line_delays[-1] + rng.randint(0, 2) / args.fps)
+            phase = rng.random() * POLL_INTERVAL_S
+            results["previous"].append(run_previous(FakeSource(warning_at, line_delays, flashing), args.fps, phase))
+            results["EcamWatcher"].append(run_watcher(FakeSource(warning_at, line_delays, flashing), args.fps,
+                                                      args.settle_frames))
+        print("Flashing Master Warning" if flashing else "Steady Master Warning")
+        for name, runs in results.items():
+            latencies = sorted(latency for latency, _ in runs)
+            complete = sum(c for _, c in runs)
+            print(f"  {name:<12} warning to alert: mean {sum(latencies) / len(latencies) * 1000:6.0f} ms, "
+                  f"max {latencies[-1] * 1000:6.0f} ms, all ECAM messages in {complete}/{len(runs)} alerts")
+
+
+if __name__ == "__main__":
+    main_benchmark()
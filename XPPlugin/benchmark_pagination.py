@@ -0,0 +1,114 @@
+# Headless benchmark of the answer pagination of the plugin. Runs outside of X-Plane: the text width is a stub with a
+# fixed width per character instead of imgui.calc_text_size. A long answer is streamed in small chunks like the relay
+# sends them, and after every chunk the text is paginated with the previous implementation (re-measuring a growing
+# prefix for every word) and with the Paginator of ai_assistant_pagination.py. The page breaks of both are compared.
+# Usage: python3 benchmark_pagination.py [--words 600] [--chunk-words 3]
+
+import argparse
+import random
+import time
+from ai_assistant_pagination import Paginator
+
+CHAR_WIDTH = 9.0    # roughly tahomabd at size 20
+LINE_HEIGHT = 20.0
+WRAP_WIDTH = 600.0
+PAGE_HEIGHT = 600 * 0.7
+VOCABULARY = ["ENG", "2", "FIRE", "THR", "LEVER", "IDLE", "MASTER", "OFF", "AGENT", "DISCH", "after", "10", "s", "LAND",
+              "ASAP", "at", "KMIA", "runway", "weather", "single", "engine", "approach", "consider", "diversion", "to",
+              "the", "nearest", "suitable", "airport", "with", "longest", "justification:", "fuel", "imbalance"]
+
+calls = 0
+
+
+def measure(text):
+    global calls
+    calls += 1
+    return len(text) * CHAR_WIDTH
+
+
+def calc_text_size(text, wrap_width):
+    # stub of imgui.calc_text_size with the same greedy word wrap
+    lines = 0
+    for paragraph in text.split("\n"):
+        lines += 1
+        width = 0.0
+        for word in paragraph.split(" "):
+            if not word:
+                continue
+            w = measure(word)
+            if width > 0 and width + CHAR_WIDTH + w > wrap_width:
+                lines += 1
+                width = w
+            else:
+                width = width + CHAR_WIDTH + w if width > 0 else w
+    return wrap_width, lines * LINE_HEIGHT
+
+
+def paginate_text(text, wrap_width, page_height):
+    # the previous implementation of PythonInterface.paginate_text
+    words = text.split(' ')
+    current_page = []
+    pages = []
+    current_text = ""
+    for word in words:
+        test_text = current_text + (" " if current_text else "") + word
+        text_size = calc_text_size(test_text, wrap_width=wrap_width)
+        if text_size[1] > page_height:
+            pages.append(" ".join(current_page))
+            current_text = word
+            current_page = [word]
+        else:
+            current_page.append(word)
+            current_text = test_text
+    if current_page:
+        pages.append(" ".join(current_page))
+    return pages
+
+
+def stream(words, chunk_words, seed=0):
+    rng = random.Random(seed)
+    text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+    chunks = []
+    i = 0
+    while i < len(text):
+        # chunks end in the middle of words, like LLM tokens
+        n = rng.randint(1, chunk_words * 8)
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+
+def main_benchmark():
+    global calls
+    parser = argparse.ArgumentParser(description="Headless benchmark of the answer pagination")
+    parser.add_argument("--words", type=int, default=600, help="length of the answer")
+    parser.add_argument("--chunk-words", type=int, default=3, help="average words per streamed chunk")
+    args = parser.parse_args()
+
+    chunks = stream(args.words, args.chunk_words)
+    results = {}
+    for name in ["previous", "Paginator"]:
+        paginator = Paginator(measure, LINE_HEIGHT)
+        calls = 0
+        text = ""
+        t_start = time.perf_counter()
+        for chunk in chunks:
+            text += chunk
+            if name == "previous":
+                pages = paginate_text(text, WRAP_WIDTH, PAGE_HEIGHT)
+            else:
+                pages = paginator.update(text, WRAP_WIDTH, PAGE_HEIGHT)
+        t_total = time.perf_counter() - t_start
+        t_resize = time.perf_counter()
+        if name == "Paginator":
+            paginator.update(text, WRAP_WIDTH * 0.8, PAGE_HEIGHT)
+        t_resize = time.perf_counter() - t_resize
+        results[name] = pages
+        print(f"{name:<10} {len(chunks)} updates in {t_total * 1000:9.1f} ms ({t_total / len(chunks) * 1e6:8.1f} us per update), "
+              f"{calls} width measurements, {len(pages)} pages" + (f", reflow after resize {t_resize * 1000:.2f} ms" if name == "Paginator" else ""))
+    same = [p.split() for p in results["previous"]] == [p.split() for p in results["Paginator"]]
+    print(f"Page breaks {'identical' if same else 'differ'}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
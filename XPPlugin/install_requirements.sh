@@ -13,3 +13,6 @@ TARGET_DIR="$PYTHON_EXEC_DIR/../../../../PythonPlugins"
 
 # Copy the PI_AI_Assistant file into the appropriate directory
 cp ./PI_AI_Assistant.py "$TARGET_DIR/PI_AI_Assistant.py"
+
+# helper modules of the plugin, they are not plugins themselves and therefore do not follow the PI_ naming convention
+cp ./ai_assistant_*.py "$TARGET_DIR/"